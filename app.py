@@ -1,26 +1,106 @@
-from collections import defaultdict
+import time
 from contextlib import asynccontextmanager
+from typing import Iterable, List, Optional
 
-from fastapi import FastAPI, File, Header, HTTPException, Path, UploadFile, Depends
-from fastapi.responses import FileResponse, Response
-from fastapi.staticfiles import StaticFiles
-from sqlalchemy import func, select, delete
+from fastapi import (FastAPI, File, Header, HTTPException, Path, Query, Request,
+                     UploadFile, Depends, WebSocket, WebSocketDisconnect)
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import delete, select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import (Base, Follow, Like, Media, Tweet, Users, engine,
-                      get_user_by_api_key, session, TweetIN, get_session)
+from database import (check_schema_version, Follow, Media, Tweet, Users, engine,
+                      replica_engine, read_router, get_read_session,
+                      get_user_by_api_key, api_key_cache, TweetIN, get_session,
+                      AuthorPayload, TweetPayload,
+                      get_feed_page, get_timeline_page, search_tweets, get_profile,
+                      add_to_author_timeline, get_feed_audience,
+                      remove_tweet_from_timelines, remove_followee_from_timeline,
+                      job_queue, like_buffer, add_media, attach_media, detach_media,
+                      get_media_variant, get_unprocessed_object,
+                      get_media_stats, TweetsBatchIN, LikesBatchIN, FollowsBatchIN,
+                      create_tweets_batch, like_tweets_batch, follow_users_batch)
+from database.routing import SAFE_METHODS
+from database.export import EXPORT_TABLES, export_ndjson, gzip_stream
+from services import (IMMUTABLE_CACHE_CONTROL, INLINE_MIME_TYPES, http_date,
+                      is_not_modified, media_storage,
+                      instrument_engine, metrics_registry, server_timing,
+                      start_request_metrics, response_cache, FastJSONResponse,
+                      json_dumps, image_pipeline, event_broker, HEARTBEAT, Subscription)
+from services.static import PrecompressedStaticFiles
+
+# Пространство имён кэша страниц ленты; у каждого читателя своя версия, её поднимают
+# записи, меняющие его ленту. Число лайков чужих твитов устаревает не дольше TTL кэша.
+FEED_CACHE = "feed"
+
+# Через сколько миллисекунд EventSource переподключается после обрыва
+EVENTS_RETRY_MS = 3000
+
+# Поля stats() компонентов, которые только растут: в /metrics это counter, остальные — gauge
+MONOTONIC_STATS = frozenset((
+    "hits", "misses", "processed", "retried", "failed", "events", "written", "flushes",
+    "primary_reads", "replica_reads", "published", "delivered", "dropped",
+))
+
+templates_files = PrecompressedStaticFiles(directory="templates")
+
+
+async def publish_tweet_created(user, tweets: Iterable[tuple]) -> None:
+    """События tweet.created по парам (id твита, TweetIN) в форме элемента ленты."""
+    for tweet_id, tweet in tweets:
+        attachments = [f"/api/medias/{media_id}" for media_id in tweet.tweet_media_ids or ()]
+        payload = TweetPayload(
+            tweet_id, tweet.tweet_data, attachments or None, AuthorPayload(user.id, user.name), []
+        )
+        await event_broker.publish(user.id, {"type": "tweet.created", "tweet": payload})
+
+
+async def publish_like_counts(tweet_ids: List[int]) -> None:
+    """События tweet.likes с записанным в базу числом лайков."""
+    async with like_buffer.session_maker() as session:
+        rows = (await session.execute(
+            select(Tweet.id, Tweet.user_id, Tweet.like_count).where(Tweet.id.in_(tweet_ids))
+        )).all()
+    for row in rows:
+        await event_broker.publish(
+            row.user_id, {"type": "tweet.likes", "tweet_id": row.id, "likes_count": row.like_count}
+        )
+
+
+def feed_cache(user_id: int) -> str:
+    return f"{FEED_CACHE}:{user_id}"
+
+
+async def bump_feeds(user_ids: Iterable[int]) -> None:
+    await response_cache.bump(*(feed_cache(user_id) for user_id in user_ids))
 
 
+async def on_likes_flushed(tweet_ids: List[int], user_ids: List[int]) -> None:
+    # свои лайки пользователь видит сразу, остальные читатели — по истечении TTL
+    await bump_feeds(user_ids)
+    await publish_like_counts(tweet_ids)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # схема создаётся и обновляется миграциями (alembic upgrade head), здесь только проверка версии
+    await check_schema_version(engine)
+    await event_broker.start()
+    job_queue.start()
+    # лайки пишутся в базу пакетами, каждая запись меняет ленты
+    like_buffer.on_flush = on_likes_flushed
+    like_buffer.start()
     yield
-    await session.close()
+    await like_buffer.stop()
+    # открытые потоки событий завершаются, клиенты переподключатся к другому процессу
+    await event_broker.stop()
+    # воркеры больше не берут задачи и дорабатывают взятые не дольше JOB_DRAIN_TIMEOUT
+    await job_queue.stop()
+    # изображения, уже поставленные в обработку, дописываются до закрытия движка
+    await image_pipeline.shutdown()
     await engine.dispose()
+    if replica_engine is not engine:
+        await replica_engine.dispose()
 
 
 app = FastAPI(
@@ -30,15 +110,49 @@ app = FastAPI(
     version="1.0.0",
 )
 
+instrument_engine(engine)
+if replica_engine is not engine:
+    instrument_engine(replica_engine)
+
+
+@app.middleware("http")
+async def sql_metrics(request: Request, call_next):
+    """Число SQL-запросов, время в базе и время обработки запроса:
+    в заголовке Server-Timing и в агрегированных метриках /metrics."""
+    metrics = start_request_metrics()
+    started = time.perf_counter()
+    response = await call_next(request)
+    duration = time.perf_counter() - started
+
+    route = request.scope.get("route")
+    metrics_registry.observe_request(
+        request.method, getattr(route, "path", "unmatched"),
+        response.status_code, duration, metrics,
+    )
+    response.headers["Server-Timing"] = server_timing(metrics, duration)
+    return response
+
+
+@app.middleware("http")
+async def read_after_write(request: Request, call_next):
+    """После записи пользователь REPLICA_LAG_WINDOW секунд читает из основной базы."""
+    response = await call_next(request)
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        read_router.mark_write(request.headers.get("api-key"))
+    return response
+
 @app.get(
     "/",
     summary="Главная страница",
-    description="Возвращает HTML-страницу с клиентским интерфейсом приложения.",
+    description=(
+        "Возвращает HTML-страницу с клиентским интерфейсом приложения. Страница "
+        "перепроверяется по ETag (304 без изменений) и отдаётся сжатой, если есть вариант."
+    ),
     tags=["Frontend"],
     response_description="HTML страница главного интерфейса",
 ) #11
-async def root():
-    return FileResponse("templates/index.html")
+async def root(request: Request):
+    return await templates_files.get_response("index.html", request.scope)
 
 
 
@@ -49,7 +163,9 @@ async def root():
     summary="Создать твит",
     description=(
         "Создает новый твит от имени авторизованного пользователя. "
-        "Тело запроса содержит текст твита и, при необходимости, список ID медиа-файлов."
+        "Тело запроса содержит текст твита и, при необходимости, список ID медиа-файлов. "
+        "Прикрепить можно только свои медиа или загруженные без api-key; такое медиа "
+        "становится медиа пользователя. Каждое медиа прикрепляется только к одному твиту."
     ),
     tags=["Tweets"],
     response_description="Результат создания твита и его идентификатор",
@@ -58,6 +174,7 @@ async def root():
 async def create_tweet(
     tweet: TweetIN,
     api_key: str = Header(...),
+    session: AsyncSession = Depends(get_session),
 ):
 
     user = await get_user_by_api_key(api_key=api_key, session=session)
@@ -65,52 +182,165 @@ async def create_tweet(
     new_post = Tweet(
         user_id=user.id,
         tweet_data=tweet.tweet_data,  # ✅ Доступ через .
-        tweet_media_ids=tweet.tweet_media_ids,  # ✅ Доступ через .
     )
 
     session.add(new_post)
+    await session.flush()
+    if tweet.tweet_media_ids:
+        await attach_media(session, user.id, {new_post.id: tweet.tweet_media_ids})
+    await add_to_author_timeline(session, [new_post.id], user.id)
+    await job_queue.enqueue(
+        "timeline.fan_out", {"tweet_ids": [new_post.id], "author_id": user.id},
+        session=session,
+    )
     await session.commit()
-    await session.refresh(new_post)
+    await bump_feeds(await get_feed_audience(session, user.id))
+    await publish_tweet_created(user, [(new_post.id, tweet)])
     return {"result": True, "tweet_id": new_post.id}
 
 
+@app.post(
+    "/api/tweets:batch",
+    summary="Создать несколько твитов",
+    description=(
+        "Создает пачку твитов от имени авторизованного пользователя одним запросом к базе. "
+        "Возвращает ID твитов в порядке запроса."
+    ),
+    tags=["Tweets"],
+    response_description="Результат для каждого твита",
+    status_code=201,
+)
+async def create_tweets_batch_endpoint(
+    batch: TweetsBatchIN,
+    api_key: str = Header(...),
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    user = await get_user_by_api_key(api_key, session)
+    results = await create_tweets_batch(session, user.id, batch.tweets)
+    await session.commit()
+    await bump_feeds(await get_feed_audience(session, user.id))
+    await publish_tweet_created(
+        user, [(result["tweet_id"], tweet) for result, tweet in zip(results, batch.tweets)]
+    )
+    return {"result": True, "results": results}
+
+
+@app.get(
+    "/api/medias/stats",
+    summary="Статистика дедупликации медиа",
+    description=(
+        "Возвращает число загрузок и уникальных объектов в хранилище, "
+        "коэффициент дедупликации и сэкономленный объём."
+    ),
+    tags=["Media"],
+    response_description="Статистика хранилища медиа",
+)
+async def get_media_storage_stats(session: AsyncSession = Depends(get_session)) -> dict:
+    return {"result": True, "stats": await get_media_stats(session)}
+
+
 @app.get(
     "/api/medias/{media_id}",
     summary="Получить медиа-файл",
-    description="Возвращает бинарное содержимое медиа-файла по его ID.",
+    description=(
+        "Возвращает содержимое медиа-файла по его ID, поддерживает запросы Range. "
+        "С параметром size для изображения отдаётся ближайший по ширине уменьшенный вариант "
+        "без метаданных; пока варианты не готовы, отдаётся оригинал без долгого кэширования. "
+        "Без size отдаётся оригинал как загружен, вместе с EXIF (в том числе GPS): "
+        "клиентам, которым метаданные не нужны, следует запрашивать вариант. "
+        "Ответ кэшируется клиентом навсегда, повторный запрос с If-None-Match получает 304. "
+        "Файлы, кроме изображений и видео, отдаются только как вложение (Content-Disposition)."
+    ),
     tags=["Media"],
     response_description="Бинарные данные медиа-файла",
 )
-async def get_media(media_id: int):
-    media = await session.get(Media, media_id)
-    return Response(
-        content=media.file,  # bytes из LargeBinary
-        media_type="image/jpeg"  # или media.mime_type
+async def get_media(
+    request: Request,
+    media_id: int,
+    size: Optional[int] = Query(None, ge=1, description="Желаемая ширина изображения в пикселях"),
+    session: AsyncSession = Depends(get_read_session),
+    primary: AsyncSession = Depends(get_session),
+):
+    query = (
+        select(Media.path, Media.mime_type, Media.sha256, Media.created_at)
+        .where(Media.id == media_id)
     )
+    media = (await session.execute(query)).one_or_none()
+    if not media and read_router.enabled:
+        # медиа запрашивают сразу после загрузки и без api-key: реплика могла не успеть
+        session = primary
+        media = (await session.execute(query)).one_or_none()
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+    path, mime_type = media.path, media.mime_type
+    headers = {
+        "ETag": f'"{media.sha256}"',
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "X-Content-Type-Options": "nosniff",
+    }
+    if mime_type not in INLINE_MIME_TYPES:
+        # в том числе старые записи с типом, который заявил клиент
+        headers["Content-Disposition"] = "attachment"
+    if size is not None:
+        variant = await get_media_variant(session, media.sha256, size)
+        if variant is not None:
+            path, mime_type = variant.path, variant.mime_type
+            headers["ETag"] = f'"{media.sha256}-{variant.width}"'
+        else:
+            # вариант может появиться позже, поэтому оригинал по этому адресу перепроверяется
+            headers["Cache-Control"] = "no-cache"
+    if media.created_at is not None:
+        headers["Last-Modified"] = http_date(media.created_at)
+    if is_not_modified(request.headers, headers["ETag"], media.created_at):
+        return Response(status_code=304, headers=headers)
+    return media_storage.response(path, mime_type, headers=headers)
 
 
 
 @app.post(
     "/api/medias",
     summary="Загрузить медиа-файл",
-    description="Принимает файл и сохраняет его в базе как медиа-объект.",
+    description=(
+        "Принимает файл и сохраняет его в хранилище медиа. Если такое содержимое уже "
+        "загружалось, новый медиа-объект ссылается на существующий файл. Тип определяется "
+        "по сигнатуре содержимого, нераспознанный сохраняется как application/octet-stream. "
+        "С заголовком api-key медиа закрепляется за пользователем. Уменьшенные варианты "
+        "изображения создаются фоновой задачей после ответа и повторяются при ошибке."
+    ),
     tags=["Media"],
     response_description="Результат операции и ID загруженного медиа-файла",
     status_code=201,
 )
-async def upload_media(file: UploadFile = File(...), session: AsyncSession = Depends(get_session)):
-    print(file)
-    content = await file.read()
-    media = Media(file=content)
-    session.add(media)
-    await session.flush()
-    return {"result": True, "media_id": media.id}
+async def upload_media(
+    file: UploadFile = File(...),
+    api_key: Optional[str] = Header(None, description="API ключ; медиа становится собственностью пользователя"),
+    session: AsyncSession = Depends(get_session),
+):
+    owner_id = (await get_user_by_api_key(api_key, session)).id if api_key else None
+    stored = await media_storage.save(file.file)
+    # заявленному клиентом типу не верим: text/html с нашего домена — это XSS
+    mime_type = stored.mime_type or "application/octet-stream"
+    media, deduplicated = await add_media(session, stored, mime_type, owner_id)
+    if not await media_storage.exists(stored.path):
+        # строка содержимого теперь заблокирована до commit, но purge_media_object
+        # мог удалить файл между его сохранением и захватом строки
+        file.file.seek(0)
+        await media_storage.save(file.file)
+    # повторная загрузка тоже ставит обработку, если варианты не были созданы
+    if image_pipeline.accepts(mime_type) and await get_unprocessed_object(session, stored.sha256):
+        await job_queue.enqueue("media.variants", {"sha256": stored.sha256}, session=session)
+    await session.commit()
+    return {"result": True, "media_id": media.id, "deduplicated": deduplicated}
 
 
 @app.delete(
     "/api/tweets/{tweet_id}",
     summary="Удалить твит",
-    description="Удаляет твит по его ID, если пользователь авторизован и является владельцем твита.",
+    description=(
+        "Удаляет твит по его ID, если пользователь авторизован и является владельцем твита. "
+        "Медиа твита освобождаются фоновой задачей после ответа."
+    ),
     tags=["Tweets"],
     response_description="Результат удаления",
     status_code=200,
@@ -118,6 +348,7 @@ async def upload_media(file: UploadFile = File(...), session: AsyncSession = Dep
 async def delete_tweet(
     tweet_id: int = Path(..., title="ID твита для удаления"),
     api_key: str = Header(..., description="API ключ авторизованного пользователя"),
+    session: AsyncSession = Depends(get_session),
 ) -> dict:
 
 
@@ -134,19 +365,25 @@ async def delete_tweet(
     if not tweet:
         raise HTTPException(status_code=404, detail="Tweet not found")
 
-    if tweet.tweet_media_ids:
-        await session.execute(
-            delete(Media).where(Media.id.in_(tweet.tweet_media_ids))
-        )
+    media_ids = await detach_media(session, tweet.id)
+    if media_ids:
+        # без ключа идемпотентности: id удалённого твита может достаться новому
+        await job_queue.enqueue("media.release", {"media_ids": media_ids}, session=session)
+    await remove_tweet_from_timelines(session, tweet.id)
     await session.delete(tweet)
     await session.commit()
+    await bump_feeds(await get_feed_audience(session, user.id))
+    await event_broker.publish(user.id, {"type": "tweet.deleted", "tweet_id": tweet_id})
     return {"result": True}
 
 
 @app.post(
     "/api/tweets/{tweet_id}/likes",
     summary="Поставить лайк твиту",
-    description="Добавляет лайк к твиту от авторизованного пользователя.",
+    description=(
+        "Добавляет лайк к твиту от авторизованного пользователя. Лайк записывается в базу "
+        "пакетом вместе с другими в течение LIKE_FLUSH_INTERVAL; сам пользователь видит его сразу."
+    ),
     tags=["Tweets"],
     response_description="Результат операции",
     status_code=200
@@ -154,18 +391,17 @@ async def delete_tweet(
 async def like_tweet(
     api_key: str = Header(..., description="API ключ авторизованного пользователя"),
     tweet_id: int = Path(..., title="ID твита для лайка"),
+    session: AsyncSession = Depends(get_session),
 ) -> dict:
 
 
-    await get_user_by_api_key(api_key, session)
-    tweet = (
-        await session.execute(select(Tweet).where(Tweet.id==tweet_id))
-    ).scalar_one_or_none()
-    if not tweet:
-        raise HTTPException(status_code=404, detail="Tweet not found")
+    user = await get_user_by_api_key(api_key, session)
 
-    # session.add(Like(user_id=user.id, tweet_id=tweet_id))
-    # await session.commit()
+    recorded = await like_buffer.record_persisted(user.id, tweet_id, True)
+    if recorded is None:
+        raise HTTPException(status_code=404, detail="Tweet not found")
+    if not recorded:
+        raise HTTPException(status_code=409, detail="You already liked this tweet")
 
     return {"result": True}
 
@@ -173,7 +409,9 @@ async def like_tweet(
 @app.delete(
     "/api/tweets/{tweet_id}/likes",
     summary="Удалить лайк твита",
-    description="Удаляет лайк пользователя с указанного твита.",
+    description=(
+        "Удаляет лайк пользователя с указанного твита. Как и лайк, записывается в базу пакетом."
+    ),
     tags=["Tweets"],
     response_description="Результат операции",
     status_code=200,
@@ -181,22 +419,43 @@ async def like_tweet(
 async def delete_like_tweet(
     api_key: str = Header(..., description="API ключ авторизованного пользователя"),
     tweet_id: int = Path(..., title="ID твита для удаления лайка"),
+    session: AsyncSession = Depends(get_session),
 ) -> dict:
     user = await get_user_by_api_key(api_key, session)
-    like = (
-        await session.execute(
-            select(Like).where((tweet_id == Like.tweet_id) & (Like.user_id == user.id))
-        )
-    ).scalar_one_or_none()
-    if not like:
+    if not await like_buffer.record_persisted(user.id, tweet_id, False):
         raise HTTPException(status_code=404, detail="Like not found")
 
-    await session.delete(like)
-    await session.commit()
-
     return {"result": True}
 
 
+@app.post(
+    "/api/likes:batch",
+    summary="Поставить лайки нескольким твитам",
+    description=(
+        "Добавляет лайки пачке твитов. Повторный лайк не является ошибкой: "
+        "для каждого твита возвращается created, exists или not_found."
+    ),
+    tags=["Tweets"],
+    response_description="Результат для каждого твита",
+    status_code=200,
+)
+async def like_tweets_batch_endpoint(
+    batch: LikesBatchIN,
+    api_key: str = Header(..., description="API ключ авторизованного пользователя"),
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    user = await get_user_by_api_key(api_key, session)
+    # незаписанные лайки из буфера пишутся раньше пакета, чтобы сохранить порядок
+    await like_buffer.sync_user(user.id)
+    results = await like_tweets_batch(session, user.id, batch.tweet_ids)
+    await session.commit()
+    await bump_feeds([user.id])
+    created = [result["tweet_id"] for result in results if result["result"] == "created"]
+    if created:
+        await publish_like_counts(created)
+    return {"result": True, "results": results}
+
+
 @app.post(
     "/api/users/{follow_id}/follow",
     summary="Подписаться на пользователя",
@@ -208,6 +467,7 @@ async def delete_like_tweet(
 async def follow_user(
     api_key: str = Header(..., description="API ключ авторизованного пользователя"),
     follow_id: int = Path(..., title="ID пользователя для подписки"),
+    session: AsyncSession = Depends(get_session),
 ) -> dict:
     user = await get_user_by_api_key(api_key, session)
 
@@ -221,58 +481,126 @@ async def follow_user(
         raise HTTPException(status_code=404, detail="You can't subscribe to yourself")
     try:
         session.add(Follow(follower_id=user.id, following_id=following.id))
-        await session.commit()
+        await session.flush()
     except IntegrityError:
+        await session.rollback()
         raise HTTPException(status_code=404, detail="You are already follow user")
+    await session.execute(
+        update(Users)
+        .where(Users.id == following.id)
+        .values(followers_count=Users.followers_count + 1)
+    )
+    await job_queue.enqueue(
+        "timeline.backfill", {"user_id": user.id, "followee_ids": [following.id]}, session=session
+    )
+    await session.commit()
+    await bump_feeds([user.id])
+    await event_broker.publish_follow(user.id, following.id, True)
     return {"result": True}
 
 
 
+@app.post(
+    "/api/follows:batch",
+    summary="Подписаться на нескольких пользователей",
+    description=(
+        "Добавляет подписки на пачку пользователей. Для каждого ID возвращается "
+        "created, exists, not_found или self."
+    ),
+    tags=["Users"],
+    response_description="Результат для каждого пользователя",
+    status_code=200,
+)
+async def follow_users_batch_endpoint(
+    batch: FollowsBatchIN,
+    api_key: str = Header(..., description="API ключ авторизованного пользователя"),
+    session: AsyncSession = Depends(get_session),
+) -> dict:
+    user = await get_user_by_api_key(api_key, session)
+    results = await follow_users_batch(session, user.id, batch.user_ids)
+    await session.commit()
+    await bump_feeds([user.id])
+    for result in results:
+        if result["result"] == "created":
+            await event_broker.publish_follow(user.id, result["user_id"], True)
+    return {"result": True, "results": results}
+
+
 @app.get(
     "/api/tweets",
     summary="Получить список твитов",
     description=(
-        "Возвращает список твитов с информацией об авторе, прикреплённых медиа "
-        "и пользователях, поставивших лайк. Результат отсортирован по количеству лайков."
+        "Возвращает ленту: твиты текущего пользователя и тех, на кого он подписан, "
+        "с информацией об авторе, прикреплённых медиа и пользователях, поставивших лайк. "
+        "Результат отсортирован по количеству лайков и разбит на страницы курсором next_cursor. "
+        "Страницы кратковременно кэшируются и сбрасываются записями, меняющими ленту "
+        "пользователя; число лайков чужих твитов обновляется не позже чем через RESPONSE_CACHE_TTL."
     ),
     tags=["Tweets"],
     response_description="Список твитов с метаданными",
 )
-async def get_tweets(api_key: str = Header(...)) -> dict:
-    await get_user_by_api_key(api_key, session)
+async def get_tweets(
+    api_key: str = Header(...),
+    limit: int = Query(20, ge=1, le=100, description="Количество твитов на странице"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы"),
+    session: AsyncSession = Depends(get_read_session),
+) -> dict:
+    user = await get_user_by_api_key(api_key, session)
+    await like_buffer.sync_user(user.id)
 
-    tweets_data = await session.execute(
-        select(
-            Tweet.id, Tweet.tweet_data, func.array_agg(Media.id).label("attachments"),
-            Users.id.label("user_id"), Users.name.label("user_name")
-        )
-        .select_from(Tweet)
-        .outerjoin(Media, Tweet.tweet_media_ids.any(Media.id))
-        .join(Users, Tweet.user_id == Users.id)
-        .group_by(Tweet.id, Tweet.tweet_data, Users.id, Users.name)
-    )
+    async def build_page() -> bytes:
+        tweets_list, next_cursor = await get_feed_page(session, user.id, limit, cursor)
+        return json_dumps({"result": True, "tweets": tweets_list, "next_cursor": next_cursor})
 
-    likes_data = await session.execute(
-        select(Like.tweet_id, Like.user_id, Users.name).join(Users, Like.user_id == Users.id)
-    )
+    body = await response_cache.get_or_build(feed_cache(user.id), f"{limit}:{cursor}", build_page)
+    return Response(content=body, media_type=FastJSONResponse.media_type)
 
-    tweet_likes = defaultdict(list)
-    for tweet_id, user_id, user_name in likes_data:
-        tweet_likes[tweet_id].append({"user_id": user_id, "name": user_name})
+@app.get(
+    "/api/timeline",
+    summary="Получить хронологическую ленту",
+    description=(
+        "Возвращает твиты текущего пользователя и его подписок в порядке публикации "
+        "из материализованной ленты. Следующая страница запрашивается по курсору next_cursor."
+    ),
+    tags=["Tweets"],
+    response_description="Страница ленты",
+)
+async def get_timeline(
+    api_key: str = Header(...),
+    limit: int = Query(20, ge=1, le=100, description="Количество твитов на странице"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы"),
+    session: AsyncSession = Depends(get_read_session),
+) -> dict:
+    user = await get_user_by_api_key(api_key, session)
+    await like_buffer.sync_user(user.id)
 
-    tweets_list = []
-    for tweet_id, content, attachments, user_id, user_name in tweets_data:
-        print(tweet_likes[tweet_id])
-        tweets_list.append({
-            "id": tweet_id, "content": content,
-            "attachments": None if attachments == [None] else [f"/api/medias/{media_id}" for media_id in attachments],
-            "author": {"id": user_id, "name": user_name},
-            "likes": tweet_likes[tweet_id],
-        })
+    tweets_list, next_cursor = await get_timeline_page(session, user.id, limit, cursor)
 
-    tweets_list.sort(key=lambda t: len(tweet_likes[t["id"]]), reverse=True)
+    return FastJSONResponse({"result": True, "tweets": tweets_list, "next_cursor": next_cursor})
 
-    return {"result": True, "tweets": tweets_list}
+@app.get(
+    "/api/tweets/search",
+    summary="Поиск твитов",
+    description=(
+        "Полнотекстовый поиск по тексту твитов: находятся твиты со всеми словами запроса, "
+        "в PostgreSQL поддерживаются \"фразы\", or и -исключение. Результат отсортирован "
+        "по релевантности, следующая страница запрашивается по курсору next_cursor."
+    ),
+    tags=["Tweets"],
+    response_description="Страница найденных твитов",
+)
+async def search_tweets_endpoint(
+    api_key: str = Header(...),
+    q: str = Query(..., min_length=1, max_length=200, description="Поисковый запрос"),
+    limit: int = Query(20, ge=1, le=100, description="Количество твитов на странице"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы"),
+    session: AsyncSession = Depends(get_read_session),
+) -> dict:
+    await get_user_by_api_key(api_key, session)
+
+    tweets_list, next_cursor = await search_tweets(session, q, limit, cursor)
+
+    return FastJSONResponse({"result": True, "tweets": tweets_list, "next_cursor": next_cursor})
 
 @app.delete(
     "/api/users/{follow_id}/follow",
@@ -285,118 +613,239 @@ async def get_tweets(api_key: str = Header(...)) -> dict:
 async def unfollow_user(
     api_key: str = Header(..., description="API ключ авторизованного пользователя"),
     follow_id: int = Path(..., title="ID пользователя для отписки"),
+    session: AsyncSession = Depends(get_session),
 ) -> dict:
 
 
     user = await get_user_by_api_key(api_key, session)
 
-    follow = (
+    # счётчик уменьшается, только если строку удалил именно этот запрос:
+    # у параллельной отписки от того же пользователя RETURNING будет пустым
+    deleted = (
         await session.execute(
-            select(Follow).where(
-                (user.id == Follow.follower_id) & (follow_id == Follow.following_id)
-            )
+            delete(Follow)
+            .where(Follow.follower_id == user.id, Follow.following_id == follow_id)
+            .returning(Follow.id)
         )
-    ).scalar_one_or_none()
+    ).first()
 
-    if not follow:
+    if not deleted:
         raise HTTPException(
             status_code=404, detail="You are not subscribed to the user"
         )
 
-    await session.delete(follow)
+    await session.execute(
+        update(Users)
+        .where(Users.id == follow_id)
+        .values(followers_count=Users.followers_count - 1)
+    )
+    await remove_followee_from_timeline(session, user.id, follow_id)
     await session.commit()
+    await bump_feeds([user.id])
+    await event_broker.publish_follow(user.id, follow_id, False)
     return {"result": True}
 
 
 @app.get(
     "/api/users/me",
     summary="Получить профиль текущего пользователя",
-    description="Возвращает информацию о пользователе, его подписчиках и на кого он подписан.",
+    description=(
+        "Возвращает информацию о пользователе, его подписчиках и на кого он подписан. "
+        "Списки разбиты на страницы, их полные размеры — в followers_count и following_count."
+    ),
     tags=["Users"],
     response_description="Профиль пользователя",
     status_code=200,
 )
 async def get_my_profile(
-    api_key: str = Header(..., description="API ключ авторизованного пользователя")
+    api_key: str = Header(..., description="API ключ авторизованного пользователя"),
+    limit: int = Query(100, ge=1, le=1000, description="Размер страницы списков"),
+    followers_cursor: Optional[int] = Query(None, description="Курсор страницы подписчиков"),
+    following_cursor: Optional[int] = Query(None, description="Курсор страницы подписок"),
+    session: AsyncSession = Depends(get_read_session),
 ) -> dict:
 
     user = await get_user_by_api_key(api_key, session)
 
-    if not user:
+    profile = await get_profile(session, user.id, limit, followers_cursor, following_cursor)
+    if not profile:
         raise HTTPException(status_code=401, detail="User not found")
 
-    followers_query = (
-        select(Users)
-        .join(Follow, Users.id == Follow.following_id)
-        .where(Follow.follower_id == user.id)
-    )
-    followers_result = await session.execute(followers_query)
-    followers = [{"id": u.id, "name": u.name} for u in followers_result.scalars().all()]
-
-    following_query = (
-        select(Users)
-        .join(Follow, Users.id == Follow.follower_id)
-        .where(Follow.following_id == user.id)
-    )
-    following_result = await session.execute(following_query)
-    following = [{"id": u.id, "name": u.name} for u in following_result.scalars().all()]
-
-    return {
-        "result": "true",
-        "user": {
-            "id": user.id,
-            "name": user.name,
-            "followers": followers,
-            "following": following,
-        },
-    }
+    return {"result": "true", "user": profile}
 
 
 @app.get(
     "/api/users/{user_id}",
     summary="Получить информацию о пользователе",
-    description="Возвращает данные пользователя с подписчиками и подписками по ID пользователя.",
+    description=(
+        "Возвращает данные пользователя с подписчиками и подписками по ID пользователя. "
+        "Списки разбиты на страницы, их полные размеры — в followers_count и following_count."
+    ),
     tags=["Users"],
     response_description="Профиль пользователя",
     status_code=200,
 )
-async def get_user_info(user_id: int = Path(..., title="ID пользователя")) -> dict:
-    user = (
-        await session.execute(select(Users).where(Users.id== user_id))
-    ).scalar_one_or_none()
-    if not user:
+async def get_user_info(
+    user_id: int = Path(..., title="ID пользователя"),
+    limit: int = Query(100, ge=1, le=1000, description="Размер страницы списков"),
+    followers_cursor: Optional[int] = Query(None, description="Курсор страницы подписчиков"),
+    following_cursor: Optional[int] = Query(None, description="Курсор страницы подписок"),
+    session: AsyncSession = Depends(get_read_session),
+) -> dict:
+    profile = await get_profile(session, user_id, limit, followers_cursor, following_cursor)
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
-    followers_query = (
-        select(Users)
-        .join(Follow, Users.id == Follow.following_id)
-        .where(Follow.follower_id == user_id)
-    )
-    followers_result = await session.execute(followers_query)
-    followers = [{"id": u.id, "name": u.name} for u in followers_result.scalars().all()]
 
-    following_query = (
-        select(Users)
-        .join(Follow, Follow.follower_id == Users.id)
-        .where(Follow.following_id == user_id)
-    )
-    following_result = await session.execute(following_query)
-    following = [{"id": u.id, "name": u.name} for u in following_result.scalars().all()]
-
-    return {
-        "result": "true",
-        "user": {
-            "id": user.id,
-            "name": user.name,
-            "followers": followers,
-            "following": following,
-        },
-    }
+    return {"result": "true", "user": profile}
+
+
+@app.get(
+    "/api/export/{kind}",
+    summary="Выгрузка данных в NDJSON",
+    description=(
+        "Потоково выгружает tweets, likes или follows по одной JSON-записи на строку "
+        "в порядке id. Выгрузку можно продолжить с места обрыва через since_id; "
+        "с gzip=true ответ сжимается (Content-Encoding: gzip)."
+    ),
+    tags=["Service"],
+    response_description="Поток NDJSON",
+)
+async def export_data(
+    kind: str = Path(..., description="tweets, likes или follows"),
+    since_id: int = Query(0, ge=0, description="Выгрузить записи с id больше указанного"),
+    gzip: bool = Query(False, description="Сжать ответ gzip"),
+    api_key: str = Header(...),
+    session: AsyncSession = Depends(get_read_session),
+) -> StreamingResponse:
+    await get_user_by_api_key(api_key, session)
+    if kind not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown export")
+
+    chunks = export_ndjson(kind, since_id, session_maker=read_router.session_maker(api_key))
+    headers = {}
+    if gzip:
+        chunks = gzip_stream(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type="application/x-ndjson", headers=headers)
+
+
+async def open_event_subscription(api_key: Optional[str]) -> Subscription:
+    """Подписка на ленту пользователя. Сессия нужна только для проверки ключа
+    и списка подписок и закрывается до начала потока: открытое соединение
+    не держит соединение пула."""
+    if not api_key:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    async with read_router.session_maker(api_key)() as session:
+        user = await get_user_by_api_key(api_key, session)
+        followee_ids = (await session.execute(
+            select(Follow.following_id).where(Follow.follower_id == user.id)
+        )).scalars().all()
+    return event_broker.subscribe(user.id, followee_ids)
+
+
+async def sse_events(subscription: Subscription):
+    yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+    async for payload in event_broker.stream(subscription):
+        # комментарий не виден клиенту, но не даёт прокси закрыть простаивающее соединение
+        yield b": keepalive\n\n" if payload == HEARTBEAT else b"data: " + payload + b"\n\n"
 
 
+@app.get(
+    "/api/events",
+    summary="Поток событий ленты (SSE)",
+    description=(
+        "Server-Sent Events с обновлениями ленты текущего пользователя: tweet.created, "
+        "tweet.deleted и tweet.likes для своих твитов и твитов тех, на кого он подписан. "
+        "EventSource не передаёт заголовки, поэтому ключ можно указать параметром api_key. "
+        "Клиент, не успевающий читать события, отключается и переподключается сам."
+    ),
+    tags=["Tweets"],
+    response_class=StreamingResponse,
+    response_description="Поток text/event-stream",
+)
+async def stream_events(
+    api_key: Optional[str] = Header(None, description="API ключ авторизованного пользователя"),
+    api_key_query: Optional[str] = Query(None, alias="api_key", description="API ключ для EventSource"),
+) -> StreamingResponse:
+    subscription = await open_event_subscription(api_key or api_key_query)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(sse_events(subscription), media_type="text/event-stream", headers=headers)
+
+
+@app.websocket("/api/events/ws")
+async def stream_events_ws(
+    websocket: WebSocket,
+    api_key: Optional[str] = Header(None),
+    api_key_query: Optional[str] = Query(None, alias="api_key"),
+) -> None:
+    """Те же события, что и /api/events, текстовыми сообщениями WebSocket."""
+    try:
+        subscription = await open_event_subscription(api_key or api_key_query)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        async for payload in event_broker.stream(subscription):
+            # отправка heartbeat обнаруживает соединения, закрытые без прощания
+            message = payload if payload != HEARTBEAT else b'{"type":"heartbeat"}'
+            await websocket.send_text(message.decode())
+    except WebSocketDisconnect:
+        return
+    finally:
+        event_broker.unsubscribe(subscription)
+    # 1013 — клиент отстал и отключён, 1001 — процесс останавливается
+    await websocket.close(code=1013 if subscription.dropped else 1001)
+
+
+@app.get(
+    "/api/stats/auth-cache",
+    summary="Статистика кэша API-ключей",
+    description="Возвращает число попаданий и промахов кэша API-ключей и его заполненность.",
+    tags=["Service"],
+    response_description="Счётчики кэша",
+)
+async def get_auth_cache_stats() -> dict:
+    return {"result": True, "stats": api_key_cache.stats()}
+
+
+@app.get(
+    "/metrics",
+    summary="Метрики Prometheus",
+    description=(
+        "Агрегированные по маршрутам гистограммы времени обработки, времени в базе "
+        "и числа SQL-запросов, а также счётчики кэша API-ключей, обработки изображений, "
+        "фоновой очереди, буфера лайков, чтений из реплики и потоков событий."
+    ),
+    tags=["Service"],
+    response_class=PlainTextResponse,
+    response_description="Метрики в текстовом формате Prometheus",
+)
+async def get_metrics() -> PlainTextResponse:
+    stats = {
+        "auth_cache": api_key_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "image_pipeline": image_pipeline.stats(),
+        "job_queue": job_queue.stats(),
+        "like_buffer": like_buffer.stats(),
+        "read_replica": read_router.stats(),
+        "events": event_broker.stats(),
+    }
+    gauges, counters = {}, {}
+    for prefix, values in stats.items():
+        for name, value in values.items():
+            if name in MONOTONIC_STATS:
+                counters[f"{prefix}_{name}_total"] = value
+            else:
+                gauges[f"{prefix}_{name}"] = value
+    return PlainTextResponse(
+        metrics_registry.render(gauges, counters), media_type="text/plain; version=0.0.4"
+    )
+
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/css", StaticFiles(directory="static/css"), name="css")     # ← ДОБАВИТЕ
-app.mount("/js", StaticFiles(directory="static/js"), name="js")
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
+app.mount("/css", PrecompressedStaticFiles(directory="static/css"), name="css")     # ← ДОБАВИТЕ
+app.mount("/js", PrecompressedStaticFiles(directory="static/js"), name="js")
 
 if __name__ == "__main__":
     import uvicorn
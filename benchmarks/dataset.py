@@ -0,0 +1,139 @@
+import io
+import random
+from dataclasses import asdict, dataclass, field
+from itertools import accumulate
+from typing import Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from services.storage import MediaStorage
+
+INSERT_BATCH = 1000
+
+
+@dataclass
+class DatasetConfig:
+    users: int = 1000
+    tweets: int = 10000
+    likes: int = 50000
+    # среднее число подписок; распределение популярности авторов — степенное
+    follows_per_user: int = 20
+    power_law_alpha: float = 1.2
+    media: int = 50
+    media_min_bytes: int = 10 * 1024
+    media_max_bytes: int = 200 * 1024
+    # словарь текстов твитов; частоты слов — по закону Ципфа, как в живом языке
+    vocabulary: int = 20000
+    # id сгенерированных строк начинаются после id_offset, чтобы не мешать существующим
+    id_offset: int = 1_000_000
+    seed: int = 42
+
+
+@dataclass
+class Dataset:
+    config: DatasetConfig
+    api_keys: List[str] = field(default_factory=list)
+    user_ids: List[int] = field(default_factory=list)
+    tweet_ids: List[int] = field(default_factory=list)
+    media_ids: List[int] = field(default_factory=list)
+    # твиты по ключу автора — для сценария удаления
+    tweets_by_key: Dict[str, List[int]] = field(default_factory=dict)
+    # частое, среднее и редкое слово словаря — для сценария поиска
+    search_terms: List[str] = field(default_factory=list)
+
+    def describe(self) -> dict:
+        return asdict(self.config)
+
+
+def power_law_cum_weights(n: int, alpha: float) -> List[float]:
+    return list(accumulate(1.0 / (rank ** alpha) for rank in range(1, n + 1)))
+
+
+def vocabulary_words(size: int) -> List[str]:
+    return [f"word{rank}" for rank in range(1, size + 1)]
+
+
+def search_terms(words: List[str]) -> List[str]:
+    return [words[0], words[len(words) // 100], words[-1]]
+
+
+def tweet_text(rnd: random.Random, words: List[str], cum_weights: List[float]) -> str:
+    return " ".join(rnd.choices(words, cum_weights=cum_weights, k=rnd.randint(3, 30)))
+
+
+async def _insert_batches(conn, table, rows: List[dict]) -> None:
+    for start in range(0, len(rows), INSERT_BATCH):
+        await conn.execute(insert(table), rows[start:start + INSERT_BATCH])
+
+
+async def seed_dataset(
+    engine: AsyncEngine, storage: MediaStorage, config: DatasetConfig
+) -> Dataset:
+    """Заполняет базу синтетическими пользователями, подписками, твитами,
+    лайками и медиа. Популярность авторов и твитов — степенная, как в соцсетях."""
+    # database создаёт движок при импорте, поэтому импортируется после настройки ENGINE
+    from database import Follow, Like, Tweet, Users, add_media
+    from database.bulk_import import refresh_derived, sync_sequences
+    rnd = random.Random(config.seed)
+    dataset = Dataset(config=config)
+    offset = config.id_offset
+
+    dataset.user_ids = list(range(offset + 1, offset + config.users + 1))
+    dataset.api_keys = [f"bench-{uid}" for uid in dataset.user_ids]
+    users = [
+        {"id": uid, "name": f"bench_user_{uid}", "api_key": key}
+        for uid, key in zip(dataset.user_ids, dataset.api_keys)
+    ]
+
+    popularity = power_law_cum_weights(config.users, config.power_law_alpha)
+    follows = set()
+    for follower in dataset.user_ids:
+        degree = min(config.users - 1, int(rnd.paretovariate(1.5) * config.follows_per_user / 3))
+        for followee in rnd.choices(dataset.user_ids, cum_weights=popularity, k=degree):
+            if followee != follower:
+                follows.add((follower, followee))
+
+    authors = rnd.choices(dataset.user_ids, cum_weights=popularity, k=config.tweets)
+    dataset.tweet_ids = list(range(offset + 1, offset + config.tweets + 1))
+    words = vocabulary_words(config.vocabulary)
+    word_weights = power_law_cum_weights(config.vocabulary, 1.0)
+    dataset.search_terms = search_terms(words)
+    tweets = [
+        {"id": tid, "user_id": author, "tweet_data": tweet_text(rnd, words, word_weights)}
+        for tid, author in zip(dataset.tweet_ids, authors)
+    ]
+    for tweet in tweets:
+        dataset.tweets_by_key.setdefault(f"bench-{tweet['user_id']}", []).append(tweet["id"])
+
+    tweet_popularity = power_law_cum_weights(config.tweets, config.power_law_alpha)
+    likes = set(zip(
+        rnd.choices(dataset.user_ids, k=config.likes),
+        rnd.choices(dataset.tweet_ids, cum_weights=tweet_popularity, k=config.likes),
+    ))
+
+    async with engine.begin() as conn:
+        await _insert_batches(conn, Users.__table__, users)
+        await _insert_batches(conn, Follow.__table__, [
+            {"follower_id": a, "following_id": b} for a, b in follows
+        ])
+        await _insert_batches(conn, Tweet.__table__, tweets)
+        await _insert_batches(conn, Like.__table__, [
+            {"user_id": u, "tweet_id": t} for u, t in likes
+        ])
+        await refresh_derived(
+            conn, tweet_ids=(offset, offset + config.tweets), user_ids=(offset, offset + config.users)
+        )
+
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    async with session_maker() as session:
+        for _ in range(config.media):
+            size = rnd.randint(config.media_min_bytes, config.media_max_bytes)
+            stored = await storage.save(io.BytesIO(rnd.randbytes(size)))
+            media, _ = await add_media(session, stored, "application/octet-stream")
+            dataset.media_ids.append(media.id)
+        await session.commit()
+
+    async with engine.begin() as conn:
+        await sync_sequences(conn)
+    return dataset
@@ -0,0 +1,97 @@
+"""Сравнение сериализации большой ленты: словари через jsonable_encoder и
+stdlib json (путь FastAPI по умолчанию) против объектов со __slots__ через
+services.json_response.dumps:
+
+    python -m benchmarks.json_encoding --tweets 5000 --likes 20
+"""
+import argparse
+import json
+import random
+import time
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+
+from database.payloads import AuthorPayload, LikePayload, TweetPayload
+from services.json_response import dumps
+
+
+def make_rows(tweets: int, likes: int, seed: int = 0):
+    rnd = random.Random(seed)
+    rows = [
+        (tid, "lorem ipsum " * rnd.randint(1, 20), [tid, tid + 1] if tid % 5 == 0 else [],
+         rnd.randint(1, 1000), f"user{tid % 1000}")
+        for tid in range(1, tweets + 1)
+    ]
+    tweet_likes = {
+        tid: [(uid, f"user{uid}") for uid in rnd.sample(range(1, 10000), likes)]
+        for tid, *_ in rows
+    }
+    return rows, tweet_likes
+
+
+def build_dicts(rows, tweet_likes) -> dict:
+    return {"result": True, "next_cursor": None, "tweets": [
+        {
+            "id": tid, "content": content,
+            "attachments": [f"/api/medias/{m}" for m in media] if media else None,
+            "author": {"id": uid, "name": name},
+            "likes": [{"user_id": lid, "name": lname} for lid, lname in tweet_likes[tid]],
+        }
+        for tid, content, media, uid, name in rows
+    ]}
+
+
+def build_payloads(rows, tweet_likes) -> dict:
+    return {"result": True, "next_cursor": None, "tweets": [
+        TweetPayload(
+            tid, content,
+            [f"/api/medias/{m}" for m in media] if media else None,
+            AuthorPayload(uid, name),
+            [LikePayload(lid, lname) for lid, lname in tweet_likes[tid]],
+        )
+        for tid, content, media, uid, name in rows
+    ]}
+
+
+def stdlib_path(rows, tweet_likes) -> bytes:
+    content = jsonable_encoder(build_dicts(rows, tweet_likes))
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(rows, tweet_likes) -> bytes:
+    return dumps(build_payloads(rows, tweet_likes))
+
+
+def measure(func: Callable, rows, tweet_likes, repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(rows, tweet_likes)
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)
+
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tweets", type=int, default=5000)
+    parser.add_argument("--likes", type=int, default=20, help="лайков на твит")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rows, tweet_likes = make_rows(args.tweets, args.likes)
+    assert json.loads(stdlib_path(rows, tweet_likes)) == json.loads(fast_path(rows, tweet_likes))
+
+    report = {}
+    for name, func in (("jsonable_encoder+json", stdlib_path), ("slots+fast_dumps", fast_path)):
+        timings = measure(func, rows, tweet_likes, args.repeat)
+        report[name] = {"median_ms": round(timings[len(timings) // 2], 2), "min_ms": round(timings[0], 2)}
+    report["speedup"] = round(
+        report["jsonable_encoder+json"]["median_ms"] / report["slots+fast_dumps"]["median_ms"], 1
+    )
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,84 @@ from .models import (
     Follow as Follow,
     Like as Like,
     Media as Media,
+    MediaObject as MediaObject,
+    MediaVariant as MediaVariant,
+    QueuedJob as QueuedJob,
+    TimelineEntry as TimelineEntry,
     Tweet as Tweet,
+    TweetMedia as TweetMedia,
     Users as Users,
     engine as engine,
-    session as session,
+    async_session as async_session,
     get_session as get_session,
+    replica_engine as replica_engine,
+    replica_session as replica_session,
 )
-from .requests import get_user_by_api_key as get_user_by_api_key
-from .schemas import TweetIN as TweetIN
\ No newline at end of file
+from .routing import (
+    ReadRouter as ReadRouter,
+    get_read_session as get_read_session,
+    read_router as read_router,
+)
+from .requests import (
+    get_user_by_api_key as get_user_by_api_key,
+    dialect_insert as dialect_insert,
+    api_key_cache as api_key_cache,
+    invalidate_api_key as invalidate_api_key,
+    invalidate_user as invalidate_user,
+    get_feed_page as get_feed_page,
+    get_profile as get_profile,
+)
+from .batch import (
+    create_tweets_batch as create_tweets_batch,
+    follow_users_batch as follow_users_batch,
+    like_tweets_batch as like_tweets_batch,
+)
+from .media import (
+    add_media as add_media,
+    attach_media as attach_media,
+    detach_media as detach_media,
+    get_media_stats as get_media_stats,
+    get_media_variant as get_media_variant,
+    get_unprocessed_object as get_unprocessed_object,
+    purge_media_object as purge_media_object,
+    release_media as release_media,
+    save_media_variants as save_media_variants,
+)
+from .timeline import (
+    add_to_author_timeline as add_to_author_timeline,
+    fan_out_tweets as fan_out_tweets,
+    get_feed_audience as get_feed_audience,
+    get_timeline_page as get_timeline_page,
+    remove_followee_from_timeline as remove_followee_from_timeline,
+    backfill_followee_timeline as backfill_followee_timeline,
+    remove_tweet_from_timelines as remove_tweet_from_timelines,
+)
+from .search import (
+    search_tweets as search_tweets,
+)
+from .like_buffer import (
+    LikeBuffer as LikeBuffer,
+    get_like_state as get_like_state,
+    like_buffer as like_buffer,
+)
+from .queue import (
+    DatabaseJobQueueBackend as DatabaseJobQueueBackend,
+    create_job_queue as create_job_queue,
+    job_queue as job_queue,
+)
+from .payloads import (
+    AuthorPayload as AuthorPayload,
+    LikePayload as LikePayload,
+    TweetPayload as TweetPayload,
+)
+from .schema import (
+    SchemaVersionError as SchemaVersionError,
+    check_schema_version as check_schema_version,
+    upgrade_schema as upgrade_schema,
+)
+from .schemas import (
+    TweetIN as TweetIN,
+    TweetsBatchIN as TweetsBatchIN,
+    LikesBatchIN as LikesBatchIN,
+    FollowsBatchIN as FollowsBatchIN,
+)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import os
+from typing import List
+
+from fastapi import HTTPException
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .media import attach_media
+from .models import Follow, Like, Tweet, Users
+from .requests import dialect_insert
+from .schemas import TweetIN
+from .queue import job_queue
+from .timeline import add_to_author_timeline
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+
+
+def check_batch_size(items: list) -> None:
+    if not items:
+        raise HTTPException(status_code=422, detail="Batch is empty")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=422, detail=f"Batch is larger than {BATCH_MAX_ITEMS} items"
+        )
+
+
+async def like_tweets_batch(
+    session: AsyncSession, user_id: int, tweet_ids: List[int]
+) -> List[dict]:
+    """Лайки пачкой: одна проверка id, один INSERT ... ON CONFLICT DO NOTHING
+    по unique_user_tweet_like и одно обновление like_count."""
+    check_batch_size(tweet_ids)
+    tweet_ids = list(dict.fromkeys(tweet_ids))
+    existing = set(
+        (await session.execute(select(Tweet.id).where(Tweet.id.in_(tweet_ids)))).scalars()
+    )
+
+    created = set()
+    if existing:
+        likes = Like.__table__
+        stmt = (
+            dialect_insert(session, likes)
+            .values([{"user_id": user_id, "tweet_id": tweet_id} for tweet_id in existing])
+            .on_conflict_do_nothing(index_elements=[likes.c.user_id, likes.c.tweet_id])
+            .returning(likes.c.tweet_id)
+        )
+        created = set((await session.execute(stmt)).scalars())
+    if created:
+        await session.execute(
+            update(Tweet)
+            .where(Tweet.id.in_(created))
+            .values(like_count=Tweet.like_count + 1)
+        )
+
+    return [
+        {
+            "tweet_id": tweet_id,
+            "result": "created" if tweet_id in created
+            else "exists" if tweet_id in existing else "not_found",
+        }
+        for tweet_id in tweet_ids
+    ]
+
+
+async def follow_users_batch(
+    session: AsyncSession, user_id: int, user_ids: List[int]
+) -> List[dict]:
+    """Подписки пачкой по тем же правилам, что и follow_user, с идемпотентностью
+    через unique_follow."""
+    check_batch_size(user_ids)
+    user_ids = list(dict.fromkeys(user_ids))
+    existing = set(
+        (await session.execute(select(Users.id).where(Users.id.in_(user_ids)))).scalars()
+    )
+    existing.discard(user_id)
+
+    created = set()
+    if existing:
+        follows = Follow.__table__
+        stmt = (
+            dialect_insert(session, follows)
+            .values([{"follower_id": user_id, "following_id": fid} for fid in existing])
+            .on_conflict_do_nothing(
+                index_elements=[follows.c.follower_id, follows.c.following_id]
+            )
+            .returning(follows.c.following_id)
+        )
+        created = set((await session.execute(stmt)).scalars())
+    if created:
+        await session.execute(
+            update(Users)
+            .where(Users.id.in_(created))
+            .values(followers_count=Users.followers_count + 1)
+        )
+        await job_queue.enqueue(
+            "timeline.backfill", {"user_id": user_id, "followee_ids": sorted(created)},
+            session=session,
+        )
+
+    def outcome(follow_id: int) -> str:
+        if follow_id == user_id:
+            return "self"
+        if follow_id in created:
+            return "created"
+        return "exists" if follow_id in existing else "not_found"
+
+    return [{"user_id": fid, "result": outcome(fid)} for fid in user_ids]
+
+
+async def create_tweets_batch(
+    session: AsyncSession, user_id: int, tweets: List[TweetIN]
+) -> List[dict]:
+    """Твиты пачкой одним многострочным INSERT с RETURNING в порядке запроса."""
+    check_batch_size(tweets)
+    table = Tweet.__table__
+    tweet_ids = (
+        await session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True),
+            [
+                {"user_id": user_id, "tweet_data": tweet.tweet_data}
+                for tweet in tweets
+            ],
+        )
+    ).scalars().all()
+    await attach_media(session, user_id, {
+        tweet_id: tweet.tweet_media_ids
+        for tweet_id, tweet in zip(tweet_ids, tweets) if tweet.tweet_media_ids
+    })
+    await add_to_author_timeline(session, tweet_ids, user_id)
+    await job_queue.enqueue(
+        "timeline.fan_out", {"tweet_ids": list(tweet_ids), "author_id": user_id},
+        session=session,
+    )
+    return [{"tweet_id": tweet_id, "result": "created"} for tweet_id in tweet_ids]
@@ -0,0 +1,319 @@
+"""Массовая загрузка данных из NDJSON или CSV (можно .gz) для нового окружения.
+
+Схема и типы колонок берутся из моделей database/models.py. На PostgreSQL
+строки пишутся через COPY (asyncpg), на SQLite — executemany большими
+пачками в одной транзакции. Вторичные индексы загружаемой таблицы
+удаляются на время загрузки и создаются заново в конце:
+
+    python -m database.bulk_import --users users.ndjson --tweets tweets.csv.gz \\
+        --likes likes.ndjson --follows follows.ndjson
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Table, and_, false, func, insert, or_, select, text, true, union, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.sql.functions import now
+
+from .models import (Follow, Like, Media, MediaObject, TimelineEntry, Tweet, TweetMedia,
+                     Users, engine)
+from .requests import dialect_insert
+from .timeline import FANOUT_FOLLOWERS_LIMIT, trim_timelines
+
+IMPORT_BATCH_SIZE = 10000
+
+# Порядок загрузки учитывает внешние ключи
+IMPORT_TABLES: Dict[str, Table] = {
+    "users": Users.__table__,
+    "media_objects": MediaObject.__table__,
+    "medias": Media.__table__,
+    "tweets": Tweet.__table__,
+    "tweet_media": TweetMedia.__table__,
+    "likes": Like.__table__,
+    "follows": Follow.__table__,
+}
+
+IdRange = Tuple[int, int]
+# Таблицы, от которых зависят счётчики и ленты
+DERIVED_SOURCES = ("users", "tweets", "likes", "follows")
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """Записи файла: .ndjson/.jsonl — по объекту на строку, .csv — с заголовком."""
+    opener = gzip.open if path.endswith(".gz") else open
+    name = path[:-3] if path.endswith(".gz") else path
+    with opener(path, "rt", encoding="utf-8", newline="") as f:
+        if name.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _converter(column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = str
+
+    def convert(value):
+        if value is None or (value == "" and python_type is not str):
+            return None
+        if python_type in (list, dict):
+            return json.loads(value) if isinstance(value, str) else value
+        if python_type is datetime:
+            return datetime.fromisoformat(value) if isinstance(value, str) else value
+        if python_type is bool and isinstance(value, str):
+            return value.lower() in ("1", "true", "t", "yes")
+        return python_type(value)
+
+    return convert
+
+
+def prepare_rows(table: Table, records: Iterable[dict], loaded_at: datetime) -> Iterator[dict]:
+    """Приводит значения к типам колонок и заполняет умолчания из модели:
+    COPY не вычисляет Python-умолчания SQLAlchemy."""
+    converters = {column.key: _converter(column) for column in table.columns}
+    defaults = {}
+    for column in table.columns:
+        default = column.default
+        if default is None:
+            continue
+        if default.is_scalar:
+            defaults[column.key] = default.arg
+        elif isinstance(default.arg, now):
+            defaults[column.key] = loaded_at
+
+    for record in records:
+        unknown = set(record) - set(converters)
+        if unknown:
+            raise ValueError(f"{table.name}: unknown columns {sorted(unknown)}")
+        row = dict(defaults)
+        for key, value in record.items():
+            value = converters[key](value)
+            # пустое значение (пустая ячейка CSV) не затирает умолчание модели
+            if value is not None or key not in defaults:
+                row[key] = value
+        yield row
+
+
+def _batches(rows: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _copy_batch(conn: AsyncConnection, table: Table, columns: List[str], rows: List[dict]) -> None:
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table.name,
+        records=[tuple(row.get(key) for key in columns) for row in rows],
+        columns=columns,
+    )
+
+
+async def load_table(
+    conn: AsyncConnection,
+    table: Table,
+    records: Iterable[dict],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    defer_indexes: bool = True,
+) -> int:
+    """Загружает записи в таблицу внутри транзакции conn, возвращает число строк."""
+    indexes = list(table.indexes) if defer_indexes else []
+    for index in indexes:
+        await conn.run_sync(lambda sync_conn, index=index: index.drop(sync_conn, checkfirst=True))
+
+    use_copy = conn.dialect.name == "postgresql"
+    columns: Optional[List[str]] = None
+    loaded = 0
+    for batch in _batches(prepare_rows(table, records, datetime.utcnow()), batch_size):
+        if columns is None:
+            columns = [column.key for column in table.columns if column.key in batch[0]]
+        if use_copy:
+            await _copy_batch(conn, table, columns, batch)
+        else:
+            await conn.execute(insert(table), [{key: row.get(key) for key in columns} for row in batch])
+        loaded += len(batch)
+
+    for index in indexes:
+        await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+    return loaded
+
+
+async def sync_sequences(conn: AsyncConnection) -> None:
+    """После вставки явных id сдвигает последовательности PostgreSQL за максимум."""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in IMPORT_TABLES.values():
+        if "id" not in table.columns:
+            continue
+        await conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"(SELECT coalesce(max(id), 0) + 1 FROM {table.name}), false)"
+        ))
+
+
+async def refresh_derived(
+    conn: AsyncConnection,
+    tweet_ids: Optional[IdRange] = None,
+    user_ids: Optional[IdRange] = None,
+    like_ids: Optional[IdRange] = None,
+    follow_ids: Optional[IdRange] = None,
+) -> None:
+    """Пересчитывает like_count, followers_count и дополняет ленты
+    timeline_entries для загруженных напрямую строк.
+
+    Диапазоны id (lo, hi] ограничивают пересчёт загруженными твитами,
+    пользователями, лайками и подписками; без tweet_ids и user_ids
+    пересчитываются все твиты и пользователи. Лайки и подписки пересчитывают
+    счётчики своих твитов и авторов, даже если те были в базе раньше.
+    Существующие записи лент не удаляются, ленты обрезаются до
+    TIMELINE_MAX_ENTRIES, популярные авторы не рассылаются.
+    """
+    def in_range(column, id_range: Optional[IdRange], default=true):
+        if id_range is None:
+            return default()
+        return and_(column > id_range[0], column <= id_range[1])
+
+    liked = select(Like.tweet_id).where(in_range(Like.id, like_ids, false))
+    like_count = select(func.count(Like.id)).where(Like.tweet_id == Tweet.id).scalar_subquery()
+    await conn.execute(
+        update(Tweet)
+        .where(or_(in_range(Tweet.id, tweet_ids), Tweet.id.in_(liked)))
+        .values(like_count=like_count)
+    )
+    followed = select(Follow.following_id).where(in_range(Follow.id, follow_ids, false))
+    followers_count = (
+        select(func.count(Follow.id)).where(Follow.following_id == Users.id).scalar_subquery()
+    )
+    await conn.execute(
+        update(Users)
+        .where(or_(in_range(Users.id, user_ids), Users.id.in_(followed)))
+        .values(followers_count=followers_count)
+    )
+
+    new_tweet = in_range(Tweet.id, tweet_ids)
+    new_follow = in_range(Follow.id, follow_ids, false)
+    own = select(Tweet.user_id, Tweet.id).where(new_tweet)
+    # новые твиты подписчикам и твиты авторов новым подписчикам
+    fanned = (
+        select(Follow.follower_id, Tweet.id)
+        .join(Tweet, Tweet.user_id == Follow.following_id)
+        .join(Users, Users.id == Tweet.user_id)
+        .where(or_(new_tweet, new_follow))
+        .where(Users.followers_count <= FANOUT_FOLLOWERS_LIMIT)
+    )
+    await conn.execute(
+        dialect_insert(conn, TimelineEntry.__table__)
+        .from_select(["user_id", "tweet_id"], union(own, fanned))
+        .on_conflict_do_nothing()
+    )
+    owners = union(
+        select(Tweet.user_id).where(new_tweet),
+        select(Follow.follower_id)
+        .join(Tweet, Tweet.user_id == Follow.following_id)
+        .where(or_(new_tweet, new_follow)),
+    )
+    await trim_timelines(conn, owners)
+
+
+async def _max_id(conn: AsyncConnection, table: Table) -> int:
+    return (await conn.execute(select(func.coalesce(func.max(table.c.id), 0)))).scalar_one()
+
+
+def _track_ids(records: Iterable[dict], bounds: dict) -> Iterator[dict]:
+    """Пропускает записи, запоминая наименьший явно заданный id."""
+    for record in records:
+        value = record.get("id")
+        if value not in (None, ""):
+            bounds["min"] = min(bounds.get("min", int(value)), int(value))
+        yield record
+
+
+async def bulk_import(
+    engine: AsyncEngine,
+    sources: Dict[str, str],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    defer_indexes: bool = True,
+    derived: bool = True,
+) -> Dict[str, dict]:
+    """Загружает файлы sources ({таблица: путь}) одной транзакцией и
+    возвращает по таблице число строк, время и скорость загрузки."""
+    report = {}
+    # (lo, hi] загруженных id: от максимума до загрузки (или меньшего явного id) до нового максимума
+    id_ranges: Dict[str, IdRange] = {}
+    async with engine.begin() as conn:
+        for name, table in IMPORT_TABLES.items():
+            if name not in sources:
+                continue
+            started = time.perf_counter()
+            records = read_records(sources[name])
+            if name in DERIVED_SOURCES:
+                before, bounds = await _max_id(conn, table), {}
+                records = _track_ids(records, bounds)
+            rows = await load_table(conn, table, records, batch_size, defer_indexes)
+            if name in DERIVED_SOURCES:
+                lo = min(before, bounds.get("min", before + 1) - 1)
+                id_ranges[name] = (lo, await _max_id(conn, table))
+            seconds = time.perf_counter() - started
+            report[name] = {
+                "rows": rows,
+                "seconds": round(seconds, 3),
+                "rows_per_s": round(rows / seconds) if seconds else rows,
+            }
+        await sync_sequences(conn)
+        if derived and {"tweets", "likes", "follows"} & set(sources):
+            started = time.perf_counter()
+            # таблица без загрузки — пустой диапазон, а не пересчёт всей базы
+            empty = (0, 0)
+            await refresh_derived(
+                conn,
+                tweet_ids=id_ranges.get("tweets", empty),
+                user_ids=id_ranges.get("users", empty),
+                like_ids=id_ranges.get("likes", empty),
+                follow_ids=id_ranges.get("follows", empty),
+            )
+            report["derived"] = {"seconds": round(time.perf_counter() - started, 3)}
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    for name in IMPORT_TABLES:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help=f"файл для {name}")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="не удалять вторичные индексы на время загрузки")
+    parser.add_argument("--skip-derived", action="store_true",
+                        help="не пересчитывать счётчики и ленты после загрузки")
+    args = parser.parse_args()
+
+    sources = {name: getattr(args, name) for name in IMPORT_TABLES if getattr(args, name)}
+    if not sources:
+        parser.error("no input files")
+    report = await bulk_import(
+        engine, sources, args.batch_size,
+        defer_indexes=not args.keep_indexes, derived=not args.skip_derived,
+    )
+    for name, stats in report.items():
+        print(name, " ".join(f"{key}={value}" for key, value in stats.items()))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
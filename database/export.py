@@ -0,0 +1,90 @@
+"""Потоковая выгрузка твитов, лайков и подписок в NDJSON.
+
+Строки читаются серверным курсором пачками по batch_size и сразу
+отдаются, поэтому память не зависит от размера таблицы. Каждая строка
+содержит id; выгрузку можно продолжить с места обрыва через since_id:
+
+    python -m database.export tweets --gzip --output tweets.ndjson.gz
+    python -m database.export likes --since-id 1500000
+"""
+import argparse
+import asyncio
+import sys
+import zlib
+from typing import AsyncIterator, Dict, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from services.json_response import dumps
+
+from .models import Follow, Like, Tweet, TweetMedia, async_session, engine
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_TABLES: Dict[str, Tuple] = {
+    "tweets": (Tweet, (Tweet.id, Tweet.user_id, Tweet.tweet_data, Tweet.like_count)),
+    "tweet_media": (TweetMedia, (TweetMedia.id, TweetMedia.tweet_id, TweetMedia.media_id,
+                                 TweetMedia.position)),
+    "likes": (Like, (Like.id, Like.user_id, Like.tweet_id)),
+    "follows": (Follow, (Follow.id, Follow.follower_id, Follow.following_id)),
+}
+
+
+async def export_ndjson(
+    kind: str,
+    since_id: int = 0,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    session_maker: async_sessionmaker = async_session,
+) -> AsyncIterator[bytes]:
+    """Строки таблицы kind с id > since_id по возрастанию id, по куску NDJSON на пачку."""
+    model, columns = EXPORT_TABLES[kind]
+    keys = [column.key for column in columns]
+    stmt = (
+        select(*columns)
+        .where(model.id > since_id)
+        .order_by(model.id)
+        .execution_options(yield_per=batch_size)
+    )
+    # отдельная сессия: выгрузка продолжается после выхода из обработчика
+    async with session_maker() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            yield b"".join(dumps(dict(zip(keys, row))) + b"\n" for row in rows)
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # 31 — формат gzip
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("kind", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--since-id", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--output", help="файл для выгрузки, по умолчанию stdout")
+    args = parser.parse_args()
+
+    chunks = export_ndjson(args.kind, args.since_id, args.batch_size)
+    if args.gzip:
+        chunks = gzip_stream(chunks)
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        async for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
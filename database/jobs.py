@@ -0,0 +1,80 @@
+import asyncio
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Follow, Like, Tweet, Users, async_session
+
+
+async def reconcile_like_counts(session: AsyncSession, batch_size: int = 10000) -> int:
+    """Пересчитывает tweets.like_count по таблице likes диапазонами id.
+
+    Каждый диапазон обновляется одним UPDATE и фиксируется отдельной
+    транзакцией, поэтому задача не держит длинных блокировок.
+    Возвращает количество исправленных твитов.
+    """
+    actual = (
+        select(func.count(Like.id))
+        .where(Like.tweet_id == Tweet.id)
+        .correlate(Tweet)
+        .scalar_subquery()
+    )
+    return await _reconcile(session, Tweet, Tweet.like_count, actual, batch_size)
+
+
+async def reconcile_followers_counts(session: AsyncSession, batch_size: int = 10000) -> int:
+    """Пересчитывает users.followers_count по таблице follows так же, как
+    reconcile_like_counts. От счётчика зависит порог рассылки твитов по лентам.
+    Возвращает количество исправленных пользователей.
+    """
+    actual = (
+        select(func.count(Follow.id))
+        .where(Follow.following_id == Users.id)
+        .correlate(Users)
+        .scalar_subquery()
+    )
+    return await _reconcile(session, Users, Users.followers_count, actual, batch_size)
+
+
+async def _reconcile(session: AsyncSession, model, counter, actual, batch_size: int) -> int:
+    fixed = 0
+    start = 0
+    while True:
+        # границы диапазонов берутся по существующим id, чтобы не проходить пустые промежутки
+        end = (
+            await session.execute(
+                select(func.max(model.id)).where(
+                    model.id.in_(
+                        select(model.id)
+                        .where(model.id >= start)
+                        .order_by(model.id)
+                        .limit(batch_size)
+                    )
+                )
+            )
+        ).scalar()
+        if end is None:
+            break
+        result = await session.execute(
+            update(model)
+            .where(model.id >= start, model.id <= end)
+            .where(counter != actual)
+            .values({counter: actual})
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        fixed += result.rowcount
+        start = end + 1
+    return fixed
+
+
+async def main():
+    async with async_session() as session:
+        likes_fixed = await reconcile_like_counts(session)
+        followers_fixed = await reconcile_followers_counts(session)
+    print(f"like_count fixed for {likes_fixed} tweets")
+    print(f"followers_count fixed for {followers_fixed} users")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
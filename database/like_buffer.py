@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, delete, exists, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .models import Like, Tweet, async_session
+from .requests import dialect_insert
+
+logger = logging.getLogger("twitterclone.likes")
+
+# Как часто буфер сбрасывается в базу, сек, и после скольких изменений сбрасывается сразу
+LIKE_FLUSH_INTERVAL = float(os.getenv("LIKE_FLUSH_INTERVAL", 0.05))
+LIKE_FLUSH_MAX_EVENTS = int(os.getenv("LIKE_FLUSH_MAX_EVENTS", 500))
+
+LikeKey = Tuple[int, int]
+
+
+async def get_like_state(session: AsyncSession, user_id: int, tweet_id: int) -> Optional[bool]:
+    """Стоит ли в базе лайк пользователя на твите; None, если твита нет."""
+    liked = exists().where(Like.tweet_id == Tweet.id, Like.user_id == user_id)
+    return (
+        await session.execute(select(liked).where(Tweet.id == tweet_id))
+    ).scalar_one_or_none()
+
+
+class LikeBuffer:
+    """Отложенная запись лайков.
+
+    like/unlike запоминают желаемое состояние пары (user_id, tweet_id), поэтому
+    повторные переключения схлопываются в одно. Фоновая задача каждые
+    flush_interval секунд (или после max_events изменений) пишет накопленное
+    одной транзакцией: многострочный INSERT ... ON CONFLICT DO NOTHING,
+    DELETE по списку пар и одно изменение like_count на твит по числу
+    действительно вставленных и удалённых строк.
+    """
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker = async_session,
+        flush_interval: float = LIKE_FLUSH_INTERVAL,
+        max_events: int = LIKE_FLUSH_MAX_EVENTS,
+    ):
+        self.session_maker = session_maker
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        # вызывается после записи со списком твитов, у которых изменился like_count,
+        # и пользователей, чьи лайки записаны
+        self.on_flush: Optional[Callable[[List[int], List[int]], Awaitable[None]]] = None
+        # желаемое состояние: True — лайк есть, False — лайка нет
+        self._pending: Dict[LikeKey, bool] = {}
+        self._inflight: Dict[LikeKey, bool] = {}
+        # пользователи с незаписанными изменениями, для чтения своих записей
+        self._pending_users: Set[int] = set()
+        self._inflight_users: Set[int] = set()
+        # блокировка создаётся в цикле событий, где работает буфер
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.events = 0
+        self.written = 0
+        self.flushes = 0
+
+    def state(self, user_id: int, tweet_id: int, persisted: bool) -> bool:
+        """Стоит ли лайк с учётом ещё не записанных изменений; persisted —
+        состояние в базе."""
+        key = (user_id, tweet_id)
+        return self._pending.get(key, self._inflight.get(key, persisted))
+
+    def record(self, user_id: int, tweet_id: int, liked: bool, persisted: bool) -> bool:
+        """Запоминает лайк (liked=True) или его снятие. Возвращает False, если
+        состояние уже такое."""
+        if self.state(user_id, tweet_id, persisted) == liked:
+            return False
+        self._pending[(user_id, tweet_id)] = liked
+        self._pending_users.add(user_id)
+        self.events += 1
+        if len(self._pending) >= self.max_events and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def record_persisted(self, user_id: int, tweet_id: int, liked: bool) -> Optional[bool]:
+        """record по состоянию, прочитанному из базы; None, если твита нет.
+
+        Сброс, завершившийся во время чтения, убирает пару из _inflight, и
+        прочитанное до его commit состояние устарело бы, поэтому тогда чтение
+        повторяется в новой транзакции.
+        """
+        while True:
+            flushes = self.flushes
+            async with self.session_maker() as session:
+                persisted = await get_like_state(session, user_id, tweet_id)
+            if persisted is None:
+                return None
+            if self.flushes == flushes:
+                return self.record(user_id, tweet_id, liked, persisted)
+
+    def has_pending(self, user_id: int) -> bool:
+        return user_id in self._pending_users or user_id in self._inflight_users
+
+    async def sync_user(self, user_id: int) -> None:
+        """Чтение своих записей: если у пользователя есть незаписанные лайки,
+        буфер сбрасывается до чтения."""
+        if self.has_pending(user_id):
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Пишет накопленные изменения; возвращает число изменённых строк likes."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._inflight, self._pending = self._pending, {}
+            self._inflight_users, self._pending_users = self._pending_users, set()
+            users = sorted(self._inflight_users)
+            try:
+                try:
+                    deltas = await self._write(self._inflight)
+                except BaseException:
+                    # более новые изменения из _pending важнее возвращаемых
+                    for key, liked in self._inflight.items():
+                        self._pending.setdefault(key, liked)
+                    self._pending_users |= self._inflight_users
+                    raise
+                finally:
+                    self._inflight = {}
+                written = sum(abs(delta) for delta in deltas.values())
+                self.written += written
+                self.flushes += 1
+                # on_flush выполняется под блокировкой, а пользователи остаются в
+                # _inflight_users до его конца: sync_user дождётся сброса кэша
+                changed = [tweet_id for tweet_id, delta in deltas.items() if delta]
+                if changed and self.on_flush is not None:
+                    await self.on_flush(changed, users)
+            finally:
+                self._inflight_users = set()
+        return written
+
+    async def _write(self, batch: Dict[LikeKey, bool]) -> Counter:
+        """Пишет изменения одной транзакцией; возвращает изменение like_count по твитам."""
+        keys = list(batch)
+        deltas: Counter = Counter()
+        async with self.session_maker() as session:
+            async with session.begin():
+                for start in range(0, len(keys), self.max_events):
+                    chunk = keys[start:start + self.max_events]
+                    await self._write_chunk(session, chunk, batch, deltas)
+                changed = {tweet_id: delta for tweet_id, delta in deltas.items() if delta}
+                if changed:
+                    await session.execute(
+                        update(Tweet.__table__)
+                        .where(Tweet.__table__.c.id == bindparam("b_id"))
+                        .values(like_count=Tweet.__table__.c.like_count + bindparam("b_delta")),
+                        [{"b_id": tweet_id, "b_delta": delta} for tweet_id, delta in changed.items()],
+                    )
+        return deltas
+
+    @staticmethod
+    async def _write_chunk(
+        session: AsyncSession, keys: List[LikeKey], batch: Dict[LikeKey, bool], deltas: Counter
+    ) -> None:
+        likes = Like.__table__
+        added = [key for key in keys if batch[key]]
+        removed = [key for key in keys if not batch[key]]
+        if added:
+            # твит мог быть удалён, пока лайк ждал записи
+            existing: Set[int] = set((await session.execute(
+                select(Tweet.id).where(Tweet.id.in_({tweet_id for _, tweet_id in added}))
+            )).scalars())
+            rows = [
+                {"user_id": user_id, "tweet_id": tweet_id}
+                for user_id, tweet_id in added if tweet_id in existing
+            ]
+            if rows:
+                inserted = await session.execute(
+                    dialect_insert(session, likes)
+                    .values(rows)
+                    .on_conflict_do_nothing(index_elements=[likes.c.user_id, likes.c.tweet_id])
+                    .returning(likes.c.tweet_id)
+                )
+                deltas.update(inserted.scalars())
+        if removed:
+            deleted = await session.execute(
+                delete(likes)
+                .where(tuple_(likes.c.user_id, likes.c.tweet_id).in_(removed))
+                .returning(likes.c.tweet_id)
+            )
+            deltas.subtract(deleted.scalars())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("like buffer flush failed, %d changes kept", len(self._pending))
+                await asyncio.sleep(self.flush_interval)
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает остаток буфера."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("like buffer lost %d changes on shutdown", len(self._pending))
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "events": self.events,
+            "written": self.written,
+            "flushes": self.flushes,
+        }
+
+
+like_buffer = LikeBuffer()
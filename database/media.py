@@ -0,0 +1,242 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from services.images import ImageVariant
+from services.storage import StoredObject
+
+from .models import Media, MediaObject, MediaVariant, TweetMedia, async_session
+from .requests import Executor, dialect_insert
+
+async def acquire_media_object(executor: Executor, stored: StoredObject) -> bool:
+    """Увеличивает ref_count содержимого, создавая запись при первой загрузке.
+
+    Возвращает True, если такое содержимое уже хранилось (дубликат).
+    """
+    stmt = dialect_insert(executor, MediaObject.__table__).values(
+        sha256=stored.sha256, path=stored.path, size=stored.size, ref_count=1
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaObject.sha256],
+        set_={"ref_count": MediaObject.__table__.c.ref_count + 1},
+    ).returning(MediaObject.__table__.c.ref_count)
+    ref_count = (await executor.execute(stmt)).scalar_one()
+    return ref_count > 1
+
+
+async def add_media(
+    session: AsyncSession, stored: StoredObject, mime_type: str, user_id: Optional[int] = None
+) -> Tuple[Media, bool]:
+    deduplicated = await acquire_media_object(session, stored)
+    media = Media(
+        path=stored.path, size=stored.size, sha256=stored.sha256, mime_type=mime_type,
+        user_id=user_id,
+    )
+    session.add(media)
+    await session.flush()
+    return media, deduplicated
+
+
+async def attach_media(
+    session: AsyncSession, user_id: int, attachments: Dict[int, List[int]]
+) -> None:
+    """Прикрепляет медиа к твитам ({tweet_id: [media_id, ...]}) в заданном порядке.
+
+    Существование и владельца всех медиа проверяет один запрос: чужие медиа
+    прикреплять нельзя, медиа без владельца (загруженные без api-key) при
+    первом прикреплении становится медиа пользователя. Медиа прикрепляется только к одному твиту: удаление твита освобождает его
+    медиа, и другой твит не должен потерять вложение.
+    """
+    all_ids = [media_id for ids in attachments.values() for media_id in ids]
+    media_ids = set(all_ids)
+    if not media_ids:
+        return
+    if len(all_ids) != len(media_ids):
+        raise HTTPException(status_code=409, detail="Media is already attached")
+    owners = dict(
+        (await session.execute(
+            select(Media.id, Media.user_id).where(Media.id.in_(media_ids))
+        )).all()
+    )
+    if media_ids - set(owners):
+        raise HTTPException(status_code=404, detail="Media not found")
+    if any(owner not in (None, user_id) for owner in owners.values()):
+        raise HTTPException(status_code=403, detail="Media belongs to another user")
+    attached = (await session.execute(
+        select(TweetMedia.media_id).where(TweetMedia.media_id.in_(media_ids)).limit(1)
+    )).first()
+    if attached:
+        raise HTTPException(status_code=409, detail="Media is already attached")
+    unowned = [media_id for media_id, owner in owners.items() if owner is None]
+    if unowned:
+        # условие user_id IS NULL: из двух одновременных запросов медиа получает только один
+        claimed = (await session.execute(
+            update(Media)
+            .where(Media.id.in_(unowned), Media.user_id.is_(None))
+            .values(user_id=user_id)
+            .returning(Media.id)
+            .execution_options(synchronize_session=False)
+        )).scalars().all()
+        if len(claimed) != len(unowned):
+            raise HTTPException(status_code=403, detail="Media belongs to another user")
+
+    await session.execute(
+        insert(TweetMedia),
+        [
+            {"tweet_id": tweet_id, "media_id": media_id, "position": position}
+            for tweet_id, ids in attachments.items()
+            for position, media_id in enumerate(ids)
+        ],
+    )
+
+
+async def detach_media(session: AsyncSession, tweet_id: int) -> List[int]:
+    """Удаляет вложения твита и возвращает id его медиа."""
+    return list(
+        (await session.execute(
+            delete(TweetMedia).where(TweetMedia.tweet_id == tweet_id).returning(TweetMedia.media_id)
+        )).scalars()
+    )
+
+
+async def release_media(session: AsyncSession, media_ids: Iterable[int]) -> List[str]:
+    """Удаляет medias, больше не прикреплённые ни к одному твиту, и
+    уменьшает ref_count их содержимого.
+
+    Возвращает sha256 содержимого, которое могло остаться без ссылок; его
+    записи и файлы удаляет purge_media_object.
+    """
+    media_ids = list(media_ids)
+    if not media_ids:
+        return []
+    released = (
+        await session.execute(
+            delete(Media)
+            .where(
+                Media.id.in_(media_ids),
+                # медиа могли снова прикрепить, пока задача ждала выполнения
+                ~select(TweetMedia.id).where(TweetMedia.media_id == Media.id).exists(),
+            )
+            .returning(Media.sha256)
+        )
+    ).scalars().all()
+    counts = Counter(sha256 for sha256 in released if sha256)
+    if not counts:
+        return []
+
+    objects = MediaObject.__table__
+    await session.execute(
+        update(objects)
+        .where(objects.c.sha256 == bindparam("b_sha256"))
+        .values(ref_count=objects.c.ref_count - bindparam("b_count")),
+        [{"b_sha256": sha256, "b_count": count} for sha256, count in counts.items()],
+    )
+    return sorted(counts)
+
+
+async def lock_media_object(session: AsyncSession, sha256: str, unreferenced: bool = False):
+    """Блокирует строку содержимого до конца транзакции и возвращает её путь;
+    None, если строки нет (или на неё ещё ссылаются при unreferenced=True).
+
+    Пустой UPDATE, а не SELECT FOR UPDATE: в SQLite он тоже берёт блокировку
+    записи. Повторная загрузка того же содержимого ждёт её в acquire_media_object.
+    """
+    objects = MediaObject.__table__
+    stmt = update(objects).where(objects.c.sha256 == sha256)
+    if unreferenced:
+        stmt = stmt.where(objects.c.ref_count <= 0)
+    return (
+        await session.execute(
+            stmt.values(ref_count=objects.c.ref_count).returning(objects.c.path)
+        )
+    ).scalar_one_or_none()
+
+
+async def purge_media_object(session: AsyncSession, sha256: str) -> List[str]:
+    """Удаляет содержимое без ссылок и его варианты; возвращает пути файлов.
+
+    Файлы нужно удалить до commit: пока строка заблокирована, загрузка того же
+    содержимого ждёт и после удаления запишет файл заново, а не сошлётся на
+    удалённый.
+    """
+    path = await lock_media_object(session, sha256, unreferenced=True)
+    if path is None:
+        return []
+    variants = await session.execute(
+        delete(MediaVariant).where(MediaVariant.sha256 == sha256).returning(MediaVariant.path)
+    )
+    variant_paths = list(variants.scalars())
+    await session.execute(delete(MediaObject).where(MediaObject.sha256 == sha256))
+    return [path] + variant_paths
+
+
+async def save_media_variants(
+    sha256: str, variants: List[ImageVariant], session_maker=async_session
+) -> bool:
+    """Сохраняет варианты изображения в отдельной транзакции (вызывается из
+    фоновой обработки, а не из запроса). False, если содержимое уже удалено:
+    тогда файлы вариантов удаляет вызывающий код."""
+    if not variants:
+        return True
+    async with session_maker() as session:
+        async with session.begin():
+            # без блокировки purge_media_object мог бы удалить содержимое между
+            # проверкой и вставкой, и варианты остались бы без владельца
+            if await lock_media_object(session, sha256) is None:
+                return False
+            stmt = dialect_insert(session, MediaVariant.__table__).on_conflict_do_nothing(
+                index_elements=[MediaVariant.sha256, MediaVariant.width]
+            )
+            await session.execute(
+                stmt, [dict(variant._asdict(), sha256=sha256) for variant in variants]
+            )
+    return True
+
+
+async def get_unprocessed_object(session: AsyncSession, sha256: str) -> Optional[str]:
+    """Путь к содержимому, для которого ещё нет вариантов; None, если варианты
+    уже есть или содержимое освобождено."""
+    return (
+        await session.execute(
+            select(MediaObject.path).where(
+                MediaObject.sha256 == sha256,
+                ~select(MediaVariant.sha256).where(MediaVariant.sha256 == sha256).exists(),
+            )
+        )
+    ).scalar_one_or_none()
+
+
+async def get_media_variant(session: AsyncSession, sha256: str, width: int):
+    """Ближайший к width вариант: самый узкий не уже width, иначе самый широкий."""
+    variants = (
+        await session.execute(
+            select(MediaVariant.width, MediaVariant.path, MediaVariant.mime_type)
+            .where(MediaVariant.sha256 == sha256)
+            .order_by(MediaVariant.width)
+        )
+    ).all()
+    for variant in variants:
+        if variant.width >= width:
+            return variant
+    return variants[-1] if variants else None
+
+
+async def get_media_stats(session: AsyncSession) -> dict:
+    uploads, logical_bytes = (
+        await session.execute(select(func.count(Media.id), func.sum(Media.size)))
+    ).one()
+    objects, stored_bytes = (
+        await session.execute(select(func.count(MediaObject.sha256), func.sum(MediaObject.size)))
+    ).one()
+    logical_bytes, stored_bytes = logical_bytes or 0, stored_bytes or 0
+    return {
+        "uploads": uploads,
+        "objects": objects,
+        "dedup_ratio": round(uploads / objects, 3) if objects else 1.0,
+        "logical_bytes": logical_bytes,
+        "stored_bytes": stored_bytes,
+        "saved_bytes": logical_bytes - stored_bytes,
+    }
@@ -0,0 +1,107 @@
+"""Переносит содержимое medias.file из базы в хранилище медиа пакетами.
+
+Запуск: python -m database.migrate_media [--batch-size N] [--drop-blob-column]
+"""
+import argparse
+import asyncio
+import io
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from services.storage import MediaStorage, media_storage
+
+from .media import acquire_media_object
+from .models import MediaObject, engine
+
+METADATA_COLUMNS = {
+    "path": "VARCHAR(255)",
+    "size": "BIGINT",
+    "mime_type": "VARCHAR(100)",
+    "sha256": "VARCHAR(64)",
+}
+
+
+async def ensure_metadata_columns(engine: AsyncEngine) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(MediaObject.__table__.create, checkfirst=True)
+        existing = await conn.run_sync(
+            lambda sync_conn: {c["name"] for c in inspect(sync_conn).get_columns("medias")}
+        )
+        for name, ddl_type in METADATA_COLUMNS.items():
+            if name not in existing:
+                await conn.execute(text(f"ALTER TABLE medias ADD COLUMN {name} {ddl_type}"))
+
+
+async def migrate_media_blobs(
+    engine: AsyncEngine, storage: MediaStorage, batch_size: int = 100
+) -> int:
+    """Выгружает ещё не перенесённые blob-ы в storage и заполняет метаданные.
+
+    Каждый пакет читается по возрастанию id и фиксируется отдельной
+    транзакцией, поэтому миграцию можно прервать и запустить повторно.
+    """
+    await ensure_metadata_columns(engine)
+    moved, last_id = 0, 0
+    while True:
+        async with engine.begin() as conn:
+            rows = (
+                await conn.execute(
+                    text(
+                        "SELECT id, file FROM medias "
+                        "WHERE path IS NULL AND file IS NOT NULL AND id > :last_id "
+                        "ORDER BY id LIMIT :batch_size"
+                    ),
+                    {"last_id": last_id, "batch_size": batch_size},
+                )
+            ).all()
+            if not rows:
+                return moved
+
+            for media_id, blob in rows:
+                stored = await storage.save(io.BytesIO(blob))
+                await acquire_media_object(conn, stored)
+                await conn.execute(
+                    text(
+                        "UPDATE medias SET path = :path, size = :size, "
+                        "sha256 = :sha256, mime_type = COALESCE(mime_type, :mime_type) "
+                        "WHERE id = :id"
+                    ),
+                    {
+                        "id": media_id,
+                        "path": stored.path,
+                        "size": stored.size,
+                        "sha256": stored.sha256,
+                        "mime_type": stored.mime_type or "image/jpeg",
+                    },
+                )
+            moved += len(rows)
+            last_id = rows[-1][0]
+
+
+async def drop_blob_column(engine: AsyncEngine) -> None:
+    async with engine.begin() as conn:
+        left = (
+            await conn.execute(text("SELECT count(*) FROM medias WHERE path IS NULL"))
+        ).scalar()
+        if left:
+            raise RuntimeError(f"{left} media rows are not migrated yet")
+        await conn.execute(text("ALTER TABLE medias DROP COLUMN file"))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--drop-blob-column", action="store_true")
+    args = parser.parse_args()
+
+    moved = await migrate_media_blobs(engine, media_storage, args.batch_size)
+    print(f"moved {moved} media blobs")
+    if args.drop_blob_column:
+        await drop_blob_column(engine)
+        print("medias.file dropped")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
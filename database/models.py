@@ -1,42 +1,72 @@
 import os
-from typing import Optional, List
+from typing import AsyncIterator
 
 from dotenv import load_dotenv
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, String, Text,
-                        UniqueConstraint, func, LargeBinary)
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy import (BigInteger, Column, DateTime, ForeignKey, Index, Integer, JSON,
+                        String, Text, UniqueConstraint, func, PrimaryKeyConstraint)
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import (AsyncSession, async_sessionmaker,
                                     create_async_engine)
-from sqlalchemy.orm import (DeclarativeBase, Mapped, relationship, mapped_column)
+from sqlalchemy.orm import DeclarativeBase, relationship
 
 load_dotenv()
 
-engine = create_async_engine(str(os.getenv("ENGINE")))
+
+def engine_options(url: str, prefix: str = "DB_") -> dict:
+    """Настройки пула соединений, переопределяются переменными окружения DB_POOL_*
+    (для реплики — REPLICA_DB_POOL_*, по умолчанию равны DB_POOL_*)."""
+
+    def setting(name: str, default):
+        return os.getenv(prefix + name, os.getenv("DB_" + name, default))
+
+    options = {
+        "pool_pre_ping": True,
+        "pool_recycle": int(setting("POOL_RECYCLE", 1800)),
+    }
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=int(setting("POOL_SIZE", 10)),
+            max_overflow=int(setting("MAX_OVERFLOW", 20)),
+            pool_timeout=float(setting("POOL_TIMEOUT", 30)),
+        )
+    return options
+
+
+engine = create_async_engine(
+    str(os.getenv("ENGINE")), **engine_options(str(os.getenv("ENGINE")))
+)
 
 async_session = async_sessionmaker(
     bind=engine, class_=AsyncSession, expire_on_commit=False
 )
-session = async_session()
 
-async def get_session() -> AsyncSession:
+# Необязательная реплика только для чтения со своим пулом; без неё чтение идёт в ENGINE
+REPLICA_ENGINE = os.getenv("REPLICA_ENGINE")
+
+replica_engine = (
+    create_async_engine(REPLICA_ENGINE, **engine_options(REPLICA_ENGINE, "REPLICA_DB_"))
+    if REPLICA_ENGINE else engine
+)
+
+replica_session = async_sessionmaker(
+    bind=replica_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """Отдельная сессия на каждый запрос: commit при успехе, rollback при ошибке."""
     async with async_session() as session:
         try:
             yield session
             await session.commit()
-        except:
+        except Exception:
             await session.rollback()
             raise
-            await session.close()
 
 
 class Base(DeclarativeBase):
     pass
 
-async def create_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-
-
 class Tweet(Base):
     __tablename__ = "tweets"
     id = Column(Integer, primary_key=True)
@@ -44,13 +74,16 @@ class Tweet(Base):
         Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
     tweet_data = Column(Text, nullable=False)
-    # tweet_media_ids: Mapped[Optional[List[int]]] = Column(
-    #     ARRAY(Integer), nullable=True
-    # )
-    tweet_media_ids: Mapped[Optional[List[int]]] = mapped_column(
-        ARRAY(Integer, dimensions=1), nullable=True
-    )
     created_at = Column(DateTime, default=func.now())
+    # Денормализованный счётчик лайков, обновляется вместе с таблицей likes
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_tweets_like_count_id", "like_count", "id"),
+        # твиты автора по убыванию id: лента, профиль, рассылка при подписке
+        Index("ix_tweets_user_id_id", "user_id", "id"),
+        Index("ix_tweets_created_at", "created_at"),
+    )
 
     user = relationship("Users", back_populates="tweets")
     likes = relationship(
@@ -58,11 +91,69 @@ class Tweet(Base):
     )
 
 
+class TweetMedia(Base):
+    """Вложения твита в порядке position."""
+
+    __tablename__ = "tweet_media"
+    id = Column(Integer, primary_key=True)
+    tweet_id = Column(
+        Integer, ForeignKey("tweets.id", ondelete="CASCADE"), nullable=False
+    )
+    media_id = Column(
+        Integer, ForeignKey("medias.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    position = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("tweet_id", "position", name="unique_tweet_media_position"),
+    )
+
+
+
+class MediaObject(Base):
+    """Уникальное содержимое в хранилище; ref_count — число ссылающихся medias."""
+
+    __tablename__ = "media_objects"
+    sha256 = Column(String(64), primary_key=True)
+    path = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime, default=func.now())
+
+
+class MediaVariant(Base):
+    """Уменьшенная перекодированная копия изображения без метаданных.
+
+    Привязана к содержимому, а не к medias, поэтому одинаковые загрузки делят варианты.
+    """
+
+    __tablename__ = "media_variants"
+    sha256 = Column(String(64), ForeignKey("media_objects.sha256"), nullable=False)
+    width = Column(Integer, nullable=False)
+    height = Column(Integer, nullable=False)
+    path = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    mime_type = Column(String(100), nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("sha256", "width", name="pk_media_variants"),
+    )
+
 
 class Media(Base):
     __tablename__ = "medias"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    file = Column(LargeBinary)
+    # Содержимое лежит в хранилище services.storage, здесь только метаданные
+    path = Column(String(255))
+    size = Column(BigInteger)
+    mime_type = Column(String(100))
+    sha256 = Column(String(64), ForeignKey("media_objects.sha256"), index=True)
+    # Загрузивший пользователь; прикрепить медиа к твиту может только он
+    user_id = Column(
+        Integer,
+        ForeignKey("users.id", ondelete="SET NULL", name="fk_medias_user_id_users"),
+        nullable=True,
+    )
     created_at = Column(DateTime, default=func.now())
 
 
@@ -79,6 +170,8 @@ class Like(Base):
 
     __table_args__ = (
         UniqueConstraint("user_id", "tweet_id", name="unique_user_tweet_like"),
+        # обратный порядок для лайков одного твита
+        Index("ix_likes_tweet_id_user_id", "tweet_id", "user_id"),
     )
 
     user = relationship("Users", back_populates="likes")
@@ -98,6 +191,8 @@ class Follow(Base):
 
     __table_args__ = (
         UniqueConstraint("follower_id", "following_id", name="unique_follow"),
+        # обратный порядок для подписчиков пользователя
+        Index("ix_follows_following_id_follower_id", "following_id", "follower_id"),
     )
 
     follower = relationship(
@@ -108,11 +203,54 @@ class Follow(Base):
     )
 
 
+class TimelineEntry(Base):
+    """Материализованная лента: id твитов, разосланных подписчикам при публикации."""
+
+    __tablename__ = "timeline_entries"
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    tweet_id = Column(
+        Integer, ForeignKey("tweets.id", ondelete="CASCADE"), nullable=False
+    )
+
+    __table_args__ = (
+        PrimaryKeyConstraint("user_id", "tweet_id", name="pk_timeline_entries"),
+        Index("ix_timeline_entries_tweet_id", "tweet_id"),
+    )
+
+
+class QueuedJob(Base):
+    """Задача фоновой очереди (services.job_queue) в базе: ставится в той же
+    транзакции, что и основная запись."""
+
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(100), nullable=False)
+    payload = Column(JSON, nullable=False)
+    # повторная постановка с тем же ключом игнорируется
+    idempotency_key = Column(String(255), unique=True)
+    # pending, running, done или failed
+    status = Column(String(20), nullable=False, default="pending", server_default="pending")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    run_at = Column(DateTime, nullable=False)
+    # до этого момента задача принадлежит взявшему её воркеру
+    locked_until = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
+
+
 class Users(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
     name = Column(String(255), unique=True)
     api_key = Column(String(255), unique=True)
+    # Денормализованный счётчик подписчиков, обновляется в follow/unfollow
+    followers_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Отношения
     tweets = relationship("Tweet", back_populates="user", cascade="all, delete")
@@ -130,6 +268,3 @@ class Users(Base):
         cascade="all, delete",
     )
 
-
-#
-# asyncio.run(create_db())
@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+# Структуры ответа ленты. Вместо словаря на каждую строку — объекты со
+# __slots__, которые orjson сериализует напрямую, без jsonable_encoder.
+
+
+@dataclass
+class AuthorPayload:
+    __slots__ = ("id", "name")
+    id: int
+    name: str
+
+
+@dataclass
+class LikePayload:
+    __slots__ = ("user_id", "name")
+    user_id: int
+    name: str
+
+
+@dataclass
+class TweetPayload:
+    __slots__ = ("id", "content", "attachments", "author", "likes")
+    id: int
+    content: str
+    attachments: Optional[List[str]]
+    author: AuthorPayload
+    likes: List[LikePayload]
@@ -0,0 +1,196 @@
+"""Фоновые задачи записи: рассылка твитов по лентам, заполнение ленты после
+подписки, создание вариантов изображений и освобождение медиа удалённого твита.
+
+Бэкенд очереди выбирается JOB_QUEUE_BACKEND: database (по умолчанию) — задачи
+в таблице jobs ставятся в транзакции запроса и переживают перезапуск;
+memory — очередь в памяти процесса для тестов.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services import image_pipeline, media_storage
+from services.job_queue import Job, JobQueue, JobQueueBackend, MemoryJobQueueBackend
+
+from .media import (
+    get_unprocessed_object, purge_media_object, release_media, save_media_variants,
+)
+from .models import QueuedJob, async_session
+from .requests import dialect_insert
+from .timeline import backfill_followee_timeline, fan_out_tweets
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "database")
+# Сколько секунд задача принадлежит воркеру; после этого её может взять другой
+JOB_LEASE = float(os.getenv("JOB_LEASE", 300))
+# Сколько секунд хранятся упавшие задачи и задачи с ключом идемпотентности
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", 7 * 24 * 3600))
+
+
+class DatabaseJobQueueBackend(JobQueueBackend):
+    """Задачи в таблице jobs. Воркеры разных процессов забирают задачи
+    UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED), а задача
+    упавшего воркера возвращается в работу после истечения аренды.
+
+    Выполненная задача удаляется сразу, если у неё нет ключа идемпотентности;
+    задачи с ключом (он защищает от повторной постановки) и упавшие задачи
+    удаляет sweep через retention секунд."""
+
+    def __init__(
+        self,
+        session_maker: async_sessionmaker = async_session,
+        lease: float = JOB_LEASE,
+        retention: float = JOB_RETENTION,
+    ):
+        self.session_maker = session_maker
+        self.lease = lease
+        self.retention = retention
+
+    async def enqueue(
+        self, session: Optional[AsyncSession], kind: str, payload: dict, key: Optional[str]
+    ) -> None:
+        if session is None:
+            async with self.session_maker() as own_session:
+                async with own_session.begin():
+                    await self.enqueue(own_session, kind, payload, key)
+            return
+        await session.execute(
+            dialect_insert(session, QueuedJob.__table__)
+            .values(kind=kind, payload=payload, idempotency_key=key, run_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=[QueuedJob.idempotency_key])
+        )
+
+    async def claim(self, limit: int) -> List[Job]:
+        now = datetime.utcnow()
+        claimable = (
+            select(QueuedJob.id)
+            .where(or_(
+                and_(QueuedJob.status == "pending", QueuedJob.run_at <= now),
+                and_(QueuedJob.status == "running", QueuedJob.locked_until < now),
+            ))
+            .order_by(QueuedJob.run_at, QueuedJob.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        async with self.session_maker() as session:
+            async with session.begin():
+                rows = (await session.execute(
+                    update(QueuedJob)
+                    .where(QueuedJob.id.in_(claimable))
+                    .values(
+                        status="running",
+                        attempts=QueuedJob.attempts + 1,
+                        locked_until=now + timedelta(seconds=self.lease),
+                    )
+                    .returning(QueuedJob.id, QueuedJob.kind, QueuedJob.payload, QueuedJob.attempts)
+                    .execution_options(synchronize_session=False)
+                )).all()
+        return [Job(*row) for row in rows]
+
+    async def _finish(self, job: Job, **values) -> None:
+        async with self.session_maker() as session:
+            async with session.begin():
+                await session.execute(
+                    update(QueuedJob)
+                    .where(QueuedJob.id == job.id)
+                    .values(locked_until=None, **values)
+                    .execution_options(synchronize_session=False)
+                )
+
+    async def complete(self, job: Job) -> None:
+        async with self.session_maker() as session:
+            async with session.begin():
+                deleted = await session.execute(
+                    delete(QueuedJob)
+                    .where(QueuedJob.id == job.id, QueuedJob.idempotency_key.is_(None))
+                    .execution_options(synchronize_session=False)
+                )
+        if not deleted.rowcount:
+            await self._finish(job, status="done")
+
+    async def retry(self, job: Job, delay: float, error: str) -> None:
+        await self._finish(
+            job, status="pending", last_error=error,
+            run_at=datetime.utcnow() + timedelta(seconds=delay),
+        )
+
+    async def fail(self, job: Job, error: str) -> None:
+        await self._finish(job, status="failed", last_error=error)
+
+    async def pending(self) -> int:
+        async with self.session_maker() as session:
+            return (await session.execute(
+                select(func.count(QueuedJob.id))
+                .where(QueuedJob.status.in_(("pending", "running")))
+            )).scalar_one()
+
+    async def sweep(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention)
+        async with self.session_maker() as session:
+            async with session.begin():
+                swept = await session.execute(
+                    delete(QueuedJob)
+                    .where(QueuedJob.status.in_(("done", "failed")), QueuedJob.run_at < cutoff)
+                    .execution_options(synchronize_session=False)
+                )
+        return swept.rowcount
+
+
+def create_job_queue(backend: str = JOB_QUEUE_BACKEND) -> JobQueue:
+    if backend == "memory":
+        return JobQueue(MemoryJobQueueBackend())
+    return JobQueue(DatabaseJobQueueBackend())
+
+
+job_queue = create_job_queue()
+
+
+@job_queue.handler("timeline.fan_out")
+async def fan_out_job(payload: dict) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await fan_out_tweets(session, payload["tweet_ids"], payload["author_id"])
+
+
+@job_queue.handler("timeline.backfill")
+async def backfill_job(payload: dict) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            await backfill_followee_timeline(session, payload["user_id"], payload["followee_ids"])
+
+
+@job_queue.handler("media.release")
+async def release_media_job(payload: dict) -> None:
+    async with async_session() as session:
+        async with session.begin():
+            unreferenced = await release_media(session, payload["media_ids"])
+            if unreferenced:
+                # в той же транзакции: повтор release уже не найдёт удалённые medias
+                await job_queue.enqueue("media.purge", {"sha256": unreferenced}, session=session)
+
+
+@job_queue.handler("media.purge")
+async def purge_media_job(payload: dict) -> None:
+    for sha256 in payload["sha256"]:
+        async with async_session() as session:
+            async with session.begin():
+                # файлы удаляются под блокировкой строки, до commit; если commit
+                # не пройдёт, повтор найдёт строку снова, а отсутствующий файл не ошибка
+                for path in await purge_media_object(session, sha256):
+                    await media_storage.delete(path)
+
+
+@job_queue.handler("media.variants")
+async def media_variants_job(payload: dict) -> None:
+    sha256 = payload["sha256"]
+    async with async_session() as session:
+        path = await get_unprocessed_object(session, sha256)
+    # одинаковые загрузки ставят задачу каждая, варианты создаются один раз
+    if path is not None:
+        variants = await image_pipeline.process(sha256, path)
+        if not await save_media_variants(sha256, variants):
+            # содержимое удалили, пока шла обработка
+            for variant in variants:
+                await media_storage.delete(variant.path)
@@ -1,17 +1,224 @@
+import os
+from typing import List, NamedTuple, Optional, Tuple, Union
+
 from fastapi import HTTPException
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, event, func, literal_column, null, or_, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from services.cache import TTLCache
+
+from .models import Follow, Like, Tweet, TweetMedia, Users
+from .payloads import AuthorPayload, LikePayload, TweetPayload
+
+
+Executor = Union[AsyncSession, AsyncConnection]
+
 
-from .models import Users
+def dialect_insert(executor: Executor, entity):
+    """INSERT с поддержкой ON CONFLICT для диалекта текущего подключения."""
+    dialect = executor.bind.dialect if isinstance(executor, AsyncSession) else executor.dialect
+    if dialect.name == "postgresql":
+        return postgresql.insert(entity)
+    return sqlite.insert(entity)
 
 
-async def get_user_by_api_key(api_key: str, session: AsyncSession):
-    stmt = select(Users).where(Users.api_key == api_key )
-    result = await session.execute(stmt)
+class AuthUser(NamedTuple):
+    id: int
+    name: str
 
-    user = result.scalar_one_or_none()
+
+api_key_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", 60)),
+)
+
+
+async def get_user_by_api_key(api_key: str, session: AsyncSession) -> AuthUser:
+    async def load():
+        stmt = select(Users.id, Users.name).where(Users.api_key == api_key )
+        row = (await session.execute(stmt)).one_or_none()
+        return AuthUser(row.id, row.name) if row else None
+
+    user = await api_key_cache.get_or_load(api_key, load)
 
     if not user:
         raise HTTPException(status_code=401, detail="Invalid API key")
 
     return user
+
+
+def invalidate_api_key(api_key: str) -> None:
+    api_key_cache.invalidate(api_key)
+
+
+def invalidate_user(user_id: int) -> None:
+    api_key_cache.invalidate_if(lambda key, user: user.id == user_id)
+
+
+@event.listens_for(Users, "after_update")
+@event.listens_for(Users, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+def encode_feed_cursor(likes_count: int, tweet_id: int) -> str:
+    return f"{likes_count}:{tweet_id}"
+
+
+def decode_feed_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        likes_count, tweet_id = cursor.split(":")
+        return int(likes_count), int(tweet_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+async def get_feed_page(
+    session: AsyncSession, user_id: int, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[TweetPayload], Optional[str]]:
+    """Страница ленты: твиты пользователя и тех, на кого он подписан.
+
+    Сортировка (лайки, id) по убыванию выполняется в базе, продолжение
+    страницы задаётся курсором по последней паре (лайки, id).
+    """
+    followees = select(Follow.following_id).where(Follow.follower_id == user_id)
+
+    stmt = (
+        tweet_rows_query()
+        .where(or_(Tweet.user_id == user_id, Tweet.user_id.in_(followees)))
+        .order_by(Tweet.like_count.desc(), Tweet.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        last_likes, last_id = decode_feed_cursor(cursor)
+        stmt = stmt.where(
+            or_(
+                Tweet.like_count < last_likes,
+                and_(Tweet.like_count == last_likes, Tweet.id < last_id),
+            )
+        )
+
+    rows = (await session.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_feed_cursor(rows[-1].likes_count, rows[-1].id)
+
+    return await serialize_tweets(session, rows), next_cursor
+
+
+def tweet_rows_query():
+    return select(
+        Tweet.id, Tweet.tweet_data,
+        Users.id.label("user_id"), Users.name.label("user_name"),
+        Tweet.like_count.label("likes_count"),
+    ).join(Users, Tweet.user_id == Users.id)
+
+
+async def serialize_tweets(session: AsyncSession, rows) -> List[TweetPayload]:
+    """Собирает ответ по строкам tweet_rows_query: лайки и вложения
+    загружаются одним IN-запросом каждые и только для твитов страницы."""
+    tweet_likes = {row.id: [] for row in rows}
+    tweet_attachments = {row.id: [] for row in rows}
+    if tweet_likes:
+        likes_data = await session.execute(
+            select(Like.tweet_id, Like.user_id, Users.name)
+            .join(Users, Like.user_id == Users.id)
+            .where(Like.tweet_id.in_(list(tweet_likes)))
+        )
+        for tweet_id, like_user_id, user_name in likes_data:
+            tweet_likes[tweet_id].append(LikePayload(like_user_id, user_name))
+
+        media_data = await session.execute(
+            select(TweetMedia.tweet_id, TweetMedia.media_id)
+            .where(TweetMedia.tweet_id.in_(list(tweet_attachments)))
+            .order_by(TweetMedia.tweet_id, TweetMedia.position)
+        )
+        for tweet_id, media_id in media_data:
+            tweet_attachments[tweet_id].append(f"/api/medias/{media_id}")
+
+    return [
+        TweetPayload(
+            row.id, row.tweet_data,
+            tweet_attachments[row.id] or None,
+            AuthorPayload(row.user_id, row.user_name),
+            tweet_likes[row.id],
+        )
+        for row in rows
+    ]
+
+
+async def get_profile(
+    session: AsyncSession,
+    user_id: int,
+    limit: int,
+    followers_cursor: Optional[int] = None,
+    following_cursor: Optional[int] = None,
+) -> Optional[dict]:
+    """Профиль со страницами подписчиков и подписок за один запрос к базе.
+
+    Пользователь и оба списка объединяются через UNION ALL с колонкой kind;
+    списки идут по возрастанию id, курсор — id последнего элемента страницы.
+    Число подписчиков берётся из users.followers_count, число подписок
+    считается по индексу unique_follow.
+    """
+    following_count = (
+        select(func.count(Follow.id))
+        .where(Follow.follower_id == Users.id)
+        .correlate(Users)
+        .scalar_subquery()
+    )
+    profile = select(
+        literal_column("'user'").label("kind"), Users.id, Users.name,
+        Users.followers_count.label("followers_count"),
+        following_count.label("following_count"),
+    ).where(Users.id == user_id)
+
+    def page(kind: str, join_on, owner_column, cursor: Optional[int]):
+        stmt = (
+            select(
+                literal_column(f"'{kind}'").label("kind"), Users.id, Users.name,
+                null().label("followers_count"), null().label("following_count"),
+            )
+            .join(Follow, join_on)
+            .where(owner_column == user_id)
+            .order_by(Users.id)
+            .limit(limit + 1)
+        )
+        if cursor is not None:
+            stmt = stmt.where(Users.id > cursor)
+        return select(stmt.subquery())
+
+    followers = page("follower", Follow.follower_id == Users.id, Follow.following_id, followers_cursor)
+    following = page("following", Follow.following_id == Users.id, Follow.follower_id, following_cursor)
+
+    rows = (await session.execute(union_all(profile, followers, following))).all()
+
+    user, lists = None, {"follower": [], "following": []}
+    for row in rows:
+        if row.kind == "user":
+            user = row
+        else:
+            lists[row.kind].append({"id": row.id, "name": row.name})
+    if user is None:
+        return None
+
+    def next_cursor(items: list) -> Optional[int]:
+        if len(items) > limit:
+            del items[limit:]
+            return items[-1]["id"]
+        return None
+
+    followers_next = next_cursor(lists["follower"])
+    following_next = next_cursor(lists["following"])
+    return {
+        "id": user.id,
+        "name": user.name,
+        "followers": lists["follower"],
+        "following": lists["following"],
+        "followers_count": user.followers_count,
+        "following_count": user.following_count,
+        "followers_next_cursor": followers_next,
+        "following_next_cursor": following_next,
+    }
@@ -0,0 +1,70 @@
+import os
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from services.cache import TTLCache
+
+from .models import async_session, replica_session
+
+# Сколько секунд после записи пользователь читает из основной базы: больше
+# задержки репликации, иначе он может не увидеть только что записанное
+REPLICA_LAG_WINDOW = float(os.getenv("REPLICA_LAG_WINDOW", 5))
+REPLICA_GUARD_SIZE = int(os.getenv("REPLICA_GUARD_SIZE", 100000))
+
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class ReadRouter:
+    """Выбор базы для чтения.
+
+    Читающие запросы идут в реплику, кроме пользователей (по api-key), которые
+    писали в последние window секунд: они читают из основной базы, пока
+    реплика догоняет их запись. Отметки живут в памяти процесса.
+    """
+
+    def __init__(
+        self,
+        primary: async_sessionmaker = async_session,
+        replica: async_sessionmaker = replica_session,
+        window: float = REPLICA_LAG_WINDOW,
+        maxsize: int = REPLICA_GUARD_SIZE,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.recent_writers = TTLCache(maxsize, window)
+        self.primary_reads = 0
+        self.replica_reads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.replica is not self.primary
+
+    def mark_write(self, api_key: Optional[str]) -> None:
+        if api_key and self.enabled:
+            self.recent_writers.set(api_key, True)
+
+    def session_maker(self, api_key: Optional[str]) -> async_sessionmaker:
+        if self.enabled and not (api_key and self.recent_writers.get(api_key)):
+            self.replica_reads += 1
+            return self.replica
+        self.primary_reads += 1
+        return self.primary
+
+    def stats(self) -> dict:
+        return {
+            "enabled": int(self.enabled),
+            "primary_reads": self.primary_reads,
+            "replica_reads": self.replica_reads,
+            "recent_writers": self.recent_writers.stats()["size"],
+        }
+
+
+read_router = ReadRouter()
+
+
+async def get_read_session(request: Request) -> AsyncIterator[AsyncSession]:
+    """Сессия только для чтения: реплика или основная база по правилам read_router."""
+    async with read_router.session_maker(request.headers.get("api-key"))() as session:
+        yield session
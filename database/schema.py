@@ -0,0 +1,75 @@
+import os
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SchemaVersionError(RuntimeError):
+    pass
+
+
+# Полнотекстовый индекс создаётся SQL миграции 0008 и не описан в моделях
+SEARCH_INDEX_OBJECTS = frozenset(("search_vector", "ix_tweets_search_vector"))
+SEARCH_INDEX_TABLE_PREFIX = "tweets_fts"
+
+
+def include_object_for(dialect_name: str):
+    """Фильтр autogenerate: индексы с ddl_if для другого диалекта
+    (GIN только в PostgreSQL) не считаются отсутствующими, объекты
+    полнотекстового поиска — лишними."""
+    def include_object(obj, name, type_, reflected, compare_to) -> bool:
+        if reflected and compare_to is None and (
+            name in SEARCH_INDEX_OBJECTS
+            or type_ == "table" and name.startswith(SEARCH_INDEX_TABLE_PREFIX)
+        ):
+            return False
+        ddl_if = getattr(obj, "_ddl_if", None)
+        if type_ == "index" and ddl_if is not None and ddl_if.dialect is not None:
+            return ddl_if.dialect == dialect_name
+        return True
+
+    return include_object
+
+
+def alembic_config(connection=None) -> Config:
+    config = Config(os.path.join(ROOT_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(ROOT_DIR, "migrations"))
+    config.attributes["connection"] = connection
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def head_revision() -> Optional[str]:
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+async def current_revision(engine: AsyncEngine) -> Optional[str]:
+    async with engine.connect() as conn:
+        return await conn.run_sync(
+            lambda sync_conn: MigrationContext.configure(sync_conn).get_current_revision()
+        )
+
+
+async def upgrade_schema(engine: AsyncEngine, revision: str = "head") -> None:
+    """То же, что alembic upgrade head, на соединении переданного движка."""
+    async with engine.connect() as conn:
+        await conn.run_sync(
+            lambda sync_conn: command.upgrade(alembic_config(sync_conn), revision)
+        )
+        await conn.commit()
+
+
+async def check_schema_version(engine: AsyncEngine) -> None:
+    """Проверка при старте: схема базы должна быть на последней миграции."""
+    current, head = await current_revision(engine), head_revision()
+    if current != head:
+        raise SchemaVersionError(
+            f"Database schema revision is {current}, expected {head}: "
+            "run `alembic upgrade head`"
+        )
@@ -6,3 +6,15 @@ from pydantic import BaseModel
 class TweetIN(BaseModel):
     tweet_data: str
     tweet_media_ids: Optional[List[int]]
+
+
+class TweetsBatchIN(BaseModel):
+    tweets: List[TweetIN]
+
+
+class LikesBatchIN(BaseModel):
+    tweet_ids: List[int]
+
+
+class FollowsBatchIN(BaseModel):
+    user_ids: List[int]
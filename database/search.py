@@ -0,0 +1,107 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, column, func, literal_column, or_, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Tweet
+from .payloads import TweetPayload
+from .requests import serialize_tweets, tweet_rows_query
+
+# Конфигурация PostgreSQL, с которой миграция 0008 строит tweets.search_vector
+SEARCH_CONFIG = "pg_catalog.simple"
+# Ранжируются только столько самых новых совпадений: для частых слов ранг
+# всех совпадений стоил бы полного просмотра индекса на каждый запрос
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", 10000))
+
+tweets_fts = table("tweets_fts", column("rowid"))
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def fts5_query(query: str) -> str:
+    """Слова запроса в кавычках через пробел (все должны встретиться):
+    синтаксис FTS5 из пользовательского ввода не интерпретируется."""
+    return " ".join(f'"{word}"' for word in _WORD.findall(query))
+
+
+def encode_search_cursor(rank: float, tweet_id: int) -> str:
+    # repr сохраняет float точно, сравнение с рангом в базе не теряет строк
+    return f"{rank!r}:{tweet_id}"
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        rank, tweet_id = cursor.split(":")
+        return float(rank), int(tweet_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+def search_matches(dialect: str, query: str, max_candidates: int = SEARCH_MAX_CANDIDATES):
+    """id найденных твитов и ранг (больше — релевантнее) по индексу диалекта;
+    из совпадений берутся max_candidates самых новых."""
+    if dialect == "postgresql":
+        search_vector = literal_column("tweets.search_vector")
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+        candidates = (
+            select(Tweet.id)
+            .where(search_vector.op("@@")(tsquery))
+            .order_by(Tweet.id.desc())
+            .limit(max_candidates)
+            .subquery()
+        )
+        return (
+            select(Tweet.id.label("id"), func.ts_rank(search_vector, tsquery).label("rank"))
+            .join(candidates, candidates.c.id == Tweet.id)
+        )
+    fts = literal_column("tweets_fts")
+    return (
+        # bm25 тем меньше, чем документ релевантнее; FTS5 отдаёт rowid по убыванию
+        # без сортировки, поэтому bm25 считается только для отобранных строк
+        select(tweets_fts.c.rowid.label("id"), (-func.bm25(fts)).label("rank"))
+        .select_from(tweets_fts)
+        .where(fts.op("MATCH")(fts5_query(query)))
+        .order_by(tweets_fts.c.rowid.desc())
+        .limit(max_candidates)
+    )
+
+
+async def search_tweets(
+    session: AsyncSession, query: str, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[TweetPayload], Optional[str]]:
+    """Страница поиска по тексту твитов.
+
+    Кандидаты берутся из полнотекстового индекса (GIN по tsvector в PostgreSQL,
+    FTS5 в SQLite), сортировка — по рангу и id по убыванию, продолжение
+    страницы задаётся курсором по последней паре (ранг, id).
+    """
+    dialect = session.bind.dialect.name
+    if dialect != "postgresql" and not fts5_query(query):
+        return [], None
+
+    matches = search_matches(dialect, query).subquery()
+    stmt = (
+        tweet_rows_query()
+        .add_columns(matches.c.rank)
+        .join(matches, matches.c.id == Tweet.id)
+        .order_by(matches.c.rank.desc(), Tweet.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        last_rank, last_id = decode_search_cursor(cursor)
+        stmt = stmt.where(
+            or_(
+                matches.c.rank < last_rank,
+                and_(matches.c.rank == last_rank, Tweet.id < last_id),
+            )
+        )
+
+    rows = (await session.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_search_cursor(rows[-1].rank, rows[-1].id)
+
+    return await serialize_tweets(session, rows), next_cursor
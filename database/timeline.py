@@ -0,0 +1,188 @@
+import os
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, literal, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from .models import Follow, TimelineEntry, Tweet, Users
+from .payloads import TweetPayload
+from .requests import dialect_insert, serialize_tweets, tweet_rows_query
+
+# Авторы с большим числом подписчиков не рассылают твиты при записи:
+# их твиты подмешиваются в ленту при чтении.
+FANOUT_FOLLOWERS_LIMIT = int(os.getenv("TIMELINE_FANOUT_FOLLOWERS_LIMIT", 10000))
+# Сколько последних твитов хранится в ленте одного пользователя.
+TIMELINE_MAX_ENTRIES = int(os.getenv("TIMELINE_MAX_ENTRIES", 800))
+
+
+async def add_to_author_timeline(
+    session: AsyncSession, tweet_ids: List[int], author_id: int
+) -> None:
+    """Новые твиты сразу попадают в ленту автора; подписчикам их рассылает
+    фоновая задача fan_out_tweets."""
+    await session.execute(
+        insert(TimelineEntry),
+        [{"user_id": author_id, "tweet_id": tweet_id} for tweet_id in tweet_ids],
+    )
+
+
+async def get_feed_audience(session: AsyncSession, author_id: int) -> List[int]:
+    """Чьи ленты меняет запись автора: сам автор и его подписчики. Подписчиков
+    автора с больше чем FANOUT_FOLLOWERS_LIMIT подписчиками не перечисляем."""
+    followers = (
+        select(Follow.follower_id)
+        .join(Users, Users.id == Follow.following_id)
+        .where(Follow.following_id == author_id)
+        .where(Users.followers_count <= FANOUT_FOLLOWERS_LIMIT)
+    )
+    return [author_id, *(await session.execute(followers)).scalars()]
+
+
+async def fan_out_tweets(session: AsyncSession, tweet_ids: List[int], author_id: int) -> None:
+    """Кладёт твиты автора в ленты его подписчиков.
+
+    Рассылка выполняется одним INSERT ... SELECT и пропускается, если у автора
+    больше FANOUT_FOLLOWERS_LIMIT подписчиков. Уже разосланные записи и
+    удалённые твиты пропускаются, поэтому повторный запуск безопасен.
+    """
+    author_followers = (
+        select(Users.followers_count).where(Users.id == author_id).scalar_subquery()
+    )
+    result = await session.execute(
+        dialect_insert(session, TimelineEntry.__table__)
+        .from_select(
+            ["user_id", "tweet_id"],
+            select(Follow.follower_id, Tweet.id)
+            .join(Tweet, Tweet.user_id == Follow.following_id)
+            .where(Follow.following_id == author_id)
+            .where(Tweet.id.in_(tweet_ids))
+            .where(author_followers <= FANOUT_FOLLOWERS_LIMIT),
+        )
+        .on_conflict_do_nothing()
+    )
+
+    owners = [author_id]
+    if result.rowcount:
+        owners = select(Follow.follower_id).where(
+            Follow.following_id == author_id
+        ).union(select(literal(author_id)))
+    await trim_timelines(session, owners)
+
+
+async def trim_timelines(session: AsyncSession, user_ids) -> None:
+    """Оставляет в лентах пользователей не больше TIMELINE_MAX_ENTRIES записей."""
+    newer = aliased(TimelineEntry)
+    boundary = (
+        select(newer.tweet_id)
+        .where(newer.user_id == TimelineEntry.user_id)
+        .order_by(newer.tweet_id.desc())
+        .offset(TIMELINE_MAX_ENTRIES - 1)
+        .limit(1)
+        .correlate(TimelineEntry)
+        .scalar_subquery()
+    )
+    await session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id.in_(user_ids))
+        .where(TimelineEntry.tweet_id < boundary)
+    )
+
+
+async def remove_tweet_from_timelines(session: AsyncSession, tweet_id: int) -> None:
+    await session.execute(delete(TimelineEntry).where(TimelineEntry.tweet_id == tweet_id))
+
+
+async def remove_followee_from_timeline(
+    session: AsyncSession, user_id: int, followee_id: int
+) -> None:
+    await session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .where(
+            TimelineEntry.tweet_id.in_(
+                select(Tweet.id).where(Tweet.user_id == followee_id)
+            )
+        )
+    )
+
+
+async def backfill_followee_timeline(
+    session: AsyncSession, user_id: int, followee_ids: List[int]
+) -> None:
+    """После подписки добавляет в ленту последние твиты новых авторов.
+
+    Задача может выполниться уже после отписки, поэтому твиты берутся через
+    действующие подписки, как в fan_out_tweets; повтор задачи безопасен.
+    """
+    already = select(TimelineEntry.tweet_id).where(TimelineEntry.user_id == user_id)
+    recent = (
+        select(Follow.follower_id, Tweet.id)
+        .join(Tweet, Tweet.user_id == Follow.following_id)
+        .join(Users, Users.id == Tweet.user_id)
+        .where(Follow.follower_id == user_id)
+        .where(Follow.following_id.in_(followee_ids))
+        .where(Users.followers_count <= FANOUT_FOLLOWERS_LIMIT)
+        .where(Tweet.id.not_in(already))
+        .order_by(Tweet.id.desc())
+        .limit(TIMELINE_MAX_ENTRIES)
+    )
+    await session.execute(
+        dialect_insert(session, TimelineEntry.__table__)
+        .from_select(["user_id", "tweet_id"], recent)
+        .on_conflict_do_nothing()
+    )
+    await trim_timelines(session, [user_id])
+
+
+async def get_timeline_page(
+    session: AsyncSession, user_id: int, limit: int, cursor: Optional[str] = None
+) -> Tuple[List[TweetPayload], Optional[str]]:
+    """Хронологическая лента: записи из timeline_entries плюс твиты популярных
+    авторов, которые не рассылались при записи. Курсор — id последнего твита."""
+    if cursor is not None:
+        try:
+            last_id = int(cursor)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+
+    inbox = select(TimelineEntry.tweet_id.label("tweet_id")).where(
+        TimelineEntry.user_id == user_id
+    )
+    celebrities = (
+        select(Follow.following_id)
+        .join(Users, Users.id == Follow.following_id)
+        .where(Follow.follower_id == user_id)
+        .where(Users.followers_count > FANOUT_FOLLOWERS_LIMIT)
+    )
+    pulled = select(Tweet.id.label("tweet_id")).where(Tweet.user_id.in_(celebrities))
+    if cursor is not None:
+        inbox = inbox.where(TimelineEntry.tweet_id < last_id)
+        pulled = pulled.where(Tweet.id < last_id)
+
+    inbox = inbox.order_by(TimelineEntry.tweet_id.desc()).limit(limit + 1).subquery()
+    pulled = pulled.order_by(Tweet.id.desc()).limit(limit + 1).subquery()
+    candidates = union(select(inbox.c.tweet_id), select(pulled.c.tweet_id)).subquery()
+
+    tweet_ids = (
+        await session.execute(
+            select(candidates.c.tweet_id)
+            .order_by(candidates.c.tweet_id.desc())
+            .limit(limit + 1)
+        )
+    ).scalars().all()
+
+    next_cursor = None
+    if len(tweet_ids) > limit:
+        tweet_ids = tweet_ids[:limit]
+        next_cursor = str(tweet_ids[-1])
+    if not tweet_ids:
+        return [], None
+
+    rows = (
+        await session.execute(
+            tweet_rows_query().where(Tweet.id.in_(tweet_ids)).order_by(Tweet.id.desc())
+        )
+    ).all()
+    return await serialize_tweets(session, rows), next_cursor
@@ -0,0 +1,84 @@
+"""Схема, которую до миграций создавал create_all при старте: без счётчиков,
+лент и хранилища медиа, содержимое медиа в medias.file.
+
+Базы, созданные так, помечаются этой ревизией без изменений и обновляются
+следующими, которые добавляют недостающее и заполняют его из данных:
+alembic stamp 0001 && alembic upgrade head
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(length=255), nullable=True),
+        sa.Column("api_key", sa.String(length=255), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("api_key"),
+        sa.UniqueConstraint("name"),
+    )
+    op.create_table(
+        "medias",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("file", sa.LargeBinary(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "tweets",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("tweet_data", sa.Text(), nullable=False),
+        sa.Column(
+            "tweet_media_ids",
+            postgresql.ARRAY(sa.Integer(), dimensions=1).with_variant(sa.JSON(), "sqlite"),
+            nullable=True,
+        ),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "likes",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("tweet_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["tweet_id"], ["tweets.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("user_id", "tweet_id", name="unique_user_tweet_like"),
+    )
+    op.create_table(
+        "follows",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("follower_id", sa.Integer(), nullable=False),
+        sa.Column("following_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["follower_id"], ["users.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["following_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("follower_id", "following_id", name="unique_follow"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("follows")
+    op.drop_table("likes")
+    op.drop_table("tweets")
+    op.drop_table("medias")
+    op.drop_table("users")
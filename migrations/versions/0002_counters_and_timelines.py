@@ -0,0 +1,89 @@
+"""Денормализованные счётчики tweets.like_count и users.followers_count,
+материализованные ленты timeline_entries.
+
+Счётчики заполняются из likes и follows. Ленты строятся из своих твитов
+пользователя и твитов авторов, на которых он подписан (кроме авторов
+с числом подписчиков больше TIMELINE_FANOUT_FOLLOWERS_LIMIT), не больше
+TIMELINE_MAX_ENTRIES последних на пользователя.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Те же переменные и умолчания, что в database/timeline.py
+FANOUT_FOLLOWERS_LIMIT = int(os.getenv("TIMELINE_FANOUT_FOLLOWERS_LIMIT", 10000))
+TIMELINE_MAX_ENTRIES = int(os.getenv("TIMELINE_MAX_ENTRIES", 800))
+
+BACKFILL_TIMELINES = """
+    INSERT INTO timeline_entries (user_id, tweet_id)
+    SELECT user_id, tweet_id FROM (
+        SELECT user_id, tweet_id,
+               row_number() OVER (PARTITION BY user_id ORDER BY tweet_id DESC) AS n
+        FROM (
+            SELECT user_id, id AS tweet_id FROM tweets
+            UNION
+            SELECT follows.follower_id, tweets.id
+            FROM follows
+            JOIN tweets ON tweets.user_id = follows.following_id
+            JOIN users ON users.id = tweets.user_id
+            WHERE users.followers_count <= :fanout_limit
+        ) AS candidates
+    ) AS ranked
+    WHERE n <= :max_entries
+"""
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(
+            sa.Column("followers_count", sa.Integer(), server_default="0", nullable=False)
+        )
+    with op.batch_alter_table("tweets") as batch_op:
+        batch_op.add_column(
+            sa.Column("like_count", sa.Integer(), server_default="0", nullable=False)
+        )
+    op.execute("""
+        UPDATE users SET followers_count = (
+            SELECT count(*) FROM follows WHERE follows.following_id = users.id
+        )
+    """)
+    op.execute("""
+        UPDATE tweets SET like_count = (
+            SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id
+        )
+    """)
+    op.create_index("ix_tweets_like_count_id", "tweets", ["like_count", "id"])
+
+    op.create_table(
+        "timeline_entries",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("tweet_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["tweet_id"], ["tweets.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "tweet_id", name="pk_timeline_entries"),
+    )
+    op.get_bind().execute(
+        sa.text(BACKFILL_TIMELINES),
+        {"fanout_limit": FANOUT_FOLLOWERS_LIMIT, "max_entries": TIMELINE_MAX_ENTRIES},
+    )
+    op.create_index("ix_timeline_entries_tweet_id", "timeline_entries", ["tweet_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("timeline_entries")
+    op.drop_index("ix_tweets_like_count_id", table_name="tweets")
+    with op.batch_alter_table("tweets") as batch_op:
+        batch_op.drop_column("like_count")
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_column("followers_count")
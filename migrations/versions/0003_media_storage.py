@@ -0,0 +1,82 @@
+"""Содержимое медиа в хранилище services.storage вместо medias.file:
+таблица media_objects (уникальное содержимое со счётчиком ссылок) и
+метаданные medias.path, size, mime_type, sha256.
+
+Содержимое из базы переносит python -m database.migrate_media (ему нужно
+хранилище, поэтому он не часть миграции). Колонка medias.file удаляется
+только когда перенесено всё; в базе с неперенесёнными строками миграция
+останавливается:
+
+    alembic upgrade 0003  # сообщит, сколько строк осталось
+    python -m database.migrate_media
+    alembic upgrade head
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+METADATA_COLUMNS = {
+    "path": sa.String(length=255),
+    "size": sa.BigInteger(),
+    "mime_type": sa.String(length=100),
+    "sha256": sa.String(length=64),
+}
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    # migrate_media мог уже создать таблицу и колонки до этой ревизии
+    if not inspector.has_table("media_objects"):
+        op.create_table(
+            "media_objects",
+            sa.Column("sha256", sa.String(length=64), nullable=False),
+            sa.Column("path", sa.String(length=255), nullable=False),
+            sa.Column("size", sa.BigInteger(), nullable=False),
+            sa.Column("ref_count", sa.Integer(), server_default="0", nullable=False),
+            sa.Column("created_at", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("sha256"),
+        )
+    existing = {column["name"] for column in inspector.get_columns("medias")}
+    if "file" in existing:
+        left = bind.execute(sa.text(
+            "SELECT count(*) FROM medias WHERE file IS NOT NULL AND path IS NULL"
+            if "path" in existing else "SELECT count(*) FROM medias WHERE file IS NOT NULL"
+        )).scalar()
+        if left:
+            raise RuntimeError(
+                f"{left} media rows still keep their content in medias.file: "
+                "run `python -m database.migrate_media`, then `alembic upgrade head`"
+            )
+
+    with op.batch_alter_table("medias") as batch_op:
+        for name, type_ in METADATA_COLUMNS.items():
+            if name not in existing:
+                batch_op.add_column(sa.Column(name, type_, nullable=True))
+        if "file" in existing:
+            batch_op.drop_column("file")
+        batch_op.create_foreign_key(
+            "fk_medias_sha256_media_objects", "media_objects", ["sha256"], ["sha256"]
+        )
+    op.create_index("ix_medias_sha256", "medias", ["sha256"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_medias_sha256", table_name="medias")
+    with op.batch_alter_table("medias") as batch_op:
+        batch_op.drop_constraint("fk_medias_sha256_media_objects", type_="foreignkey")
+        for name in reversed(list(METADATA_COLUMNS)):
+            batch_op.drop_column(name)
+        # содержимое остаётся в хранилище и в medias.file не возвращается
+        batch_op.add_column(sa.Column("file", sa.LargeBinary(), nullable=True))
+    op.drop_table("media_objects")
@@ -0,0 +1,46 @@
+"""Индексы для обратных выборок: лайки твита, подписчики пользователя,
+твиты автора, и GIN по tweet_media_ids в PostgreSQL.
+
+В PostgreSQL индексы строятся CONCURRENTLY, без блокировки записи.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0004"
+down_revision: Union[str, None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = (
+    ("ix_tweets_user_id_id", "tweets", ["user_id", "id"]),
+    ("ix_tweets_created_at", "tweets", ["created_at"]),
+    ("ix_likes_tweet_id_user_id", "likes", ["tweet_id", "user_id"]),
+    ("ix_follows_following_id_follower_id", "follows", ["following_id", "follower_id"]),
+)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+            op.create_index(
+                "ix_tweets_tweet_media_ids", "tweets", ["tweet_media_ids"],
+                postgresql_using="gin", postgresql_concurrently=True, if_not_exists=True,
+            )
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("ix_tweets_tweet_media_ids", table_name="tweets")
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
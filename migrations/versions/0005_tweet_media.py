@@ -0,0 +1,111 @@
+"""Вложения твитов в таблице tweet_media вместо массива tweets.tweet_media_ids,
+владелец медиа в medias.user_id.
+
+Вложения переносятся из массивов с сохранением порядка, владельцем медиа
+становится автор твита, к которому оно прикреплено. После переноса массив
+и его GIN-индекс удаляются.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL = {
+    "postgresql": """
+        INSERT INTO tweet_media (tweet_id, media_id, position)
+        SELECT t.id, m.media_id, m.ord - 1
+        FROM tweets t
+        CROSS JOIN LATERAL unnest(t.tweet_media_ids) WITH ORDINALITY AS m(media_id, ord)
+        WHERE m.media_id IN (SELECT id FROM medias)
+    """,
+    "sqlite": """
+        INSERT INTO tweet_media (tweet_id, media_id, position)
+        SELECT t.id, j.value, j.key
+        FROM tweets t, json_each(t.tweet_media_ids) j
+        WHERE t.tweet_media_ids IS NOT NULL AND j.value IN (SELECT id FROM medias)
+    """,
+}
+
+RESTORE = {
+    "postgresql": """
+        UPDATE tweets SET tweet_media_ids = (
+            SELECT array_agg(media_id ORDER BY position) FROM tweet_media
+            WHERE tweet_media.tweet_id = tweets.id
+        )
+    """,
+    "sqlite": """
+        UPDATE tweets SET tweet_media_ids = (
+            SELECT json_group_array(media_id) FROM (
+                SELECT media_id FROM tweet_media
+                WHERE tweet_media.tweet_id = tweets.id ORDER BY position
+            )
+        )
+        WHERE id IN (SELECT tweet_id FROM tweet_media)
+    """,
+}
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    op.create_table(
+        "tweet_media",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("tweet_id", sa.Integer(), nullable=False),
+        sa.Column("media_id", sa.Integer(), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["tweet_id"], ["tweets.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["media_id"], ["medias.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("tweet_id", "position", name="unique_tweet_media_position"),
+    )
+    op.create_index("ix_tweet_media_media_id", "tweet_media", ["media_id"])
+    with op.batch_alter_table("medias") as batch_op:
+        batch_op.add_column(sa.Column("user_id", sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            "fk_medias_user_id_users", "users", ["user_id"], ["id"], ondelete="SET NULL"
+        )
+
+    op.execute(BACKFILL[dialect])
+    op.execute("""
+        UPDATE medias SET user_id = (
+            SELECT tweets.user_id FROM tweet_media
+            JOIN tweets ON tweets.id = tweet_media.tweet_id
+            WHERE tweet_media.media_id = medias.id
+            ORDER BY tweet_media.id LIMIT 1
+        )
+        WHERE user_id IS NULL
+    """)
+
+    if dialect == "postgresql":
+        op.drop_index("ix_tweets_tweet_media_ids", table_name="tweets", if_exists=True)
+    with op.batch_alter_table("tweets") as batch_op:
+        batch_op.drop_column("tweet_media_ids")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    with op.batch_alter_table("tweets") as batch_op:
+        batch_op.add_column(sa.Column(
+            "tweet_media_ids",
+            postgresql.ARRAY(sa.Integer(), dimensions=1).with_variant(sa.JSON(), "sqlite"),
+            nullable=True,
+        ))
+    op.execute(RESTORE[dialect])
+    if dialect == "postgresql":
+        op.create_index(
+            "ix_tweets_tweet_media_ids", "tweets", ["tweet_media_ids"], postgresql_using="gin"
+        )
+    with op.batch_alter_table("medias") as batch_op:
+        batch_op.drop_constraint("fk_medias_user_id_users", type_="foreignkey")
+        batch_op.drop_column("user_id")
+    op.drop_table("tweet_media")
@@ -0,0 +1,33 @@
+"""Варианты изображений: уменьшенные копии без метаданных для параметра size.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "media_variants",
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("width", sa.Integer(), nullable=False),
+        sa.Column("height", sa.Integer(), nullable=False),
+        sa.Column("path", sa.String(length=255), nullable=False),
+        sa.Column("size", sa.BigInteger(), nullable=False),
+        sa.Column("mime_type", sa.String(length=100), nullable=False),
+        sa.ForeignKeyConstraint(["sha256"], ["media_objects.sha256"]),
+        sa.PrimaryKeyConstraint("sha256", "width", name="pk_media_variants"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("media_variants")
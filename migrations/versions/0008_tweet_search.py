@@ -0,0 +1,87 @@
+"""Полнотекстовый индекс по tweets.tweet_data.
+
+PostgreSQL: колонка tweets.search_vector (tsvector) с GIN-индексом, её
+заполняет триггер при вставке и изменении текста, поэтому индекс синхронен
+для любых путей записи, включая COPY. SQLite: FTS5-таблица tweets_fts с
+внешним содержимым из tweets и триггерами вставки, изменения и удаления.
+Batch-миграция tweets в SQLite пересоздаёт таблицу без триггеров, после
+неё их нужно создать заново.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+UPGRADE = {
+    "postgresql": [
+        "ALTER TABLE tweets ADD COLUMN search_vector tsvector",
+        # пересчёт только при изменении текста, а не при каждом обновлении like_count
+        """
+        CREATE TRIGGER tweets_search_vector_update
+        BEFORE INSERT OR UPDATE OF tweet_data ON tweets
+        FOR EACH ROW EXECUTE FUNCTION
+        tsvector_update_trigger(search_vector, 'pg_catalog.simple', tweet_data)
+        """,
+        "UPDATE tweets SET search_vector = to_tsvector('pg_catalog.simple', tweet_data)",
+        "CREATE INDEX ix_tweets_search_vector ON tweets USING gin (search_vector)",
+    ],
+    "sqlite": [
+        """
+        CREATE VIRTUAL TABLE tweets_fts USING fts5(
+            tweet_data, content='tweets', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER tweets_fts_insert AFTER INSERT ON tweets BEGIN
+            INSERT INTO tweets_fts(rowid, tweet_data) VALUES (new.id, new.tweet_data);
+        END
+        """,
+        """
+        CREATE TRIGGER tweets_fts_delete AFTER DELETE ON tweets BEGIN
+            INSERT INTO tweets_fts(tweets_fts, rowid, tweet_data)
+            VALUES ('delete', old.id, old.tweet_data);
+        END
+        """,
+        """
+        CREATE TRIGGER tweets_fts_update AFTER UPDATE OF tweet_data ON tweets BEGIN
+            INSERT INTO tweets_fts(tweets_fts, rowid, tweet_data)
+            VALUES ('delete', old.id, old.tweet_data);
+            INSERT INTO tweets_fts(rowid, tweet_data) VALUES (new.id, new.tweet_data);
+        END
+        """,
+        "INSERT INTO tweets_fts(tweets_fts) VALUES ('rebuild')",
+    ],
+}
+
+DOWNGRADE = {
+    "postgresql": [
+        "DROP INDEX ix_tweets_search_vector",
+        "DROP TRIGGER tweets_search_vector_update ON tweets",
+        "ALTER TABLE tweets DROP COLUMN search_vector",
+    ],
+    "sqlite": [
+        "DROP TRIGGER tweets_fts_update",
+        "DROP TRIGGER tweets_fts_delete",
+        "DROP TRIGGER tweets_fts_insert",
+        "DROP TABLE tweets_fts",
+    ],
+}
+
+
+def upgrade() -> None:
+    for statement in UPGRADE[op.get_bind().dialect.name]:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    for statement in DOWNGRADE[op.get_bind().dialect.name]:
+        op.execute(statement)
@@ -0,0 +1,46 @@
+from .cache import TTLCache as TTLCache
+from .http_cache import (
+    IMMUTABLE_CACHE_CONTROL as IMMUTABLE_CACHE_CONTROL,
+    http_date as http_date,
+    is_not_modified as is_not_modified,
+)
+from .images import (
+    ImagePipeline as ImagePipeline,
+    ImageVariant as ImageVariant,
+    image_pipeline as image_pipeline,
+    render_variants as render_variants,
+)
+from .json_response import (
+    FastJSONResponse as FastJSONResponse,
+    dumps as json_dumps,
+)
+from .metrics import (
+    instrument_engine as instrument_engine,
+    metrics_registry as metrics_registry,
+    server_timing as server_timing,
+    start_request_metrics as start_request_metrics,
+)
+from .pubsub import (
+    HEARTBEAT as HEARTBEAT,
+    EventBackend as EventBackend,
+    EventBroker as EventBroker,
+    MemoryEventBackend as MemoryEventBackend,
+    RedisEventBackend as RedisEventBackend,
+    Subscription as Subscription,
+    event_broker as event_broker,
+)
+from .response_cache import (
+    MemoryResponseCacheBackend as MemoryResponseCacheBackend,
+    RedisResponseCacheBackend as RedisResponseCacheBackend,
+    ResponseCache as ResponseCache,
+    ResponseCacheBackend as ResponseCacheBackend,
+    response_cache as response_cache,
+)
+from .storage import (
+    INLINE_MIME_TYPES as INLINE_MIME_TYPES,
+    LocalMediaStorage as LocalMediaStorage,
+    MediaStorage as MediaStorage,
+    StoredObject as StoredObject,
+    media_storage as media_storage,
+    sniff_mime_type as sniff_mime_type,
+)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU-кэш в памяти процесса с ограничением размера и временем жизни записей.
+
+    Все операции синхронные и не содержат await, поэтому безопасны для
+    конкурентных корутин одного event loop. get_or_load объединяет
+    одновременные промахи по одному ключу в один вызов загрузчика.
+    """
+
+    def __init__(
+        self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > self._clock():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (self._clock() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def invalidate_if(self, predicate: Callable[[Hashable, Any], bool]) -> None:
+        for key in [k for k, (_, v) in self._data.items() if predicate(k, v)]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        """Возвращает значение из кэша или загружает его; None не кэшируется."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except Exception as exc:
+            future.set_exception(exc)
+            # исключение получат ожидающие, здесь помечаем его как полученное
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            if value is not None:
+                self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
@@ -0,0 +1,139 @@
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .storage import MediaStorage, media_storage
+
+# Ширины вариантов в пикселях; вариант не шире оригинала
+IMAGE_VARIANT_WIDTHS = tuple(
+    int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(",")
+)
+IMAGE_VARIANT_FORMAT = os.getenv("IMAGE_VARIANT_FORMAT", "webp")
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", 80))
+# Процессов для декодирования и сжатия
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+
+PROCESSABLE_MIME_TYPES = frozenset(
+    ("image/jpeg", "image/png", "image/gif", "image/bmp", "image/webp")
+)
+FORMAT_MIME_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg"}
+
+# ширина, высота, закодированные данные
+RenderedVariant = Tuple[int, int, bytes]
+
+
+class ImageVariant(NamedTuple):
+    width: int
+    height: int
+    path: str
+    size: int
+    mime_type: str
+
+
+def variant_path(sha256: str, width: int, fmt: str) -> str:
+    return os.path.join("variants", sha256[:2], sha256[2:4], f"{sha256}-{width}.{fmt}")
+
+
+def render_variants(
+    data: bytes, widths: Sequence[int], fmt: str, quality: int
+) -> List[RenderedVariant]:
+    """Уменьшает изображение до каждой ширины из widths и перекодирует в fmt.
+
+    EXIF, XMP и прочие метаданные в варианты не попадают. Выполняется в
+    процессе пула, поэтому Pillow импортируется здесь.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        # поворот из EXIF применяется до того, как метаданные будут отброшены
+        image = ImageOps.exif_transpose(original)
+        mode = "RGBA" if image.has_transparency_data and fmt != "jpeg" else "RGB"
+        if image.mode != mode:
+            image = image.convert(mode)
+
+        rendered = []
+        for width in sorted({min(width, image.width) for width in widths}):
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            out = io.BytesIO()
+            resized.save(out, format=fmt.upper(), quality=quality)
+            rendered.append((width, height, out.getvalue()))
+    return rendered
+
+
+class ImagePipeline:
+    """Обработка загруженных изображений в пуле процессов.
+
+    Вызывается из задачи очереди media.variants, поэтому время загрузки не
+    меняется, а упавшая обработка повторяется очередью. Декодирование и сжатие
+    идут в процессах пула, а цикл событий лишь читает оригинал и пишет варианты.
+    """
+
+    def __init__(
+        self,
+        storage: MediaStorage,
+        widths: Sequence[int] = IMAGE_VARIANT_WIDTHS,
+        fmt: str = IMAGE_VARIANT_FORMAT,
+        quality: int = IMAGE_VARIANT_QUALITY,
+        workers: int = IMAGE_WORKERS,
+        executor: Optional[Executor] = None,
+        render: Callable[..., List[RenderedVariant]] = render_variants,
+    ):
+        self.storage = storage
+        self.widths = tuple(widths)
+        self.format = fmt
+        self.quality = quality
+        self.workers = workers
+        self.render = render
+        self._executor = executor
+        self._own_executor = executor is None
+        # без Pillow (необязательная зависимость) изображения отдаются как есть
+        self.enabled = executor is not None or importlib.util.find_spec("PIL") is not None
+        self.processed = 0
+        self.failed = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            # spawn: fork процесса с потоками (aiosqlite, пул starlette) небезопасен
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def accepts(self, mime_type: str) -> bool:
+        """Будут ли для содержимого этого типа созданы варианты."""
+        return self.enabled and mime_type in PROCESSABLE_MIME_TYPES
+
+    async def process(self, sha256: str, path: str) -> List[ImageVariant]:
+        try:
+            data = await self.storage.read(path)
+            rendered = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), self.render, data, self.widths, self.format, self.quality
+            )
+            variants = []
+            for width, height, content in rendered:
+                target = variant_path(sha256, width, self.format)
+                await self.storage.write(target, content)
+                variants.append(ImageVariant(
+                    width, height, target, len(content), FORMAT_MIME_TYPES[self.format]
+                ))
+        except Exception:
+            self.failed += 1
+            raise
+        self.processed += 1
+        return variants
+
+    async def shutdown(self) -> None:
+        if self._own_executor and self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "failed": self.failed}
+
+
+image_pipeline = ImagePipeline(media_storage)
@@ -0,0 +1,306 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger("twitterclone.jobs")
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+# Задержка перед повтором, сек: JOB_RETRY_BACKOFF * 2 ** (попытка - 1), но не больше JOB_RETRY_MAX
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 0.5))
+JOB_RETRY_MAX = float(os.getenv("JOB_RETRY_MAX", 60))
+# Как часто свободный воркер проверяет задачи, поставленные другими процессами
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+# Сколько ждать выполняемых задач при остановке приложения
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", 10))
+# Как часто свободный воркер удаляет старые завершённые задачи, сек
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", 60))
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    # номер текущей попытки, начиная с 1
+    attempts: int
+
+
+def after_commit(session: Optional[AsyncSession], callback: Callable[[], None]) -> None:
+    """Вызывает callback после commit сессии (сразу, если сессии нет);
+    при rollback вызов отменяется."""
+    if session is None:
+        callback()
+        return
+    sync_session = session.sync_session
+    if not sync_session.in_transaction():
+        # без транзакции rollback не вызывает событий и не отменил бы callback
+        sync_session.begin()
+    callbacks = session.info.get("after_commit")
+    if callbacks is None:
+        callbacks = session.info["after_commit"] = []
+
+        @event.listens_for(sync_session, "after_commit")
+        def _run(_):
+            pending = list(callbacks)
+            callbacks.clear()
+            for pending_callback in pending:
+                pending_callback()
+
+        @event.listens_for(sync_session, "after_transaction_end")
+        def _discard(_, transaction):
+            if transaction.parent is None:
+                callbacks.clear()
+
+    callbacks.append(callback)
+
+
+class JobQueueBackend:
+    """Хранилище задач очереди."""
+
+    # Задачи переживают остановку процесса и доступны другим процессам
+    durable = True
+
+    async def enqueue(
+        self, session: Optional[AsyncSession], kind: str, payload: dict, key: Optional[str]
+    ) -> None:
+        """Ставит задачу. С session задача появляется только после её commit;
+        задача с уже известным ключом идемпотентности не ставится повторно."""
+        raise NotImplementedError
+
+    async def claim(self, limit: int) -> List[Job]:
+        raise NotImplementedError
+
+    async def complete(self, job: Job) -> None:
+        raise NotImplementedError
+
+    async def retry(self, job: Job, delay: float, error: str) -> None:
+        raise NotImplementedError
+
+    async def fail(self, job: Job, error: str) -> None:
+        raise NotImplementedError
+
+    async def pending(self) -> int:
+        """Число задач, которые ещё будут выполнены, включая ждущие повтора."""
+        raise NotImplementedError
+
+    async def sweep(self) -> int:
+        """Удаляет завершённые задачи старше срока хранения; возвращает их число."""
+        return 0
+
+
+class MemoryJobQueueBackend(JobQueueBackend):
+    """Очередь в памяти процесса для тестов и разработки: задачи не
+    переживают перезапуск."""
+
+    durable = False
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        # (время запуска, id, задача)
+        self._ready: List[tuple] = []
+        self._running: Dict[int, Job] = {}
+        self._keys: Set[str] = set()
+        self.failed: List[Job] = []
+
+    async def enqueue(
+        self, session: Optional[AsyncSession], kind: str, payload: dict, key: Optional[str]
+    ) -> None:
+        def push():
+            if key is not None:
+                if key in self._keys:
+                    return
+                self._keys.add(key)
+            job = Job(next(self._ids), kind, payload, 0)
+            heapq.heappush(self._ready, (time.monotonic(), job.id, job))
+
+        after_commit(session, push)
+
+    async def claim(self, limit: int) -> List[Job]:
+        jobs = []
+        now = time.monotonic()
+        while self._ready and len(jobs) < limit and self._ready[0][0] <= now:
+            job = heapq.heappop(self._ready)[2]
+            job = job._replace(attempts=job.attempts + 1)
+            self._running[job.id] = job
+            jobs.append(job)
+        return jobs
+
+    async def complete(self, job: Job) -> None:
+        self._running.pop(job.id, None)
+
+    async def retry(self, job: Job, delay: float, error: str) -> None:
+        self._running.pop(job.id, None)
+        heapq.heappush(self._ready, (time.monotonic() + delay, job.id, job))
+
+    async def fail(self, job: Job, error: str) -> None:
+        self._running.pop(job.id, None)
+        self.failed.append(job)
+
+    async def pending(self) -> int:
+        return len(self._ready) + len(self._running)
+
+
+class JobQueue:
+    """Очередь побочных эффектов записи.
+
+    Обработчик регистрируется декоратором handler(kind) и получает payload.
+    Запрос ставит задачу в своей сессии и отвечает сразу после commit, а
+    воркеры (корутины, запущенные start) выполняют задачи по одной. Ошибка
+    обработчика повторяется с экспоненциальной задержкой до max_attempts
+    попыток, поэтому обработчики должны быть идемпотентными.
+    """
+
+    def __init__(
+        self,
+        backend: JobQueueBackend,
+        workers: int = JOB_WORKERS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_backoff: float = JOB_RETRY_BACKOFF,
+        poll_interval: float = JOB_POLL_INTERVAL,
+    ):
+        self.backend = backend
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.handlers: Dict[str, Handler] = {}
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+        self._swept_at = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    def handler(self, kind: str) -> Callable[[Handler], Handler]:
+        def register(func: Handler) -> Handler:
+            self.handlers[kind] = func
+            return func
+        return register
+
+    async def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        key: Optional[str] = None,
+        session: Optional[AsyncSession] = None,
+    ) -> None:
+        if kind not in self.handlers:
+            raise ValueError(f"unknown job kind {kind!r}")
+        await self.backend.enqueue(session, kind, payload, key)
+        after_commit(session, self._wake)
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            jobs = await self.backend.claim(1)
+            if not jobs:
+                await self._sweep()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for job in jobs:
+                await self.run(job)
+
+    async def _sweep(self) -> None:
+        if time.monotonic() - self._swept_at < JOB_SWEEP_INTERVAL:
+            return
+        # отметка до await: остальные воркеры процесса в это время не чистят
+        self._swept_at = time.monotonic()
+        try:
+            swept = await self.backend.sweep()
+        except Exception:
+            logger.exception("job sweep failed")
+        else:
+            if swept:
+                logger.info("swept %d finished jobs", swept)
+
+    async def run(self, job: Job) -> None:
+        self._running += 1
+        try:
+            await self.handlers[job.kind](job.payload)
+        except asyncio.CancelledError:
+            # аренда снимается сразу: задачу возьмёт другой процесс, не дожидаясь JOB_LEASE
+            await self.backend.retry(job, 0, "interrupted by shutdown")
+            raise
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+            if job.attempts >= self.max_attempts:
+                self.failed += 1
+                logger.exception("job %s %s failed after %d attempts", job.id, job.kind, job.attempts)
+                await self.backend.fail(job, error)
+            else:
+                self.retried += 1
+                delay = min(self.retry_backoff * 2 ** (job.attempts - 1), JOB_RETRY_MAX)
+                logger.warning("job %s %s failed, retry in %.1fs: %s", job.id, job.kind, delay, error)
+                await self.backend.retry(job, delay, error)
+        else:
+            self.processed += 1
+            await self.backend.complete(job)
+        finally:
+            self._running -= 1
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """Ждёт, пока очередь опустеет; False, если не успела за timeout.
+        Общая очередь в базе включает задачи других процессов, поэтому drain
+        нужен тестам и скриптам, а не остановке приложения."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while await self.backend.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wake()
+            await asyncio.sleep(0.01)
+        return True
+
+    async def stop(self, timeout: float = JOB_DRAIN_TIMEOUT) -> None:
+        """Плавная остановка: воркеры перестают брать задачи и дорабатывают
+        уже взятые не дольше timeout, прерванные возвращаются в очередь.
+        Очередь в памяти процесса перед этим выполняется целиком, иначе её
+        задачи потерялись бы."""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        if not self.backend.durable:
+            await self.drain(timeout)
+        self._stopping = True
+        self._wake()
+        _, running = await asyncio.wait(
+            self._tasks, timeout=max(0.0, deadline - time.monotonic())
+        )
+        if running:
+            logger.warning("job queue stopped with %d running jobs", self._running)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
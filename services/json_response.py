@@ -0,0 +1,33 @@
+import dataclasses
+import json
+from typing import Any
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if dataclasses.is_dataclass(value):
+        return {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Сериализует ответ известной формы (словари, списки, dataclass) без
+    обхода jsonable_encoder. С orjson — в несколько раз быстрее stdlib json."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
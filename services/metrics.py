@@ -0,0 +1,200 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import ORMExecuteState, Session
+
+slow_query_logger = logging.getLogger("twitterclone.sql.slow")
+
+# Порог медленного запроса в миллисекундах; если не задан, лог выключен
+SLOW_QUERY_MS: Optional[float] = (
+    float(os.environ["SLOW_QUERY_MS"]) if os.getenv("SLOW_QUERY_MS") else None
+)
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+class RequestMetrics:
+    """Счётчики SQL одного HTTP-запроса."""
+
+    __slots__ = ("queries", "db_time", "rows")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+def start_request_metrics() -> RequestMetrics:
+    metrics = RequestMetrics()
+    _current.set(metrics)
+    return metrics
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Подписывается на события движка: время, число запросов и строк
+    записываются в метрики текущего HTTP-запроса. Изменённые строки берутся
+    из rowcount, выбранные SELECT — считаются при выполнении в сессии."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.queries += 1
+            metrics.db_time += elapsed
+            if context.is_crud or cursor.description is None:
+                # строки SELECT считает _count_selected
+                metrics.rows += max(cursor.rowcount, 0)
+        if SLOW_QUERY_MS is not None and elapsed * 1000 >= SLOW_QUERY_MS:
+            slow_query_logger.warning(
+                "slow query %.1f ms: %s; parameters: %r", elapsed * 1000, statement, parameters
+            )
+
+    if not event.contains(Session, "do_orm_execute", _count_selected):
+        event.listen(Session, "do_orm_execute", _count_selected)
+
+
+def _count_selected(state: ORMExecuteState) -> Optional[Result]:
+    """Считает строки, выбранные SELECT. AsyncSession.execute и так выбирает
+    их целиком, поэтому результат замораживается без лишней памяти; потоковые
+    выборки (session.stream, yield_per) не считаются."""
+    metrics = _current.get()
+    options = state.execution_options
+    if (
+        metrics is None or not state.is_select
+        or options.get("stream_results") or options.get("yield_per")
+    ):
+        return None
+    frozen = state.invoke_statement().freeze()
+    metrics.rows += len(frozen.data)
+    return frozen()
+
+
+class Histogram:
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """Агрегированные метрики процесса в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.requests: Dict[Labels, int] = {}
+        self.rows: Dict[Labels, int] = {}
+        self.request_duration: Dict[Labels, Histogram] = {}
+        self.db_duration: Dict[Labels, Histogram] = {}
+        self.db_queries: Dict[Labels, Histogram] = {}
+
+    def observe_request(
+        self, method: str, route: str, status: int, duration: float, metrics: RequestMetrics
+    ) -> None:
+        labels = (("method", method), ("route", route))
+        status_labels = labels + (("status", str(status)),)
+        self.requests[status_labels] = self.requests.get(status_labels, 0) + 1
+        self.rows[labels] = self.rows.get(labels, 0) + metrics.rows
+        self._histogram(self.request_duration, labels, DURATION_BUCKETS).observe(duration)
+        self._histogram(self.db_duration, labels, DURATION_BUCKETS).observe(metrics.db_time)
+        self._histogram(self.db_queries, labels, QUERY_COUNT_BUCKETS).observe(metrics.queries)
+
+    @staticmethod
+    def _histogram(store: Dict[Labels, Histogram], labels: Labels, buckets) -> Histogram:
+        histogram = store.get(labels)
+        if histogram is None:
+            histogram = store[labels] = Histogram(buckets)
+        return histogram
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def render(
+        self,
+        gauges: Optional[Dict[str, float]] = None,
+        counters: Optional[Dict[str, float]] = None,
+    ) -> str:
+        lines: List[str] = []
+        _counter(lines, "http_requests_total", "HTTP requests by route and status", self.requests)
+        _histograms(lines, "http_request_duration_seconds", "Request handling time",
+                    self.request_duration)
+        _histograms(lines, "db_query_duration_seconds", "Total SQL time per request",
+                    self.db_duration)
+        _histograms(lines, "db_queries_per_request", "SQL statements per request",
+                    self.db_queries)
+        _counter(lines, "db_rows_total", "Rows returned or affected by SQL", self.rows)
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        for name, value in (counters or {}).items():
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"')) for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _counter(lines: List[str], name: str, help_text: str, values: Dict[Labels, int]) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in sorted(values.items()):
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+
+def _histograms(
+    lines: List[str], name: str, help_text: str, values: Dict[Labels, Histogram]
+) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(values.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, (('le', repr(float(bound))),))} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram.count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+
+def server_timing(metrics: RequestMetrics, duration: float) -> str:
+    return (
+        f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries, {metrics.rows} rows", '
+        f"app;dur={duration * 1000:.2f}"
+    )
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,303 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Iterable, Optional, Set
+
+from .json_response import dumps
+
+logger = logging.getLogger("twitterclone.events")
+
+# Событий в очереди одного соединения; клиент, отставший сильнее, отключается
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+# Как часто простаивающим соединениям отправляется heartbeat, сек
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", 15))
+# redis://... — события доходят до подписчиков во всех процессах; по умолчанию только в своём
+EVENTS_URL = os.getenv("EVENTS_URL")
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "twitterclone:events")
+
+# Тема служебных событий подписки: они меняют темы соединений пользователя
+# и клиентам не отправляются
+FOLLOW_TOPIC_PREFIX = "follow:"
+HEARTBEAT = b""
+
+Deliver = Callable[[str, bytes], None]
+
+
+class Subscription:
+    """Очередь событий одного соединения.
+
+    Соединение без новых событий держит только этот объект: ни задачи, ни
+    таймера, ни соединения с базой. Очередь ограничена maxsize, при
+    переполнении подписка закрывается как медленная.
+    """
+
+    __slots__ = ("user_id", "topics", "maxsize", "dropped", "closed", "_items", "_ready", "_heartbeat")
+
+    def __init__(self, user_id: int, topics: Set[str], maxsize: int):
+        self.user_id = user_id
+        self.topics = topics
+        self.maxsize = maxsize
+        self.dropped = False
+        self.closed = False
+        self._items: deque = deque()
+        self._ready = asyncio.Event()
+        self._heartbeat = False
+
+    def put(self, payload: bytes) -> bool:
+        """Кладёт событие; False, если очередь переполнена и подписка закрыта."""
+        if self.closed:
+            return False
+        if len(self._items) >= self.maxsize:
+            self.dropped = True
+            self.close()
+            return False
+        self._items.append(payload)
+        self._ready.set()
+        return True
+
+    def heartbeat(self) -> None:
+        if not self._items:
+            self._heartbeat = True
+            self._ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def get(self) -> Optional[bytes]:
+        """Следующее событие, HEARTBEAT при простое или None после закрытия."""
+        while True:
+            # медленный клиент отключается сразу, недоставленное ему не нужно
+            if self.dropped:
+                return None
+            if self._items:
+                return self._items.popleft()
+            if self.closed:
+                return None
+            if self._heartbeat:
+                self._heartbeat = False
+                return HEARTBEAT
+            self._ready.clear()
+            await self._ready.wait()
+
+
+class EventBackend:
+    """Доставка опубликованных событий брокерам процессов."""
+
+    async def publish(self, topic: str, payload: bytes) -> None:
+        raise NotImplementedError
+
+    async def start(self, deliver: Deliver) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryEventBackend(EventBackend):
+    """События только внутри процесса."""
+
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def publish(self, topic: str, payload: bytes) -> None:
+        if self._deliver is not None:
+            self._deliver(topic, payload)
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def stop(self) -> None:
+        self._deliver = None
+
+
+class RedisEventBackend(EventBackend):
+    """События через Redis Pub/Sub: каждый процесс получает все события канала
+    и сам раздаёт их своим подписчикам. client — redis.asyncio.Redis."""
+
+    def __init__(self, client, channel: str = EVENTS_CHANNEL):
+        self.client = client
+        self.channel = channel
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, topic: str, payload: bytes) -> None:
+        await self.client.publish(self.channel, topic.encode() + b" " + payload)
+
+    async def start(self, deliver: Deliver) -> None:
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._read(deliver))
+
+    async def _read(self, deliver: Deliver) -> None:
+        async for message in self._pubsub.listen():
+            if message["type"] != "message":
+                continue
+            topic, _, payload = message["data"].partition(b" ")
+            deliver(topic.decode(), payload)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            self._pubsub = None
+
+
+class EventBroker:
+    """Раздача событий ленты подключённым клиентам.
+
+    Соединение подписывается на темы — id авторов, чьи твиты в его ленте.
+    Событие сериализуется один раз при публикации и раздаётся только
+    подписчикам своей темы через индекс тема -> подписки. Подписка и
+    отписка (publish_follow) добавляют или убирают тему у соединений
+    пользователя во всех процессах.
+    """
+
+    def __init__(
+        self,
+        backend: EventBackend,
+        queue_size: int = EVENTS_QUEUE_SIZE,
+        heartbeat: float = EVENTS_HEARTBEAT,
+    ):
+        self.backend = backend
+        self.queue_size = queue_size
+        self.heartbeat_interval = heartbeat
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._subscriptions: Set[Subscription] = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @staticmethod
+    def topic(user_id: int) -> str:
+        return str(user_id)
+
+    async def start(self) -> None:
+        await self.backend.start(self._deliver)
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeats())
+
+    async def stop(self) -> None:
+        """Закрывает все подписки, чтобы открытые потоки завершились."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        await self.backend.stop()
+        for subscription in list(self._subscriptions):
+            subscription.close()
+            self.unsubscribe(subscription)
+
+    async def publish(self, user_id: int, event: dict) -> None:
+        self.published += 1
+        try:
+            await self.backend.publish(self.topic(user_id), dumps(event))
+        except Exception:
+            # запись уже выполнена; потерянное событие клиент догонит перечитыванием ленты
+            logger.exception("failed to publish %s", event.get("type"))
+
+    def subscribe(self, user_id: int, followee_ids: Iterable[int]) -> Subscription:
+        topics = {self.topic(user_id)} | {self.topic(followee) for followee in followee_ids}
+        subscription = Subscription(user_id, topics, self.queue_size)
+        self._subscriptions.add(subscription)
+        for topic in topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        """События подписки до её закрытия; при выходе подписка снимается."""
+        try:
+            while True:
+                payload = await subscription.get()
+                if payload is None:
+                    return
+                yield payload
+        finally:
+            self.unsubscribe(subscription)
+
+    async def publish_follow(self, user_id: int, followee_id: int, following: bool) -> None:
+        """Подписка или отписка: соединения user_id начинают или перестают
+        получать события followee_id без переподключения."""
+        try:
+            await self.backend.publish(
+                FOLLOW_TOPIC_PREFIX + self.topic(user_id),
+                dumps({"followee_id": followee_id, "following": following}),
+            )
+        except Exception:
+            # подписка уже записана; открытые соединения узнают о ней при переподключении
+            logger.exception("failed to publish follow change of user %s", user_id)
+
+    def _deliver(self, topic: str, payload: bytes) -> None:
+        if topic.startswith(FOLLOW_TOPIC_PREFIX):
+            self._apply_follow(topic[len(FOLLOW_TOPIC_PREFIX):], json.loads(payload))
+            return
+        for subscription in list(self._topics.get(topic, ())):
+            if subscription.put(payload):
+                self.delivered += 1
+            elif subscription.dropped:
+                self.dropped += 1
+                logger.info("dropping slow event subscriber of user %s", subscription.user_id)
+                self.unsubscribe(subscription)
+
+    def _apply_follow(self, topic: str, event: dict) -> None:
+        followee = self.topic(event["followee_id"])
+        # подписки самого пользователя на свою тему не меняются
+        if followee == topic:
+            return
+        for subscription in list(self._topics.get(topic, ())):
+            if subscription.user_id != int(topic):
+                continue
+            if event["following"]:
+                subscription.topics.add(followee)
+                self._topics.setdefault(followee, set()).add(subscription)
+            else:
+                subscription.topics.discard(followee)
+                subscribers = self._topics.get(followee)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._topics[followee]
+
+    async def _heartbeats(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for subscription in list(self._subscriptions):
+                subscription.heartbeat()
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscriptions),
+            "topics": len(self._topics),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+def create_event_broker(url: Optional[str] = EVENTS_URL) -> EventBroker:
+    if url:
+        # redis — необязательная зависимость, нужна только для событий между процессами
+        import redis.asyncio
+
+        backend: EventBackend = RedisEventBackend(redis.asyncio.from_url(url))
+    else:
+        backend = MemoryEventBackend()
+    return EventBroker(backend)
+
+
+event_broker = create_event_broker()
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from .cache import TTLCache
+
+# Время жизни страницы в кэше, сек. Версия сбрасывает страницы сразу, TTL
+# ограничивает устаревание между процессами при кэше в памяти.
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 2))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 10000))
+# redis://... — общий кэш для всех воркеров; по умолчанию кэш в памяти процесса
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")
+# Сколько ждать, пока страницу строит другой процесс
+RESPONSE_CACHE_LOCK_TIMEOUT = float(os.getenv("RESPONSE_CACHE_LOCK_TIMEOUT", 1))
+
+
+class ResponseCacheBackend:
+    """Хранилище сериализованных ответов и счётчиков версий."""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def get_version(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def acquire_lock(self, key: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    async def release_lock(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryResponseCacheBackend(ResponseCacheBackend):
+    """Кэш в памяти процесса. Конкурентные промахи уже объединяет ResponseCache,
+    поэтому межпроцессная блокировка не нужна."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._pages = TTLCache(maxsize, ttl)
+        self._versions: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._pages.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._pages.set(key, value)
+
+    async def get_version(self, key: str) -> int:
+        return self._versions.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self._versions[key] = self._versions.get(key, 0) + 1
+        return self._versions[key]
+
+    async def acquire_lock(self, key: str, ttl: float) -> bool:
+        return True
+
+    async def release_lock(self, key: str) -> None:
+        pass
+
+
+class RedisResponseCacheBackend(ResponseCacheBackend):
+    """Общий кэш в Redis; client — совместимый с redis.asyncio.Redis объект."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(key, value, px=int(ttl * 1000))
+
+    async def get_version(self, key: str) -> int:
+        return int(await self.client.get(key) or 0)
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(key)
+
+    async def acquire_lock(self, key: str, ttl: float) -> bool:
+        return bool(await self.client.set(key, b"1", nx=True, px=int(ttl * 1000)))
+
+    async def release_lock(self, key: str) -> None:
+        await self.client.delete(key)
+
+
+class ResponseCache:
+    """Кэш сериализованных страниц с версией на пространство имён.
+
+    Запись увеличивает версию затронутых пространств (bump), и их страницы
+    старой версии перестают читаться. Одновременные промахи по одной странице в процессе ждут одного
+    построения, между процессами — блокировки в бэкенде.
+    """
+
+    def __init__(
+        self,
+        backend: ResponseCacheBackend,
+        ttl: float,
+        lock_timeout: float = RESPONSE_CACHE_LOCK_TIMEOUT,
+        poll_interval: float = 0.02,
+    ):
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.hits = 0
+        self.misses = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def bump(self, *namespaces: str) -> None:
+        for namespace in namespaces:
+            await self.backend.incr(f"{namespace}:version")
+
+    async def get_or_build(
+        self, namespace: str, key: str, builder: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        version = await self.backend.get_version(f"{namespace}:version")
+        full_key = f"{namespace}:v{version}:{key}"
+        value = await self.backend.get(full_key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        future = self._inflight.get(full_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[full_key] = future
+        try:
+            value = await self._build_once(full_key, builder)
+        except Exception as exc:
+            future.set_exception(exc)
+            # исключение получат ожидающие, здесь помечаем его как полученное
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(full_key, None)
+
+    async def _build_once(self, key: str, builder: Callable[[], Awaitable[bytes]]) -> bytes:
+        lock_key = f"lock:{key}"
+        if not await self.backend.acquire_lock(lock_key, self.lock_timeout):
+            # страницу строит другой процесс: ждём её, но не дольше lock_timeout
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                value = await self.backend.get(key)
+                if value is not None:
+                    return value
+            value = await builder()
+            await self.backend.set(key, value, self.ttl)
+            return value
+
+        try:
+            value = await builder()
+            await self.backend.set(key, value, self.ttl)
+            return value
+        finally:
+            await self.backend.release_lock(lock_key)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_response_cache(url: Optional[str] = RESPONSE_CACHE_URL) -> ResponseCache:
+    if url:
+        # redis — необязательная зависимость, нужна только для общего кэша
+        import redis.asyncio
+
+        backend: ResponseCacheBackend = RedisResponseCacheBackend(redis.asyncio.from_url(url))
+    else:
+        backend = MemoryResponseCacheBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    return ResponseCache(backend, RESPONSE_CACHE_TTL)
+
+
+response_cache = create_response_cache()
@@ -0,0 +1,161 @@
+"""Раздача собранного фронтенда.
+
+Сжатые варианты файлов создаются один раз при сборке:
+
+    python -m services.static static templates
+
+рядом с файлом появляются file.js.gz и, если установлен пакет brotli,
+file.js.br. При запросе отдаётся лучший вариант из принятых клиентом по
+Accept-Encoding, без сжатия на лету.
+"""
+import gzip
+import mimetypes
+import os
+import re
+import sys
+from typing import Dict, List, Optional, Set
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from .http_cache import IMMUTABLE_CACHE_CONTROL
+
+# Карты исходников нужны только для отладки и по умолчанию не отдаются
+STATIC_SOURCE_MAPS = os.getenv("STATIC_SOURCE_MAPS", "0") == "1"
+
+# Имя с хэшем содержимого от сборщика: app.ee2cdef2.js, chunk-vendors.de691de6.css
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.[a-z0-9]+$")
+COMPRESSIBLE_EXTENSIONS = frozenset((".js", ".css", ".html", ".svg", ".json", ".ico", ".txt"))
+COMPRESS_MIN_SIZE = 1024
+# Content-Encoding и расширение варианта в порядке предпочтения
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def accepted_encodings(header: Optional[str]) -> Set[str]:
+    """Кодировки из Accept-Encoding с ненулевым q."""
+    accepted: Dict[str, bool] = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality > 0
+    if accepted.get("*"):
+        return {encoding for encoding, _ in ENCODINGS if accepted.get(encoding, True)}
+    return {encoding for encoding, ok in accepted.items() if ok}
+
+
+def is_source_map(path: str) -> bool:
+    return path.endswith(".map")
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles с заранее сжатыми вариантами и долгим кэшированием.
+
+    Файлы с хэшем содержимого в имени кэшируются навсегда (immutable), остальные
+    (index.html, favicon.ico) — с перепроверкой по ETag. У каждого варианта
+    свой ETag, поэтому 304 возвращается только для той же кодировки.
+    """
+
+    def __init__(self, *args, source_maps: bool = STATIC_SOURCE_MAPS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source_maps = source_maps
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if is_source_map(path) and not self.source_maps:
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        name = os.path.basename(full_path)
+        headers = {
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if HASHED_NAME.search(name) else "no-cache"
+        }
+        path, encoding = full_path, None
+        if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding"))
+            for candidate, suffix in ENCODINGS:
+                if candidate not in accepted:
+                    continue
+                try:
+                    variant_stat = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                # вариант от прошлой сборки не отдаётся вместо обновлённого файла
+                if variant_stat.st_mtime >= stat_result.st_mtime:
+                    path, stat_result, encoding = full_path + suffix, variant_stat, candidate
+                    headers["Content-Encoding"] = candidate
+                    break
+
+        response = FileResponse(
+            path,
+            status_code=status_code,
+            stat_result=stat_result,
+            headers=headers,
+            media_type=mimetypes.guess_type(full_path)[0] or "text/plain",
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def _compress_brotli(data: bytes) -> Optional[bytes]:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def compress_directory(directory: str, min_size: int = COMPRESS_MIN_SIZE) -> List[str]:
+    """Создаёт .gz и .br рядом с текстовыми файлами directory; возвращает
+    записанные пути. Вариант не сохраняется, если он не меньше оригинала."""
+    written = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < min_size:
+                continue
+            source_stat = os.stat(path)
+            variants = {
+                ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+                ".br": _compress_brotli(data),
+            }
+            for suffix, compressed in variants.items():
+                if compressed is None or len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+                # одинаковое время у варианта и оригинала: ETag не меняется между сборками
+                os.utime(path + suffix, (source_stat.st_atime, source_stat.st_mtime))
+                written.append(path + suffix)
+    return written
+
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:] or ["static", "templates"]:
+        for path in compress_directory(directory):
+            print(path)
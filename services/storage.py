@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, NamedTuple, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Сигнатуры начала файла для определения настоящего MIME-типа
+MAGIC_NUMBERS = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"%PDF-", "application/pdf"),
+)
+
+
+# Типы, которые отдаются для показа в браузере; остальное — только скачиванием
+INLINE_MIME_TYPES = frozenset((
+    "image/jpeg", "image/png", "image/gif", "image/bmp", "image/webp", "image/avif",
+    "image/heic", "video/mp4",
+))
+
+
+def sniff_mime_type(head: bytes) -> Optional[str]:
+    for magic, mime_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"avif", b"avis"):
+            return "image/avif"
+        if brand in (b"heic", b"heix", b"mif1"):
+            return "image/heic"
+        return "video/mp4"
+    return None
+
+
+class StoredObject(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+    mime_type: Optional[str]
+
+
+class MediaStorage:
+    """Хранилище содержимого медиа-файлов. В базе остаются только метаданные."""
+
+    async def save(self, stream: BinaryIO) -> StoredObject:
+        raise NotImplementedError
+
+    async def read(self, path: str) -> bytes:
+        raise NotImplementedError
+
+    async def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    async def write(self, path: str, data: bytes) -> None:
+        """Записывает производный файл (например, вариант изображения) по заданному пути."""
+        raise NotImplementedError
+
+    async def delete(self, path: str) -> None:
+        raise NotImplementedError
+
+    def response(
+        self, path: str, media_type: str, headers: Optional[dict] = None
+    ) -> Response:
+        raise NotImplementedError
+
+
+class LocalMediaStorage(MediaStorage):
+    """Файлы на локальном диске по пути из sha256 содержимого: ab/cd/abcd...
+
+    Запись идёт во временный файл кусками по CHUNK_SIZE с подсчётом хэша и
+    затем атомарно переименовывается, блокирующий ввод-вывод вынесен в пул потоков.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def full_path(self, path: str) -> str:
+        return os.path.join(self.root, path)
+
+    async def save(self, stream: BinaryIO) -> StoredObject:
+        return await run_in_threadpool(self._save_sync, stream)
+
+    def _save_sync(self, stream: BinaryIO) -> StoredObject:
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        head = b""
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            try:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+
+        sha256 = digest.hexdigest()
+        path = os.path.join(sha256[:2], sha256[2:4], sha256)
+        full_path = self.full_path(path)
+        if os.path.exists(full_path):
+            os.unlink(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            os.replace(tmp.name, full_path)
+        return StoredObject(
+            path=path, size=size, sha256=sha256, mime_type=sniff_mime_type(head)
+        )
+
+    async def read(self, path: str) -> bytes:
+        return await run_in_threadpool(self._read_sync, path)
+
+    def _read_sync(self, path: str) -> bytes:
+        with open(self.full_path(path), "rb") as f:
+            return f.read()
+
+    async def exists(self, path: str) -> bool:
+        return await run_in_threadpool(os.path.exists, self.full_path(path))
+
+    async def write(self, path: str, data: bytes) -> None:
+        await run_in_threadpool(self._write_sync, path, data)
+
+    def _write_sync(self, path: str, data: bytes) -> None:
+        full_path = self.full_path(path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(full_path), delete=False) as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, full_path)
+
+    async def delete(self, path: str) -> None:
+        try:
+            await run_in_threadpool(os.unlink, self.full_path(path))
+        except FileNotFoundError:
+            pass
+
+    def response(
+        self, path: str, media_type: str, headers: Optional[dict] = None
+    ) -> Response:
+        # FileResponse отдаёт файл потоком и сам обрабатывает заголовок Range
+        return FileResponse(self.full_path(path), media_type=media_type, headers=headers)
+
+
+media_storage = LocalMediaStorage(os.getenv("MEDIA_ROOT", "media"))
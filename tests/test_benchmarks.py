@@ -0,0 +1,66 @@
+from benchmarks.dataset import DatasetConfig, seed_dataset
+from benchmarks.run import SCENARIOS, parse_args, run_benchmark
+
+
+def test_benchmark_smoke(setup_test_db, client):
+    from app import app
+    from services import media_storage
+
+    config = DatasetConfig(
+        users=20, tweets=100, likes=200, follows_per_user=5, media=2,
+        media_min_bytes=16, media_max_bytes=64, id_offset=900_000,
+    )
+
+    async def _run():
+        dataset = await seed_dataset(setup_test_db["engine"], media_storage, config)
+        return await run_benchmark(app, dataset, requests=5, concurrency=1)
+
+    # в цикле событий приложения, где работают фоновые задачи lifespan
+    report = client.portal.call(_run)
+    assert report["dataset"]["users"] == 20
+    assert set(report["results"]) == {s.name for s in SCENARIOS}
+    for name, result in report["results"].items():
+        assert result["requests"] == 5, name
+        assert result["errors"] == 0, name
+        assert result["p50_ms"] <= result["p99_ms"] <= result["max_ms"]
+
+
+def test_remote_benchmark_requires_target_dataset():
+    import pytest
+
+    # без базы и хранилища сервера засеянные локально ключи и id ему неизвестны
+    for argv in (
+        ["--base-url", "http://bench"],
+        ["--base-url", "http://bench", "--database-url", "postgresql+asyncpg://bench"],
+    ):
+        with pytest.raises(SystemExit):
+            parse_args(argv)
+    args = parse_args([
+        "--base-url", "http://bench", "--database-url", "postgresql+asyncpg://bench",
+        "--media-root", "/srv/media",
+    ])
+    assert args.media_root == "/srv/media"
+
+
+def test_search_benchmark_smoke(tmp_path):
+    import asyncio
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from benchmarks.search import run_search_benchmark, seed_tweets
+    from database import upgrade_schema
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'search.sqlite'}")
+
+    async def _run():
+        await upgrade_schema(engine)
+        await seed_tweets(engine, tweets=300, users=5, vocabulary=50)
+        results = await run_search_benchmark(
+            async_sessionmaker(bind=engine, expire_on_commit=False), 50, requests=2,
+            limit=5, like_baseline=True,
+        )
+        await engine.dispose()
+        return results
+
+    results = asyncio.run(_run())
+    assert {"common", "common_page_2", "common_like", "rare", "two_words"} <= set(results)
+    assert results["common"]["found"] == 5
+    assert all(r["p50_ms"] <= r["max_ms"] for r in results.values())
@@ -0,0 +1,126 @@
+import asyncio
+import gzip
+import json
+
+from sqlalchemy import inspect, select
+
+
+def test_bulk_import_ndjson_and_csv(setup_test_db, tmp_path):
+    from database import TimelineEntry, Tweet, TweetMedia, Users
+    from database.bulk_import import bulk_import
+
+    users = tmp_path / "users.ndjson"
+    users.write_text("\n".join(
+        json.dumps({"id": uid, "name": f"bulk{uid}", "api_key": f"bulk-{uid}"})
+        for uid in (800001, 800002, 800003)
+    ))
+    tweets = tmp_path / "tweets.csv.gz"
+    with gzip.open(tweets, "wt", newline="") as f:
+        f.write("id,user_id,tweet_data,created_at\n")
+        f.write('800001,800001,"hello, bulk",\n')
+        f.write("800002,800002,second,2024-01-02T03:04:05\n")
+    likes = tmp_path / "likes.ndjson"
+    likes.write_text("\n".join(
+        json.dumps({"user_id": uid, "tweet_id": 800001}) for uid in (800002, 800003)
+    ))
+    tweet_media = tmp_path / "tweet_media.ndjson"
+    tweet_media.write_text(json.dumps({"tweet_id": 800001, "media_id": 1, "position": 0}))
+    follows = tmp_path / "follows.ndjson"
+    follows.write_text(json.dumps({"follower_id": 800002, "following_id": 800001}))
+
+    engine = setup_test_db["engine"]
+    report = asyncio.run(bulk_import(engine, {
+        "users": str(users), "tweets": str(tweets), "tweet_media": str(tweet_media),
+        "likes": str(likes), "follows": str(follows),
+    }, batch_size=1))
+    assert report["users"]["rows"] == 3
+    assert report["tweets"]["rows"] == 2
+    assert report["likes"]["rows_per_s"] > 0
+
+    async def check():
+        async with setup_test_db["session_maker"]() as s:
+            tweet = await s.get(Tweet, 800001)
+            author = await s.get(Users, 800001)
+            inbox = (await s.execute(
+                select(TimelineEntry.tweet_id).where(TimelineEntry.user_id == 800002)
+            )).scalars().all()
+            other = await s.get(Tweet, 800002)
+            attached = (await s.execute(
+                select(TweetMedia.media_id).where(TweetMedia.tweet_id == 800001)
+            )).scalars().all()
+        async with engine.connect() as conn:
+            indexes = await conn.run_sync(
+                lambda sync_conn: {i["name"] for i in inspect(sync_conn).get_indexes("tweets")}
+            )
+        return tweet, author, set(inbox), other, attached, indexes
+
+    tweet, author, inbox, other, attached, indexes = asyncio.run(check())
+    assert tweet.tweet_data == "hello, bulk"
+    assert tweet.like_count == 2
+    assert tweet.created_at is not None
+    assert other.created_at.year == 2024
+    assert attached == [1]
+    assert author.followers_count == 1
+    assert inbox == {800001, 800002}
+    assert "ix_tweets_like_count_id" in indexes
+
+
+def test_bulk_import_refreshes_only_imported_rows(setup_test_db, tmp_path, monkeypatch):
+    import database.bulk_import
+    import database.timeline
+    from database import Follow, TimelineEntry, Tweet, Users
+    from database.bulk_import import bulk_import
+
+    monkeypatch.setattr(database.bulk_import, "FANOUT_FOLLOWERS_LIMIT", 2)
+    monkeypatch.setattr(database.timeline, "TIMELINE_MAX_ENTRIES", 2)
+    author, follower, newcomer, celebrity = 810001, 810002, 810003, 810004
+    session_maker = setup_test_db["session_maker"]
+
+    async def inboxes():
+        async with session_maker() as s:
+            rows = (await s.execute(select(TimelineEntry.user_id, TimelineEntry.tweet_id))).all()
+        result = {}
+        for user_id, tweet_id in rows:
+            result.setdefault(user_id, set()).add(tweet_id)
+        return result
+
+    async def prepare():
+        async with session_maker() as s:
+            async with s.begin():
+                followers = {author: 1, celebrity: 3}
+                s.add_all([Users(id=uid, name=f"pre{uid}", api_key=f"pre-{uid}",
+                                 followers_count=followers.get(uid, 0))
+                           for uid in (author, follower, newcomer, celebrity, 810005)])
+                s.add_all([Follow(follower_id=a, following_id=b) for a, b in (
+                    (follower, author), (follower, celebrity), (newcomer, celebrity), (810005, celebrity),
+                )])
+                s.add_all([Tweet(id=tid, user_id=author, tweet_data="old") for tid in (810001, 810002)])
+                s.add_all([TimelineEntry(user_id=uid, tweet_id=tid)
+                           for uid in (author, follower) for tid in (810001, 810002)])
+        return await inboxes()
+
+    before = asyncio.run(prepare())
+    tweets = tmp_path / "tweets.ndjson"
+    tweets.write_text("\n".join(json.dumps(t) for t in (
+        {"id": 810003, "user_id": author, "tweet_data": "new"},
+        {"id": 810004, "user_id": celebrity, "tweet_data": "popular"},
+    )))
+    likes = tmp_path / "likes.ndjson"
+    likes.write_text(json.dumps({"user_id": newcomer, "tweet_id": 810001}))
+    follows = tmp_path / "follows.ndjson"
+    follows.write_text(json.dumps({"follower_id": newcomer, "following_id": author}))
+    asyncio.run(bulk_import(setup_test_db["engine"], {
+        "tweets": str(tweets), "likes": str(likes), "follows": str(follows),
+    }))
+
+    async def counters():
+        async with session_maker() as s:
+            return (await s.get(Tweet, 810001)).like_count, (await s.get(Users, author)).followers_count
+
+    after = asyncio.run(inboxes())
+    # чужие ленты не тронуты, новые записи обрезаны, популярный автор не разослан
+    assert {uid: tids for uid, tids in after.items() if uid < 810001} == \
+        {uid: tids for uid, tids in before.items() if uid < 810001}
+    assert after[author] == after[follower] == after[newcomer] == {810002, 810003}
+    assert after[celebrity] == {810004}
+    assert asyncio.run(counters()) == (1, 2)
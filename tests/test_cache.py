@@ -0,0 +1,66 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import pytest
+
+from services.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_and_evicts_lru():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 2, "misses": 2, "size": 1, "maxsize": 2}
+
+
+def test_ttl_cache_coalesces_concurrent_misses():
+    cache = TTLCache(maxsize=10, ttl=10)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "user"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(20)))
+
+    assert asyncio.run(run()) == ["user"] * 20
+    assert len(calls) == 1
+    assert cache.get("key") == "user"
+
+
+def test_ttl_cache_does_not_store_none_and_propagates_errors():
+    cache = TTLCache(maxsize=10, ttl=10)
+
+    async def missing():
+        return None
+
+    async def broken():
+        raise RuntimeError("db down")
+
+    async def run():
+        assert await cache.get_or_load("k", missing) is None
+        with pytest.raises(RuntimeError):
+            await asyncio.gather(cache.get_or_load("x", broken), cache.get_or_load("x", broken))
+
+    asyncio.run(run())
+    assert cache.stats()["size"] == 0
@@ -3,6 +3,7 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import asyncio
+import io
 import pytest
 
 def test_root_serves_index(client):
@@ -36,9 +37,234 @@ def test_get_existing_media(client):
     assert "image" in r.headers.get("content-type", "")
 
 
-def test_get_media_not_found_raises(client):
-    with pytest.raises(Exception):
-        client.get("/api/medias/999")
+def test_get_media_not_found(client):
+    r = client.get("/api/medias/999")
+    assert r.status_code == 404
+
+
+def test_get_media_range_request(client):
+    r = client.get("/api/medias/1", headers={"Range": "bytes=0-3"})
+    assert r.status_code == 206
+    assert r.content == b"jpeg"
+
+
+def test_media_http_caching(client):
+    png = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+    files = {"file": ("img.jpg", png, "image/jpeg")}
+    media_id = client.post("/api/medias", files=files).json()["media_id"]
+
+    r = client.get(f"/api/medias/{media_id}")
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/png"
+    assert "immutable" in r.headers["cache-control"]
+    assert "last-modified" in r.headers
+    etag = r.headers["etag"]
+    assert etag.startswith('"') and len(etag) == 66
+
+    r2 = client.get(f"/api/medias/{media_id}", headers={"If-None-Match": etag})
+    assert r2.status_code == 304
+    assert r2.content == b""
+    assert r2.headers["etag"] == etag
+
+    r3 = client.get(f"/api/medias/{media_id}", headers={"If-None-Match": '"other"'})
+    assert r3.status_code == 200
+
+    r4 = client.get(f"/api/medias/{media_id}", headers={"If-Modified-Since": r.headers["last-modified"]})
+    assert r4.status_code == 304
+
+
+def test_uploaded_html_is_not_served_as_html(client):
+    html = b"<script>alert(document.cookie)</script>"
+    media_id = client.post(
+        "/api/medias", files={"file": ("x.html", html, "text/html")}
+    ).json()["media_id"]
+
+    r = client.get(f"/api/medias/{media_id}")
+    assert r.status_code == 200
+    assert r.content == html
+    assert r.headers["content-type"] == "application/octet-stream"
+    assert r.headers["x-content-type-options"] == "nosniff"
+    assert r.headers["content-disposition"] == "attachment"
+    image = client.get("/api/medias/1")
+    assert image.headers["x-content-type-options"] == "nosniff"
+    assert "content-disposition" not in image.headers
+
+
+def test_media_deduplication_and_refcounted_delete(client, run_jobs):
+    import os
+    from services import media_storage
+
+    headers = {"api-key": "valid"}
+    content = b"GIF89a duplicated meme"
+    first = client.post("/api/medias", files={"file": ("a.gif", content, "image/gif")}).json()
+    second = client.post("/api/medias", files={"file": ("b.gif", content, "image/gif")}).json()
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True
+    assert first["media_id"] != second["media_id"]
+
+    stats = client.get("/api/medias/stats").json()["stats"]
+    assert stats["uploads"] > stats["objects"]
+    assert stats["dedup_ratio"] > 1
+    assert stats["saved_bytes"] >= len(content)
+
+    etag = client.get(f"/api/medias/{first['media_id']}").headers["etag"]
+    path = media_storage.full_path(os.path.join(etag[1:3], etag[3:5], etag.strip('"')))
+    assert os.path.exists(path)
+
+    tids = [
+        client.post("/api/tweets", json={"tweet_data": "meme", "tweet_media_ids": [m["media_id"]]}, headers=headers).json()["tweet_id"]
+        for m in (first, second)
+    ]
+    assert client.delete(f"/api/tweets/{tids[0]}", headers=headers).status_code == 200
+    run_jobs()
+    assert os.path.exists(path)
+    assert client.get(f"/api/medias/{second['media_id']}").content == content
+
+    assert client.delete(f"/api/tweets/{tids[1]}", headers=headers).status_code == 200
+    run_jobs()
+    assert not os.path.exists(path)
+    assert client.get(f"/api/medias/{second['media_id']}").status_code == 404
+
+
+def test_media_attached_once_and_released_only_when_unreferenced(client, setup_test_db, run_jobs):
+    from database import release_media
+
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_user():
+        from database import Users
+        async with session_maker() as s:
+            async with s.begin():
+                s.add(Users(id=61, name="sharer", api_key="key61"))
+
+    asyncio.run(create_user())
+    media_id = client.post("/api/medias", files={"file": ("s.gif", b"GIF89a shared", "image/gif")}).json()["media_id"]
+    first = client.post("/api/tweets", json={"tweet_data": "a", "tweet_media_ids": [media_id]},
+                        headers={"api-key": "valid"}).json()["tweet_id"]
+    r = client.post("/api/tweets", json={"tweet_data": "b", "tweet_media_ids": [media_id]},
+                    headers={"api-key": "key61"})
+    # медиа без владельца досталось тому, кто первым прикрепил его
+    assert r.status_code == 403
+    r = client.post("/api/tweets", json={"tweet_data": "twice", "tweet_media_ids": [media_id]},
+                    headers={"api-key": "valid"})
+    assert r.status_code == 409
+
+    # запоздавшая задача освобождения не трогает медиа, прикреплённое к твиту
+    async def release():
+        async with session_maker() as s:
+            async with s.begin():
+                return await release_media(s, [media_id])
+
+    assert asyncio.run(release()) == []
+    assert client.get(f"/api/medias/{media_id}").status_code == 200
+
+    assert client.delete(f"/api/tweets/{first}", headers={"api-key": "valid"}).status_code == 200
+    run_jobs()
+    assert client.get(f"/api/medias/{media_id}").status_code == 404
+
+
+def test_reupload_during_release_keeps_content(client, setup_test_db, run_jobs, monkeypatch):
+    import hashlib
+    import app
+    from database.media import acquire_media_object, release_media, save_media_variants
+    from services import media_storage
+    from services.images import ImageVariant
+
+    session_maker = setup_test_db["session_maker"]
+    content = b"GIF89a released and uploaded again"
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = media_storage.full_path(os.path.join(sha256[:2], sha256[2:4], sha256))
+    media_id = client.post("/api/medias", files={"file": ("r.gif", content, "image/gif")}).json()["media_id"]
+
+    # release уже снял последнюю ссылку, но до purge пришла повторная загрузка того же содержимого
+    async def release_then_reacquire():
+        async with session_maker() as s:
+            async with s.begin():
+                unreferenced = await release_media(s, [media_id])
+        async with session_maker() as s:
+            async with s.begin():
+                await acquire_media_object(s, await media_storage.save(io.BytesIO(content)))
+        return unreferenced
+
+    assert client.portal.call(release_then_reacquire) == [sha256]
+    client.portal.call(app.job_queue.enqueue, "media.purge", {"sha256": [sha256]})
+    run_jobs()
+    assert os.path.exists(path)
+
+    # purge успел удалить файл между сохранением загрузки и захватом строки
+    add_media = app.add_media
+
+    async def add_media_after_purge(*args, **kwargs):
+        result = await add_media(*args, **kwargs)
+        os.unlink(path)
+        return result
+
+    monkeypatch.setattr(app, "add_media", add_media_after_purge)
+    again = client.post("/api/medias", files={"file": ("r.gif", content, "image/gif")}).json()["media_id"]
+    assert client.get(f"/api/medias/{again}").content == content
+
+    # варианты, посчитанные для уже удалённого содержимого, не сохраняются
+    variant = ImageVariant(10, 10, "variants/missing-10.webp", 1, "image/webp")
+    assert client.portal.call(save_media_variants, "0" * 64, [variant], session_maker) is False
+
+
+def test_tweet_attachments_ownership_and_order(client, setup_test_db):
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_user():
+        from database import Users
+        async with session_maker() as s:
+            async with s.begin():
+                s.add(Users(id=60, name="media_owner", api_key="key60"))
+
+    asyncio.run(create_user())
+    owner = {"api-key": "key60"}
+    upload = lambda name: client.post(
+        "/api/medias", files={"file": (name, name.encode(), "image/png")}, headers=owner
+    ).json()["media_id"]
+    first, second = upload("first.png"), upload("second.png")
+
+    r = client.post("/api/tweets", json={"tweet_data": "stolen", "tweet_media_ids": [first]},
+                    headers={"api-key": "valid"})
+    assert r.status_code == 403
+    r = client.post("/api/tweets", json={"tweet_data": "missing", "tweet_media_ids": [999999]},
+                    headers=owner)
+    assert r.status_code == 404
+
+    tid = client.post("/api/tweets", json={"tweet_data": "album", "tweet_media_ids": [second, first]},
+                      headers=owner).json()["tweet_id"]
+    tweets = client.get("/api/tweets", headers=owner).json()["tweets"]
+    tweet = next(t for t in tweets if t["id"] == tid)
+    assert tweet["attachments"] == [f"/api/medias/{second}", f"/api/medias/{first}"]
+
+
+def test_migrate_media_blobs_moves_legacy_rows(tmp_path):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from database.migrate_media import drop_blob_column, migrate_media_blobs
+    from services import LocalMediaStorage
+
+    legacy_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.sqlite'}")
+    storage = LocalMediaStorage(str(tmp_path / "media"))
+
+    async def run():
+        async with legacy_engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE medias (id INTEGER PRIMARY KEY, file BLOB, created_at DATETIME)"))
+            for i in range(1, 6):
+                await conn.execute(text("INSERT INTO medias (id, file) VALUES (:id, :file)"), {"id": i, "file": b"blob%d" % (i % 2)})
+        moved = await migrate_media_blobs(legacy_engine, storage, batch_size=2)
+        await drop_blob_column(legacy_engine)
+        async with legacy_engine.connect() as conn:
+            rows = (await conn.execute(text("SELECT id, path, size, mime_type FROM medias ORDER BY id"))).all()
+        await legacy_engine.dispose()
+        return moved, rows
+
+    moved, rows = asyncio.run(run())
+    assert moved == 5
+    assert {row.path for row in rows} == {rows[0].path, rows[1].path}
+    assert all(row.size == 5 and row.mime_type == "image/jpeg" for row in rows)
+    with open(storage.full_path(rows[0].path), "rb") as f:
+        assert f.read() == b"blob1"
 
 
 def test_upload_media_and_retrieve(client):
@@ -76,7 +302,7 @@ def test_delete_tweet_flow(client):
     assert r2.status_code == 404
 
 
-def test_like_and_delete_like_flow(client, setup_test_db):
+def test_like_and_delete_like_flow(client, setup_test_db, flush_likes):
     headers = {"api-key": "valid"}
 
     r_create = client.post("/api/tweets", json={"tweet_data": "for like", "tweet_media_ids": []}, headers=headers)
@@ -90,24 +316,100 @@ def test_like_and_delete_like_flow(client, setup_test_db):
     r2 = client.post("/api/tweets/99999/likes", headers=headers)
     assert r2.status_code == 404
 
+    r_again = client.post(f"/api/tweets/{tid}/likes", headers=headers)
+    assert r_again.status_code == 409
+
     session_maker = setup_test_db["session_maker"]
 
-    async def insert_like():
-        from database import Like
+    async def like_count():
+        from database import Tweet
         async with session_maker() as s:
-            async with s.begin():
-                s.add(Like(user_id=1, tweet_id=tid))
-    asyncio.run(insert_like())
+            return (await s.get(Tweet, tid)).like_count
+    flush_likes()
+    assert asyncio.run(like_count()) == 1
 
 
     r3 = client.delete(f"/api/tweets/{tid}/likes", headers=headers)
     assert r3.status_code == 200
     assert r3.json().get("result") is True
 
+    flush_likes()
+    assert asyncio.run(like_count()) == 0
+
     r4 = client.delete("/api/tweets/99999/likes", headers=headers)
     assert r4.status_code == 404
 
 
+def test_reconcile_like_counts(client, setup_test_db, flush_likes):
+    from database import Tweet
+    from database.jobs import reconcile_like_counts
+
+    headers = {"api-key": "valid"}
+    tid = client.post("/api/tweets", json={"tweet_data": "drift", "tweet_media_ids": []}, headers=headers).json()["tweet_id"]
+    assert client.post(f"/api/tweets/{tid}/likes", headers=headers).status_code == 200
+    flush_likes()
+
+    session_maker = setup_test_db["session_maker"]
+
+    async def corrupt_and_reconcile():
+        async with session_maker() as s:
+            (await s.get(Tweet, tid)).like_count = 42
+            await s.commit()
+            fixed = await reconcile_like_counts(s, batch_size=2)
+            s.expire_all()
+            return fixed, (await s.get(Tweet, tid)).like_count
+
+    fixed, count = asyncio.run(corrupt_and_reconcile())
+    assert fixed >= 1
+    assert count == 1
+
+
+def test_concurrent_unfollow_decrements_once_and_reconciles(client, setup_test_db):
+    from sqlalchemy import update
+    from database import Follow, Users
+    from database.jobs import reconcile_followers_counts
+
+    session_maker = setup_test_db["session_maker"]
+
+    async def setup():
+        async with session_maker() as s:
+            async with s.begin():
+                s.add_all([
+                    Users(id=95, name="fan95", api_key="key95"),
+                    Users(id=96, name="idol96", api_key="key96", followers_count=1),
+                ])
+                s.add(Follow(follower_id=95, following_id=96))
+
+    client.portal.call(setup)
+
+    async def unfollow_twice():
+        import httpx
+        from app import app
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            responses = await asyncio.gather(*(
+                http.delete("/api/users/96/follow", headers={"api-key": "key95"}) for _ in range(2)
+            ))
+        return sorted(r.status_code for r in responses)
+
+    async def followers_count():
+        async with session_maker() as s:
+            return (await s.get(Users, 96)).followers_count
+
+    statuses = client.portal.call(unfollow_twice)
+    assert statuses[0] == 200
+    assert client.portal.call(followers_count) == 0
+
+    async def corrupt_and_reconcile():
+        async with session_maker() as s:
+            await s.execute(update(Users).where(Users.id == 96).values(followers_count=7))
+            await s.commit()
+            return await reconcile_followers_counts(s, batch_size=2)
+
+    assert client.portal.call(corrupt_and_reconcile) >= 1
+    assert client.portal.call(followers_count) == 0
+
+
 def test_follow_and_unfollow_flow(client, setup_test_db):
     headers = {"api-key": "valid"}
     session_maker = setup_test_db["session_maker"]
@@ -159,6 +461,389 @@ def test_get_my_profile_and_user_info(client):
 
 
 
+def test_get_tweets_feed_scope_and_pagination(client, setup_test_db, flush_likes):
+    headers = {"api-key": "valid"}
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_users():
+        from database import Users
+        async with session_maker() as s:
+            async with s.begin():
+                s.add(Users(id=10, name="feed_followee", api_key="key10"))
+                s.add(Users(id=11, name="feed_stranger", api_key="key11"))
+
+    asyncio.run(create_users())
+    assert client.post("/api/users/10/follow", headers=headers).status_code == 200
+
+    followee_tid = client.post(
+        "/api/tweets", json={"tweet_data": "followee", "tweet_media_ids": []}, headers={"api-key": "key10"}
+    ).json()["tweet_id"]
+    stranger_tid = client.post(
+        "/api/tweets", json={"tweet_data": "stranger", "tweet_media_ids": []}, headers={"api-key": "key11"}
+    ).json()["tweet_id"]
+
+    assert client.post(f"/api/tweets/{followee_tid}/likes", headers={"api-key": "key11"}).status_code == 200
+    flush_likes()
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/api/tweets", headers=headers, params=params)
+        assert r.status_code == 200
+        j = r.json()
+        assert j["result"] is True
+        assert len(j["tweets"]) <= 2
+        seen.extend(j["tweets"])
+        cursor = j["next_cursor"]
+        if cursor is None:
+            break
+
+    ids = [t["id"] for t in seen]
+    assert len(ids) == len(set(ids))
+    assert ids[0] == followee_tid
+    assert seen[0]["likes"] == [{"user_id": 11, "name": "feed_stranger"}]
+    assert stranger_tid not in ids
+    assert {t["author"]["id"] for t in seen} <= {1, 10}
+
+    assert client.get("/api/tweets", headers=headers, params={"cursor": "bad"}).status_code == 422
+
+
+def test_timeline_fan_out_and_celebrity_read(client, setup_test_db, monkeypatch, run_jobs):
+    import database.timeline
+    from sqlalchemy import select, update
+    from database import TimelineEntry, Users
+
+    monkeypatch.setattr(database.timeline, "TIMELINE_MAX_ENTRIES", 3)
+    headers = {"api-key": "valid"}
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_users():
+        async with session_maker() as s:
+            async with s.begin():
+                s.add(Users(id=20, name="timeline_author", api_key="key20"))
+                s.add(Users(id=21, name="timeline_celebrity", api_key="key21"))
+
+    asyncio.run(create_users())
+    assert client.post("/api/users/20/follow", headers=headers).status_code == 200
+    assert client.post("/api/users/21/follow", headers=headers).status_code == 200
+
+    async def make_celebrity():
+        async with session_maker() as s:
+            async with s.begin():
+                await s.execute(update(Users).where(Users.id == 21).values(followers_count=10 ** 6))
+
+    asyncio.run(make_celebrity())
+
+    def tweet(key, text):
+        r = client.post("/api/tweets", json={"tweet_data": text, "tweet_media_ids": []}, headers={"api-key": key})
+        return r.json()["tweet_id"]
+
+    author_tids = [tweet("key20", f"author {i}") for i in range(4)]
+    celebrity_tid = tweet("key21", "celebrity")
+    run_jobs()
+
+    async def inbox(user_id):
+        async with session_maker() as s:
+            return set((await s.execute(
+                select(TimelineEntry.tweet_id).where(TimelineEntry.user_id == user_id)
+            )).scalars())
+
+    assert celebrity_tid not in asyncio.run(inbox(1))
+    assert asyncio.run(inbox(1)) == set(author_tids[1:])
+
+    r = client.get("/api/timeline", headers=headers, params={"limit": 2})
+    assert r.status_code == 200
+    j = r.json()
+    assert [t["id"] for t in j["tweets"]] == [celebrity_tid, author_tids[3]]
+    r2 = client.get("/api/timeline", headers=headers, params={"limit": 2, "cursor": j["next_cursor"]})
+    assert [t["id"] for t in r2.json()["tweets"]] == [author_tids[2], author_tids[1]]
+
+    assert client.delete(f"/api/tweets/{author_tids[3]}", headers={"api-key": "key20"}).status_code == 200
+    assert author_tids[3] not in asyncio.run(inbox(1))
+
+    assert client.delete("/api/users/20/follow", headers=headers).status_code == 200
+    assert asyncio.run(inbox(1)).isdisjoint(author_tids)
+
+    # задача заполнения, выполненная уже после отписки, ленту не трогает
+    async def late_backfill():
+        from database import backfill_followee_timeline
+        async with session_maker() as s:
+            async with s.begin():
+                await backfill_followee_timeline(s, 1, [20])
+
+    asyncio.run(late_backfill())
+    assert asyncio.run(inbox(1)).isdisjoint(author_tids)
+
+
+def test_parallel_requests_use_independent_sessions(client):
+    import httpx
+    from app import app
+
+    headers = {"api-key": "valid"}
+
+    async def fire():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            reads = [ac.get("/api/users/me", headers=headers) for _ in range(150)]
+            feeds = [ac.get("/api/tweets", headers=headers) for _ in range(50)]
+            writes = [
+                ac.post("/api/tweets", json={"tweet_data": f"parallel {i}", "tweet_media_ids": []}, headers=headers)
+                for i in range(50)
+            ]
+            errors = [ac.get("/api/users/me", headers={"api-key": "invalid"}) for _ in range(50)]
+            return await asyncio.gather(*reads, *feeds, *writes, *errors)
+
+    responses = asyncio.run(fire())
+    statuses = [r.status_code for r in responses]
+    assert statuses[:200] == [200] * 200
+    assert statuses[200:250] == [201] * 50
+    assert statuses[250:] == [401] * 50
+    assert len({r.json()["tweet_id"] for r in responses[200:250]}) == 50
+
+    r = client.get("/api/users/me", headers=headers)
+    assert r.status_code == 200
+
+
+def test_api_key_cache_hits_and_invalidation(client, setup_test_db):
+    from database import Users, api_key_cache
+
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_user():
+        async with session_maker() as s:
+            async with s.begin():
+                s.add(Users(id=30, name="cached", api_key="key30"))
+
+    asyncio.run(create_user())
+    headers = {"api-key": "key30"}
+    assert client.get("/api/users/me", headers=headers).json()["user"]["name"] == "cached"
+    hits = api_key_cache.stats()["hits"]
+    assert client.get("/api/users/me", headers=headers).status_code == 200
+    assert api_key_cache.stats()["hits"] == hits + 1
+
+    async def rotate_key():
+        async with session_maker() as s:
+            async with s.begin():
+                (await s.get(Users, 30)).api_key = "key30-rotated"
+
+    asyncio.run(rotate_key())
+    assert client.get("/api/users/me", headers=headers).status_code == 401
+    assert client.get("/api/users/me", headers={"api-key": "key30-rotated"}).status_code == 200
+
+    stats = client.get("/api/stats/auth-cache").json()["stats"]
+    assert stats["hits"] >= hits + 1
+    assert stats["misses"] >= 1
+
+
+def test_batch_endpoints(client, setup_test_db):
+    from database import Tweet, Users
+
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_users():
+        async with session_maker() as s:
+            async with s.begin():
+                s.add(Users(id=40, name="batch_writer", api_key="key40"))
+                s.add(Users(id=41, name="batch_target", api_key="key41"))
+
+    asyncio.run(create_users())
+    headers = {"api-key": "key40"}
+
+    r = client.post("/api/tweets:batch", json={"tweets": [
+        {"tweet_data": f"batch {i}", "tweet_media_ids": []} for i in range(3)
+    ]}, headers=headers)
+    assert r.status_code == 201
+    tids = [item["tweet_id"] for item in r.json()["results"]]
+    assert len(tids) == 3 and tids == sorted(tids)
+
+    r = client.post("/api/likes:batch", json={"tweet_ids": [tids[0], tids[1], 99999]}, headers=headers)
+    assert r.status_code == 200
+    assert [i["result"] for i in r.json()["results"]] == ["created", "created", "not_found"]
+    r = client.post("/api/likes:batch", json={"tweet_ids": [tids[0], tids[2], tids[2]]}, headers=headers)
+    assert [i["result"] for i in r.json()["results"]] == ["exists", "created"]
+
+    async def like_counts():
+        async with session_maker() as s:
+            return [(await s.get(Tweet, tid)).like_count for tid in tids]
+    assert asyncio.run(like_counts()) == [1, 1, 1]
+
+    r = client.post("/api/follows:batch", json={"user_ids": [41, 40, 99999]}, headers=headers)
+    assert [i["result"] for i in r.json()["results"]] == ["created", "self", "not_found"]
+    r = client.post("/api/follows:batch", json={"user_ids": [41]}, headers=headers)
+    assert r.json()["results"] == [{"user_id": 41, "result": "exists"}]
+
+    async def followers_count():
+        async with session_maker() as s:
+            return (await s.get(Users, 41)).followers_count
+    assert asyncio.run(followers_count()) == 1
+
+    assert client.post("/api/likes:batch", json={"tweet_ids": []}, headers=headers).status_code == 422
+    assert client.post("/api/likes:batch", json={"tweet_ids": [1]}, headers={"api-key": "invalid"}).status_code == 401
+
+
+def test_profile_single_query_with_paginated_lists(client, setup_test_db, run_jobs):
+    from sqlalchemy import event
+    from database import Users
+
+    session_maker = setup_test_db["session_maker"]
+
+    async def create_users():
+        async with session_maker() as s:
+            async with s.begin():
+                for uid in range(50, 54):
+                    s.add(Users(id=uid, name=f"profile{uid}", api_key=f"key{uid}"))
+
+    asyncio.run(create_users())
+    for uid in (51, 52, 53):
+        assert client.post("/api/users/50/follow", headers={"api-key": f"key{uid}"}).status_code == 200
+    assert client.post("/api/users/51/follow", headers={"api-key": "key50"}).status_code == 200
+    # запросы фоновых задач подписки не должны попасть в подсчёт
+    run_jobs()
+
+    statements = []
+    sync_engine = setup_test_db["engine"].sync_engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(sync_engine, "before_cursor_execute", listener)
+    try:
+        r = client.get("/api/users/50", params={"limit": 2})
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", listener)
+    assert r.status_code == 200
+    assert len(statements) == 1
+
+    user = r.json()["user"]
+    assert user["followers"] == [{"id": 51, "name": "profile51"}, {"id": 52, "name": "profile52"}]
+    assert user["following"] == [{"id": 51, "name": "profile51"}]
+    assert user["followers_count"] == 3
+    assert user["following_count"] == 1
+    assert user["following_next_cursor"] is None
+
+    r2 = client.get("/api/users/50", params={"limit": 2, "followers_cursor": user["followers_next_cursor"]})
+    assert r2.json()["user"]["followers"] == [{"id": 53, "name": "profile53"}]
+    assert r2.json()["user"]["followers_next_cursor"] is None
+
+    me = client.get("/api/users/me", headers={"api-key": "key51"}).json()["user"]
+    assert me["following"] == [{"id": 50, "name": "profile50"}]
+    assert me["followers"] == [{"id": 50, "name": "profile50"}]
+
+
+def test_sql_metrics_headers_and_prometheus(client, monkeypatch, caplog):
+    import services.metrics
+
+    r = client.get("/api/tweets", headers={"api-key": "valid"})
+    assert r.status_code == 200
+    timing = r.headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    assert "app;dur=" in timing
+    queries = int(timing.split('desc="')[1].split(" queries")[0])
+    assert queries >= 1
+
+    monkeypatch.setattr(services.metrics, "SLOW_QUERY_MS", 0.0)
+    with caplog.at_level("WARNING", logger="twitterclone.sql.slow"):
+        client.get("/api/users/1")
+    assert any("slow query" in record.getMessage() for record in caplog.records)
+
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    body = metrics.text
+    assert 'http_requests_total{method="GET",route="/api/tweets",status="200"}' in body
+    assert 'db_queries_per_request_bucket{method="GET",route="/api/users/{user_id}",le="+Inf"}' in body
+    assert "http_request_duration_seconds_count" in body
+    assert "# TYPE auth_cache_hits_total counter" in body
+    assert "# TYPE auth_cache_size gauge" in body
+    assert "# TYPE like_buffer_events_total counter" in body
+    assert "# TYPE like_buffer_pending gauge" in body
+    # строки SELECT считаются по результату, а не по внутренностям курсора адаптера
+    rows = {
+        line.split("} ")[0]: int(line.split("} ")[1])
+        for line in body.splitlines() if line.startswith("db_rows_total{")
+    }
+    assert rows['db_rows_total{method="GET",route="/api/users/{user_id}"'] >= 1
+
+
+def test_feed_page_cache_invalidated_by_writes(client):
+    from services import response_cache
+
+    headers = {"api-key": "valid"}
+    first = client.get("/api/tweets", params={"limit": 5}, headers=headers)
+    hits = response_cache.hits
+    assert client.get("/api/tweets", params={"limit": 5}, headers=headers).json() == first.json()
+    assert response_cache.hits == hits + 1
+
+    tid = client.post(
+        "/api/tweets", json={"tweet_data": "fresh", "tweet_media_ids": []}, headers=headers
+    ).json()["tweet_id"]
+    assert client.post(f"/api/tweets/{tid}/likes", headers=headers).status_code == 200
+    tweets = client.get("/api/tweets", params={"limit": 5}, headers=headers).json()["tweets"]
+    fresh = next(t for t in tweets if t["id"] == tid)
+    assert fresh["likes"] == [{"user_id": 1, "name": "name"}]
+
+
+def test_feed_cache_invalidated_only_for_affected_viewers(client, setup_test_db, flush_likes):
+    from database import Follow, Users
+    from services import response_cache
+
+    async def create_users():
+        async with setup_test_db["session_maker"]() as session:
+            async with session.begin():
+                session.add_all([
+                    Users(id=90, name="reader90", api_key="key90"),
+                    Users(id=91, name="author91", api_key="key91"),
+                    Users(id=92, name="stranger92", api_key="key92"),
+                ])
+                session.add(Follow(follower_id=90, following_id=91))
+
+    client.portal.call(create_users)
+    # по версии, а не по попаданиям: страница могла бы и просто истечь по TTL
+    version = lambda user_id: client.portal.call(
+        response_cache.backend.get_version, f"feed:{user_id}:version"
+    )
+    post = lambda key: client.post(
+        "/api/tweets", json={"tweet_data": key, "tweet_media_ids": []}, headers={"api-key": key}
+    ).json()["tweet_id"]
+    before = version(90)
+    # чужие записи и лайки не сбрасывают страницы читателя
+    stranger_tweet = post("key92")
+    assert client.post(f"/api/tweets/{stranger_tweet}/likes", headers={"api-key": "key92"}).status_code == 200
+    flush_likes()
+    assert version(90) == before
+    assert version(92) >= 2
+    # твит того, на кого он подписан, — сбрасывает
+    post("key91")
+    assert version(90) == before + 1
+
+def test_export_ndjson_streams_and_resumes(client):
+    import json
+
+    headers = {"api-key": "valid"}
+    for i in range(3):
+        client.post("/api/tweets", json={"tweet_data": f"export {i}", "tweet_media_ids": []}, headers=headers)
+
+    r = client.get("/api/export/tweets", headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    ids = [row["id"] for row in rows]
+    assert ids == sorted(ids)
+    assert {"id", "user_id", "tweet_data", "like_count"} == set(rows[0])
+
+    resumed = client.get("/api/export/tweets", params={"since_id": ids[-3]}, headers=headers)
+    assert [json.loads(line)["id"] for line in resumed.text.splitlines()] == ids[-2:]
+
+    compressed = client.get(
+        "/api/export/follows", params={"gzip": "true"}, headers=headers
+    )
+    assert compressed.headers["content-encoding"] == "gzip"
+    follows = [json.loads(line) for line in compressed.text.splitlines()]
+    assert all(set(row) == {"id", "follower_id", "following_id"} for row in follows)
+
+    assert client.get("/api/export/medias", headers=headers).status_code == 404
+    assert client.get("/api/export/tweets", headers={"api-key": "invalid"}).status_code == 401
+
+
 def test_get_tweets_route_exists_replace_endpoint(monkeypatch, client):
     import app as app_module
 
@@ -177,4 +862,127 @@ def test_get_tweets_route_exists_replace_endpoint(monkeypatch, client):
     assert r.status_code == 200
     j = r.json()
     assert j.get("result") is True
-    assert isinstance(j.get("tweets"), list)
\ No newline at end of file
+    assert isinstance(j.get("tweets"), list)
+
+def test_reads_routed_to_replica_with_lag_guard(client, setup_test_db, monkeypatch, tmp_path):
+    import shutil
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from database import Users, read_router
+    from services.cache import TTLCache
+
+    async def create_users():
+        async with setup_test_db["session_maker"]() as s:
+            async with s.begin():
+                s.add(Users(id=70, name="replica_writer", api_key="key70"))
+                s.add(Users(id=71, name="replica_target", api_key="key71"))
+
+    asyncio.run(create_users())
+    # реплика — копия базы на этот момент, дальше она «отстаёт»
+    replica_path = tmp_path / "replica.sqlite"
+    shutil.copy(setup_test_db["db_file"], replica_path)
+    replica_engine = create_async_engine(f"sqlite+aiosqlite:///{replica_path}")
+    monkeypatch.setattr(read_router, "replica", async_sessionmaker(bind=replica_engine, expire_on_commit=False))
+    monkeypatch.setattr(read_router, "recent_writers", TTLCache(100, 60))
+    replica_reads = read_router.replica_reads
+
+    assert client.post("/api/users/71/follow", headers={"api-key": "key70"}).status_code == 200
+
+    # только что писавший пользователь читает из основной базы
+    me = client.get("/api/users/me", headers={"api-key": "key70"}).json()["user"]
+    assert [u["id"] for u in me["following"]] == [71]
+    # остальные читают из реплики, где подписки ещё нет
+    assert client.get("/api/users/71").json()["user"]["followers"] == []
+    target = client.get("/api/users/me", headers={"api-key": "key71"}).json()["user"]
+    assert target["followers"] == []
+    # после окна задержки писавший тоже читает из реплики
+    read_router.recent_writers.clear()
+    me = client.get("/api/users/me", headers={"api-key": "key70"}).json()["user"]
+    assert me["following"] == []
+    assert read_router.replica_reads - replica_reads == 3
+
+    # медиа, которого ещё нет в реплике, берётся из основной базы
+    media_id = client.post(
+        "/api/medias", files={"file": ("r.bin", b"replica-lag", "application/octet-stream")}
+    ).json()["media_id"]
+    r = client.get(f"/api/medias/{media_id}")
+    assert r.status_code == 200
+    assert r.content == b"replica-lag"
+
+    client.portal.call(replica_engine.dispose)
+
+
+def test_search_tweets_ranked_paginated_and_synced(client):
+    headers = {"api-key": "valid"}
+    texts = [
+        "searchable kangaroo alpha",
+        "searchable kangaroo kangaroo kangaroo beta",
+        "searchable wombat",
+        "Searchable KANGAROO gamma",
+    ]
+    ids = [
+        client.post("/api/tweets", json={"tweet_data": text, "tweet_media_ids": []}, headers=headers).json()["tweet_id"]
+        for text in texts
+    ]
+
+    r = client.get("/api/tweets/search", params={"q": "kangaroo"}, headers=headers)
+    assert r.status_code == 200
+    found = [t["id"] for t in r.json()["tweets"]]
+    assert set(found) == {ids[0], ids[1], ids[3]}
+    # чаще встречающееся слово — выше
+    assert found[0] == ids[1]
+
+    pages, cursor = [], None
+    while True:
+        params = {"q": "searchable kangaroo", "limit": 1}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/api/tweets/search", params=params, headers=headers).json()
+        pages += [t["id"] for t in page["tweets"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert pages == found
+
+    # удалённый твит пропадает из индекса, спецсимволы запроса не ломают поиск
+    assert client.delete(f"/api/tweets/{ids[1]}", headers=headers).status_code == 200
+    r = client.get("/api/tweets/search", params={"q": 'kangaroo" OR wombat*'}, headers=headers)
+    assert r.status_code == 200
+    assert r.json()["tweets"] == []
+    r = client.get("/api/tweets/search", params={"q": "kangaroo"}, headers=headers)
+    assert {t["id"] for t in r.json()["tweets"]} == {ids[0], ids[3]}
+
+    assert client.get("/api/tweets/search", params={"q": "?!"}, headers=headers).json()["tweets"] == []
+    bad = client.get("/api/tweets/search", params={"q": "x", "cursor": "bad"}, headers=headers)
+    assert bad.status_code == 422
+    assert client.get("/api/tweets/search", params={"q": "x"}).status_code == 422
+
+
+def test_events_pushed_over_websocket(client, flush_likes):
+    from starlette.websockets import WebSocketDisconnect
+
+    headers = {"api-key": "valid"}
+    with pytest.raises(WebSocketDisconnect) as rejected:
+        with client.websocket_connect("/api/events/ws?api_key=invalid"):
+            pass
+    assert rejected.value.code == 1008
+    assert client.get("/api/events").status_code == 401
+
+    with client.websocket_connect("/api/events/ws?api_key=valid") as ws:
+        r = client.post("/api/tweets", json={"tweet_data": "pushed", "tweet_media_ids": []}, headers=headers)
+        tid = r.json()["tweet_id"]
+        created = ws.receive_json()
+        assert created["type"] == "tweet.created"
+        assert created["tweet"]["id"] == tid
+        assert created["tweet"]["content"] == "pushed"
+        assert created["tweet"]["author"] == {"id": 1, "name": "name"}
+
+        # лайк приходит, когда буфер записал его в базу
+        client.post(f"/api/tweets/{tid}/likes", headers=headers)
+        flush_likes()
+        assert ws.receive_json() == {"type": "tweet.likes", "tweet_id": tid, "likes_count": 1}
+
+        client.delete(f"/api/tweets/{tid}", headers=headers)
+        assert ws.receive_json() == {"type": "tweet.deleted", "tweet_id": tid}
+
+    metrics = client.get("/metrics").text
+    assert "events_published" in metrics
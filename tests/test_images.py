@@ -0,0 +1,136 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def _fake_render(data, widths, fmt, quality):
+    return [(width, width // 2, data[:width]) for width in widths]
+
+
+def test_pipeline_writes_variants(tmp_path):
+    from services import ImagePipeline, LocalMediaStorage
+
+    storage = LocalMediaStorage(str(tmp_path))
+
+    async def run():
+        stored = await storage.save(io.BytesIO(b"x" * 1000))
+        with ThreadPoolExecutor(1) as executor:
+            pipeline = ImagePipeline(
+                storage, widths=(100, 200), fmt="webp", executor=executor, render=_fake_render,
+            )
+            assert not pipeline.accepts("application/pdf")
+            assert pipeline.accepts("image/png")
+            variants = await pipeline.process(stored.sha256, stored.path)
+            # ошибка пробрасывается, чтобы очередь повторила задачу
+            with pytest.raises(FileNotFoundError):
+                await pipeline.process("other", "missing/path")
+            await pipeline.shutdown()
+        return variants, pipeline.stats()
+
+    variants, stats = asyncio.run(run())
+    assert stats == {"processed": 1, "failed": 1}
+    assert [(v.width, v.height, v.size, v.mime_type) for v in variants] == [
+        (100, 50, 100, "image/webp"), (200, 100, 200, "image/webp")
+    ]
+    assert (tmp_path / variants[0].path).read_bytes() == b"x" * 100
+
+
+def test_render_variants_resizes_and_strips_metadata():
+    pytest.importorskip("PIL")
+    from PIL import Image
+    from services import render_variants
+
+    exif = Image.Exif()
+    exif[0x010F] = "camera vendor"
+    source = io.BytesIO()
+    Image.new("RGB", (800, 400), "red").save(source, format="JPEG", exif=exif.tobytes())
+
+    rendered = render_variants(source.getvalue(), (320, 640, 1280), "webp", 80)
+    assert [(w, h) for w, h, _ in rendered] == [(320, 160), (640, 320), (800, 400)]
+    for width, height, data in rendered:
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.format == "WEBP"
+            assert image.size == (width, height)
+            assert not image.getexif()
+            assert "exif" not in image.info
+
+
+def test_get_media_serves_nearest_variant(client, run_jobs):
+    pytest.importorskip("PIL")
+    import time
+    from PIL import Image
+
+    source = io.BytesIO()
+    Image.new("RGB", (1000, 500), "blue").save(source, format="PNG")
+    media_id = client.post(
+        "/api/medias", files={"file": ("big.png", source.getvalue(), "image/png")}
+    ).json()["media_id"]
+
+    deadline = time.monotonic() + 60
+    while True:
+        r = client.get(f"/api/medias/{media_id}", params={"size": 300})
+        if r.headers["content-type"] == "image/webp" or time.monotonic() > deadline:
+            break
+        assert r.headers["cache-control"] == "no-cache"
+        time.sleep(0.1)
+
+    assert r.headers["content-type"] == "image/webp"
+    assert r.headers["etag"].endswith('-320"')
+    with Image.open(io.BytesIO(r.content)) as image:
+        assert image.size == (320, 160)
+    # шире самого большого варианта — отдаётся самый широкий (не шире оригинала)
+    r = client.get(f"/api/medias/{media_id}", params={"size": 5000})
+    assert r.headers["etag"].endswith('-1000"')
+    assert client.get(f"/api/medias/{media_id}").headers["content-type"] == "image/png"
+
+    from services import media_storage
+    sha256 = r.headers["etag"].strip('"').rsplit("-", 1)[0]
+    variant_dir = media_storage.full_path(os.path.join("variants", sha256[:2], sha256[2:4]))
+    variant_files = lambda: [name for name in os.listdir(variant_dir) if name.startswith(sha256)]
+    assert len(variant_files()) == 3
+    headers = {"api-key": "valid"}
+    tid = client.post(
+        "/api/tweets", json={"tweet_data": "picture", "tweet_media_ids": [media_id]}, headers=headers
+    ).json()["tweet_id"]
+    assert client.delete(f"/api/tweets/{tid}", headers=headers).status_code == 200
+    run_jobs()
+    assert variant_files() == []
+
+
+def test_reupload_processes_content_without_variants(client, run_jobs, setup_test_db):
+    pytest.importorskip("PIL")
+    from PIL import Image
+    from sqlalchemy import delete
+    from database import MediaVariant
+
+    source = io.BytesIO()
+    Image.new("RGB", (200, 100), "green").save(source, format="PNG")
+    upload = lambda: client.post(
+        "/api/medias", files={"file": ("small.png", source.getvalue(), "image/png")}
+    ).json()["media_id"]
+    media_id = upload()
+    run_jobs()
+    assert client.get(f"/api/medias/{media_id}", params={"size": 100}).headers["etag"].endswith('-200"')
+
+    # обработка первой загрузки потеряна: повторная загрузка того же файла ставит её снова
+    async def drop_variants():
+        async with setup_test_db["session_maker"]() as session:
+            async with session.begin():
+                await session.execute(delete(MediaVariant))
+    client.portal.call(drop_variants)
+    assert client.get(f"/api/medias/{media_id}", params={"size": 100}).headers["cache-control"] == "no-cache"
+    again = upload()
+    run_jobs()
+    for media in (media_id, again):
+        assert client.get(f"/api/medias/{media}", params={"size": 100}).headers["etag"].endswith('-200"')
+
+
+def test_get_media_size_without_variants_serves_original(client):
+    r = client.get("/api/medias/1", params={"size": 100})
+    assert r.status_code == 200
+    assert r.content == b"jpegbytes"
+    assert r.headers["cache-control"] == "no-cache"
+    assert client.get("/api/medias/1", params={"size": 0}).status_code == 422
@@ -0,0 +1,209 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+
+def _flaky_queue(backend, calls, failures):
+    from services.job_queue import JobQueue
+
+    queue = JobQueue(backend, workers=2, max_attempts=3, retry_backoff=0.01, poll_interval=0.05)
+
+    @queue.handler("flaky")
+    async def flaky(payload):
+        calls.append(payload["n"])
+        if calls.count(payload["n"]) <= failures.get(payload["n"], 0):
+            raise RuntimeError("boom")
+
+    return queue
+
+
+def test_memory_queue_retries_deduplicates_and_drains():
+    from services.job_queue import MemoryJobQueueBackend
+
+    backend = MemoryJobQueueBackend()
+    calls = []
+    queue = _flaky_queue(backend, calls, {1: 2, 2: 5})
+
+    async def run():
+        queue.start()
+        await queue.enqueue("flaky", {"n": 1}, key="one")
+        await queue.enqueue("flaky", {"n": 1}, key="one")
+        await queue.enqueue("flaky", {"n": 2})
+        await queue.enqueue("flaky", {"n": 3})
+        await queue.stop(timeout=5)
+
+    asyncio.run(run())
+    # 1 удаётся с третьей попытки, 2 исчерпывает попытки, 3 — с первой
+    assert sorted(calls) == [1, 1, 1, 2, 2, 2, 3]
+    assert [job.payload["n"] for job in backend.failed] == [2]
+    assert queue.stats() == {"workers": 0, "processed": 2, "retried": 4, "failed": 1}
+
+
+def test_enqueue_in_session_waits_for_commit(setup_test_db):
+    from services.job_queue import MemoryJobQueueBackend
+
+    backend = MemoryJobQueueBackend()
+    queue = _flaky_queue(backend, [], {})
+    session_maker = setup_test_db["session_maker"]
+
+    async def run():
+        async with session_maker() as session:
+            await queue.enqueue("flaky", {"n": 1}, session=session)
+            assert await backend.pending() == 0
+            await session.rollback()
+            await queue.enqueue("flaky", {"n": 2}, session=session)
+            await session.commit()
+        return [job.payload["n"] for job in await backend.claim(10)]
+
+    assert asyncio.run(run()) == [2]
+
+
+def test_database_queue_is_transactional_and_recovers_leases(tmp_path):
+    from database import DatabaseJobQueueBackend, QueuedJob, upgrade_schema
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'jobs.sqlite'}")
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    backend = DatabaseJobQueueBackend(session_maker, lease=60)
+    calls = []
+    queue = _flaky_queue(backend, calls, {1: 1, 2: 5})
+
+    async def statuses():
+        async with session_maker() as session:
+            rows = await session.execute(
+                select(QueuedJob.payload, QueuedJob.status, QueuedJob.attempts, QueuedJob.last_error)
+                .order_by(QueuedJob.id)
+            )
+            return [(row.payload["n"], row.status, row.attempts, row.last_error) for row in rows]
+
+    async def run():
+        await upgrade_schema(engine)
+        async with session_maker() as session:
+            await queue.enqueue("flaky", {"n": 0}, session=session)
+            await session.rollback()
+        async with session_maker() as session:
+            await queue.enqueue("flaky", {"n": 1}, key="one", session=session)
+            await queue.enqueue("flaky", {"n": 1}, key="one", session=session)
+            await session.commit()
+        await queue.enqueue("flaky", {"n": 2})
+
+        queue.start()
+        assert await queue.drain(timeout=10)
+        await queue.stop()
+        processed = await statuses()
+
+        # задача упавшего воркера: running с истёкшей арендой снова выдаётся
+        await queue.enqueue("flaky", {"n": 3})
+        stale = await backend.claim(1)
+        assert await backend.claim(1) == []
+        async with session_maker() as session:
+            async with session.begin():
+                await session.execute(
+                    update(QueuedJob).where(QueuedJob.id == stale[0].id)
+                    .values(locked_until=datetime.utcnow() - timedelta(seconds=1))
+                )
+        reclaimed = await backend.claim(1)
+        await engine.dispose()
+        return processed, stale, reclaimed
+
+    processed, stale, reclaimed = asyncio.run(run())
+    assert processed == [
+        (1, "done", 2, "RuntimeError: boom"),
+        (2, "failed", 3, "RuntimeError: boom"),
+    ]
+    assert sorted(calls) == [1, 1, 2, 2, 2]
+    assert reclaimed[0].id == stale[0].id
+    assert reclaimed[0].attempts == 2
+
+
+def test_stop_waits_only_for_own_running_jobs(tmp_path):
+    import time
+    from database import DatabaseJobQueueBackend, QueuedJob, upgrade_schema
+    from services.job_queue import JobQueue
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'stop.sqlite'}")
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    backend = DatabaseJobQueueBackend(session_maker, lease=60)
+    queue = JobQueue(backend, workers=1, poll_interval=0.05)
+    started = asyncio.Event()
+
+    @queue.handler("slow")
+    async def slow(payload):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        await upgrade_schema(engine)
+        # повтор другого процесса, запланированный на будущее, не задерживает остановку
+        await queue.enqueue("slow", {"n": 1})
+        async with session_maker() as session:
+            async with session.begin():
+                await session.execute(
+                    update(QueuedJob).values(run_at=datetime.utcnow() + timedelta(hours=1))
+                )
+        queue.start()
+        began = time.monotonic()
+        await queue.stop(timeout=5)
+        idle_stop = time.monotonic() - began
+
+        # взятая задача прерывается по таймауту и сразу возвращается в очередь
+        await queue.enqueue("slow", {"n": 2})
+        queue.start()
+        await asyncio.wait_for(started.wait(), 5)
+        await queue.stop(timeout=0.1)
+        async with session_maker() as session:
+            rows = (await session.execute(
+                select(QueuedJob.payload, QueuedJob.status, QueuedJob.locked_until).order_by(QueuedJob.id)
+            )).all()
+        await engine.dispose()
+        return idle_stop, [(row.payload["n"], row.status, row.locked_until) for row in rows]
+
+    idle_stop, rows = asyncio.run(run())
+    assert idle_stop < 1
+    assert rows == [(1, "pending", None), (2, "pending", None)]
+
+
+def test_finished_jobs_do_not_pile_up(tmp_path):
+    from database import DatabaseJobQueueBackend, QueuedJob, upgrade_schema
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'sweep.sqlite'}")
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    backend = DatabaseJobQueueBackend(session_maker, lease=60, retention=3600)
+    queue = _flaky_queue(backend, [], {2: 5})
+
+    async def remaining():
+        async with session_maker() as session:
+            rows = await session.execute(
+                select(QueuedJob.payload, QueuedJob.status).order_by(QueuedJob.id)
+            )
+            return [(row.payload["n"], row.status) for row in rows]
+
+    async def run():
+        await upgrade_schema(engine)
+        for n in range(5):
+            await queue.enqueue("flaky", {"n": n + 10})
+        await queue.enqueue("flaky", {"n": 1}, key="one")
+        await queue.enqueue("flaky", {"n": 2})
+        queue.start()
+        assert await queue.drain(timeout=10)
+        await queue.stop()
+        # без ключа выполненные задачи удаляются сразу
+        finished = await remaining()
+
+        # ключ и ошибка хранятся retention секунд, затем их удаляет sweep
+        assert await backend.sweep() == 0
+        async with session_maker() as session:
+            async with session.begin():
+                await session.execute(
+                    update(QueuedJob).values(run_at=datetime.utcnow() - timedelta(hours=2))
+                )
+        swept = await backend.sweep()
+        left = await remaining()
+        await engine.dispose()
+        return finished, swept, left
+
+    finished, swept, left = asyncio.run(run())
+    assert finished == [(1, "done"), (2, "failed")]
+    assert swept == 2
+    assert left == []
@@ -0,0 +1,23 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import json
+
+import services.json_response
+from database.payloads import AuthorPayload, LikePayload, TweetPayload
+from services.json_response import dumps
+
+
+def test_dumps_payloads_with_and_without_orjson(monkeypatch):
+    content = {"result": True, "tweets": [
+        TweetPayload(1, "привет", None, AuthorPayload(2, "автор"), [LikePayload(3, "x")]),
+    ]}
+    expected = {"result": True, "tweets": [{
+        "id": 1, "content": "привет", "attachments": None,
+        "author": {"id": 2, "name": "автор"}, "likes": [{"user_id": 3, "name": "x"}],
+    }]}
+    assert json.loads(dumps(content)) == expected
+
+    monkeypatch.setattr(services.json_response, "orjson", None)
+    assert json.loads(dumps(content)) == expected
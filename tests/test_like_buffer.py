@@ -0,0 +1,156 @@
+import asyncio
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+
+def test_like_buffer_coalesces_toggles_and_flushes_on_stop(tmp_path):
+    from database import Like, LikeBuffer, Tweet, Users, get_like_state, upgrade_schema
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'likes.sqlite'}")
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    buffer = LikeBuffer(session_maker, flush_interval=60, max_events=2)
+    flushed = []
+
+    async def on_flush(tweet_ids, user_ids):
+        flushed.append((buffer.stats()["written"], sorted(tweet_ids), user_ids))
+
+    buffer.on_flush = on_flush
+
+    async def snapshot():
+        async with session_maker() as session:
+            likes = (await session.execute(
+                select(Like.user_id, Like.tweet_id).order_by(Like.user_id, Like.tweet_id)
+            )).all()
+            counts = (await session.execute(
+                select(Tweet.id, Tweet.like_count).order_by(Tweet.id)
+            )).all()
+        return [tuple(row) for row in likes], dict(counts)
+
+    async def run():
+        await upgrade_schema(engine)
+        async with session_maker() as session:
+            async with session.begin():
+                session.add_all([Users(id=i, name=f"u{i}", api_key=f"k{i}") for i in (1, 2, 3)])
+                session.add_all([Tweet(id=i, user_id=1, tweet_data=f"t{i}") for i in (1, 2, 3)])
+                session.add(Like(user_id=3, tweet_id=2))
+                await session.flush()
+                await session.execute(Tweet.__table__.update().where(Tweet.id == 2).values(like_count=1))
+
+        async with session_maker() as session:
+            assert await get_like_state(session, 3, 2) is True
+            assert await get_like_state(session, 1, 2) is False
+            assert await get_like_state(session, 1, 404) is None
+
+        # лайк, снятие и снова лайк схлопываются в одну вставку
+        assert buffer.record(1, 1, True, persisted=False)
+        assert not buffer.record(1, 1, True, persisted=False)
+        assert buffer.record(1, 1, False, persisted=False)
+        assert buffer.record(1, 1, True, persisted=False)
+        assert buffer.record(2, 1, True, persisted=False)
+        assert buffer.record(3, 2, False, persisted=True)
+        assert buffer.state(3, 2, persisted=True) is False
+        assert buffer.has_pending(1) and not buffer.has_pending(4)
+        assert await snapshot() == ([(3, 2)], {1: 0, 2: 1, 3: 0})
+
+        await buffer.sync_user(1)
+        assert not buffer.has_pending(1)
+        after_sync = await snapshot()
+
+        # твит удалён, пока лайк ждал записи: лайк пропускается
+        buffer.start()
+        buffer.record(1, 3, True, persisted=False)
+        async with session_maker() as session:
+            async with session.begin():
+                await session.execute(delete(Tweet).where(Tweet.id == 3))
+        buffer.record(2, 2, True, persisted=False)
+        await buffer.stop()
+        final = await snapshot()
+        await engine.dispose()
+        return after_sync, final
+
+    after_sync, final = asyncio.run(run())
+    assert after_sync == ([(1, 1), (2, 1)], {1: 2, 2: 0, 3: 0})
+    # при остановке остаток буфера записан
+    assert final == ([(1, 1), (2, 1), (2, 2)], {1: 2, 2: 1})
+    assert flushed == [(3, [1, 2], [1, 2, 3]), (4, [2], [1, 2])]
+    assert buffer.stats() == {"pending": 0, "events": 7, "written": 4, "flushes": 2}
+
+
+def test_record_persisted_rereads_after_concurrent_flush(tmp_path, monkeypatch):
+    import importlib
+    from database import LikeBuffer, Tweet, Users, upgrade_schema
+
+    # database.like_buffer — экземпляр буфера, модуль берётся по имени
+    like_buffer_module = importlib.import_module("database.like_buffer")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'race.sqlite'}")
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    buffer = LikeBuffer(session_maker, flush_interval=60)
+    get_like_state = like_buffer_module.get_like_state
+    reads = []
+
+    async def stale_read(session, user_id, tweet_id):
+        # первое чтение видит базу до сброса, который завершается, пока ответ в пути
+        persisted = await get_like_state(session, user_id, tweet_id)
+        if not reads:
+            await buffer.flush()
+        reads.append(persisted)
+        return persisted
+
+    monkeypatch.setattr(like_buffer_module, "get_like_state", stale_read)
+
+    async def run():
+        await upgrade_schema(engine)
+        async with session_maker() as session:
+            async with session.begin():
+                session.add(Users(id=1, name="u1", api_key="k1"))
+                session.add(Tweet(id=1, user_id=1, tweet_data="t1"))
+        assert buffer.record(1, 1, True, persisted=False)
+        # повторный лайк распознаётся, хотя первое чтение устарело
+        repeated = await buffer.record_persisted(1, 1, True)
+        missing = await buffer.record_persisted(1, 404, True)
+        await engine.dispose()
+        return repeated, missing
+
+    assert asyncio.run(run()) == (False, None)
+    assert reads == [False, True, None]
+
+
+def test_sync_user_waits_for_on_flush(tmp_path):
+    from database import LikeBuffer, Tweet, Users, upgrade_schema
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'bump.sqlite'}")
+    session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+    buffer = LikeBuffer(session_maker, flush_interval=60)
+    bumping = asyncio.Event()
+    release = asyncio.Event()
+    bumped = []
+
+    async def on_flush(tweet_ids, user_ids):
+        bumping.set()
+        await release.wait()
+        bumped.extend(user_ids)
+
+    buffer.on_flush = on_flush
+
+    async def run():
+        await upgrade_schema(engine)
+        async with session_maker() as session:
+            async with session.begin():
+                session.add(Users(id=1, name="u1", api_key="k1"))
+                session.add(Tweet(id=1, user_id=1, tweet_data="t1"))
+        buffer.record(1, 1, True, persisted=False)
+        # фоновый сброс уже записал лайк, но ещё не сбросил кэш ленты
+        background = asyncio.create_task(buffer.flush())
+        await bumping.wait()
+        sync = asyncio.create_task(buffer.sync_user(1))
+        await asyncio.sleep(0.01)
+        assert not sync.done()
+        release.set()
+        await sync
+        synced = list(bumped)
+        await background
+        await engine.dispose()
+        return synced
+
+    assert asyncio.run(run()) == [1]
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+
+def test_events_routed_by_topic_and_slow_consumers_dropped():
+    from services import HEARTBEAT, EventBroker, MemoryEventBackend
+
+    async def run():
+        broker = EventBroker(MemoryEventBackend(), queue_size=2, heartbeat=60)
+        await broker.start()
+        # простаивающие соединения не получают чужих событий и ничего не стоят при публикации
+        idle = [broker.subscribe(user_id, []) for user_id in range(100, 20100)]
+        reader = broker.subscribe(1, [2])
+        author = broker.subscribe(2, [])
+
+        await broker.publish(2, {"type": "tweet.created", "tweet_id": 10})
+        await broker.publish(3, {"type": "tweet.created", "tweet_id": 11})
+        assert json.loads(await reader.get()) == {"type": "tweet.created", "tweet_id": 10}
+        assert json.loads(await author.get()) == {"type": "tweet.created", "tweet_id": 10}
+        assert broker.stats()["delivered"] == 2
+
+        # подписка меняет темы открытого соединения без переподключения
+        await broker.publish_follow(1, 3, True)
+        await broker.publish_follow(1, 2, False)
+        await broker.publish(3, {"type": "tweet.deleted", "tweet_id": 11})
+        await broker.publish(2, {"type": "tweet.deleted", "tweet_id": 10})
+        assert json.loads(await reader.get()) == {"type": "tweet.deleted", "tweet_id": 11}
+        assert reader.topics == {"1", "3"}
+
+        # автор не читает свою очередь: после queue_size событий он отключается
+        for tweet_id in range(3):
+            await broker.publish(2, {"type": "tweet.likes", "tweet_id": tweet_id, "likes_count": 1})
+        assert author.dropped and await author.get() is None
+        assert broker.stats()["dropped"] == 1
+
+        reader.heartbeat()
+        assert await reader.get() == HEARTBEAT
+        stats = broker.stats()
+        await broker.stop()
+        assert await reader.get() is None
+        return stats, len(idle)
+
+    stats, idle = asyncio.run(run())
+    assert stats["subscribers"] == idle + 1
+    assert stats["published"] == 7
+
+
+def test_sse_stream_frames_events_and_ends_on_stop(monkeypatch):
+    import app
+    from services import EventBroker, MemoryEventBackend
+
+    broker = EventBroker(MemoryEventBackend(), heartbeat=0.01)
+    monkeypatch.setattr(app, "event_broker", broker)
+
+    async def run():
+        await broker.start()
+        frames = app.sse_events(broker.subscribe(1, []))
+        assert await frames.__anext__() == b"retry: 3000\n\n"
+        assert await frames.__anext__() == b": keepalive\n\n"
+        await broker.publish(1, {"type": "tweet.deleted", "tweet_id": 5})
+        assert await frames.__anext__() == b'data: {"type":"tweet.deleted","tweet_id":5}\n\n'
+        await broker.stop()
+        assert [frame async for frame in frames] == []
+
+    asyncio.run(run())
+    assert broker.stats()["subscribers"] == 0
+
+
+def test_backend_errors_do_not_fail_committed_writes(client, setup_test_db, monkeypatch, caplog):
+    import app
+    from database import Users
+    from services import EventBroker, MemoryEventBackend
+
+    async def create_user():
+        async with setup_test_db["session_maker"]() as session:
+            async with session.begin():
+                session.add(Users(id=80, name="events80", api_key="key80"))
+
+    client.portal.call(create_user)
+
+    class BrokenBackend(MemoryEventBackend):
+        async def publish(self, topic, payload):
+            raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(app, "event_broker", EventBroker(BrokenBackend()))
+    headers = {"api-key": "valid"}
+    with caplog.at_level("ERROR", logger="twitterclone.events"):
+        assert client.post("/api/users/80/follow", headers=headers).status_code == 200
+        assert client.delete("/api/users/80/follow", headers=headers).status_code == 200
+    # событие потеряно, но запись выполнена и ошибка записана в лог
+    assert len([record for record in caplog.records if record.exc_info]) == 2
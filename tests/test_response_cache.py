@@ -0,0 +1,99 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import asyncio
+import time
+
+from services.response_cache import (
+    MemoryResponseCacheBackend,
+    RedisResponseCacheBackend,
+    ResponseCache,
+)
+
+
+class FakeRedis:
+    """Минимальная замена redis.asyncio.Redis: get, set с nx/px, incr, delete."""
+
+    def __init__(self):
+        self.data = {}
+
+    def _alive(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    async def get(self, key):
+        return self._alive(key)
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and self._alive(key) is not None:
+            return None
+        expires = time.monotonic() + px / 1000 if px else None
+        self.data[key] = (value, expires)
+        return True
+
+    async def incr(self, key):
+        value = int(self._alive(key) or 0) + 1
+        self.data[key] = (str(value).encode(), None)
+        return value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+
+def test_response_cache_coalesces_misses_and_bumps_version():
+    cache = ResponseCache(MemoryResponseCacheBackend(maxsize=10, ttl=60), ttl=60)
+    builds = 0
+
+    async def builder():
+        nonlocal builds
+        builds += 1
+        await asyncio.sleep(0.01)
+        return f"page{builds}".encode()
+
+    async def run():
+        pages = await asyncio.gather(*(cache.get_or_build("feed", "1", builder) for _ in range(10)))
+        cached = await cache.get_or_build("feed", "1", builder)
+        await cache.bump("feed")
+        rebuilt = await cache.get_or_build("feed", "1", builder)
+        return pages, cached, rebuilt
+
+    pages, cached, rebuilt = asyncio.run(run())
+    assert set(pages) == {b"page1"}
+    assert cached == b"page1"
+    assert rebuilt == b"page2"
+    assert builds == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_redis_backend_shares_pages_and_lock_between_processes():
+    redis = FakeRedis()
+    # два экземпляра кэша с общим Redis имитируют два воркера
+    first = ResponseCache(RedisResponseCacheBackend(redis), ttl=60, poll_interval=0.005)
+    second = ResponseCache(RedisResponseCacheBackend(redis), ttl=60, poll_interval=0.005)
+    builds = 0
+
+    async def builder():
+        nonlocal builds
+        builds += 1
+        await asyncio.sleep(0.05)
+        return b"page"
+
+    async def run():
+        pages = await asyncio.gather(
+            first.get_or_build("feed", "1", builder),
+            second.get_or_build("feed", "1", builder),
+        )
+        await second.bump("feed")
+        assert await redis.get("feed:version") == b"1"
+        await first.get_or_build("feed", "1", builder)
+        return pages
+
+    assert asyncio.run(run()) == [b"page", b"page"]
+    assert builds == 2
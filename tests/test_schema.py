@@ -0,0 +1,185 @@
+import asyncio
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import select, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
+
+
+def test_migrations_match_models_and_startup_check(tmp_path):
+    from database import Base, SchemaVersionError, check_schema_version, upgrade_schema
+    from database.schema import include_object_for
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'schema.sqlite'}")
+
+    async def run():
+        with pytest.raises(SchemaVersionError):
+            await check_schema_version(engine)
+        await upgrade_schema(engine)
+        await check_schema_version(engine)
+        async with engine.connect() as conn:
+            diff = await conn.run_sync(
+                lambda sync_conn: compare_metadata(
+                    MigrationContext.configure(
+                        sync_conn, opts={"include_object": include_object_for("sqlite")}
+                    ),
+                    Base.metadata,
+                )
+            )
+        await engine.dispose()
+        return diff
+
+    assert asyncio.run(run()) == []
+
+
+def _plan(stmt) -> str:
+    return str(stmt.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+@pytest.mark.parametrize("name, index", [
+    ("likes_of_tweets", "ix_likes_tweet_id_user_id"),
+    ("followers_of_user", "ix_follows_following_id_follower_id"),
+    ("tweets_of_author", "ix_tweets_user_id_id"),
+    ("tweets_by_date", "ix_tweets_created_at"),
+])
+def test_hot_queries_use_indexes(setup_test_db, name, index):
+    from database import Follow, Like, Tweet, Users
+
+    queries = {
+        "likes_of_tweets": select(Like.tweet_id, Like.user_id, Users.name)
+        .join(Users, Like.user_id == Users.id)
+        .where(Like.tweet_id.in_([1, 2, 3])),
+        "followers_of_user": select(Users.id, Users.name)
+        .join(Follow, Follow.follower_id == Users.id)
+        .where(Follow.following_id == 1)
+        .order_by(Users.id),
+        "tweets_of_author": select(Tweet.id).where(Tweet.user_id == 1).order_by(Tweet.id.desc()),
+        "tweets_by_date": select(Tweet.id).order_by(Tweet.created_at.desc()).limit(10),
+    }
+
+    async def explain():
+        async with setup_test_db["engine"].connect() as conn:
+            rows = await conn.execute(text("EXPLAIN QUERY PLAN " + _plan(queries[name])))
+            return " | ".join(row[-1] for row in rows)
+
+    plan = asyncio.run(explain())
+    assert index in plan, plan
+
+
+def test_tweet_media_migration_backfills_arrays(tmp_path):
+    from database import upgrade_schema
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'backfill.sqlite'}")
+
+    async def run():
+        await upgrade_schema(engine, "0004")
+        async with engine.begin() as conn:
+            await conn.execute(text("INSERT INTO users (id, name, api_key) VALUES (1, 'a', 'k')"))
+            for media_id in (1, 2):
+                await conn.execute(text(
+                    "INSERT INTO medias (id, path, mime_type) VALUES (:id, :path, 'image/png')"
+                ), {"id": media_id, "path": f"m{media_id}"})
+            await conn.execute(text(
+                "INSERT INTO tweets (id, user_id, tweet_data, tweet_media_ids) "
+                "VALUES (1, 1, 'album', '[2, 1, 404]'), (2, 1, 'plain', NULL)"
+            ))
+        await upgrade_schema(engine)
+        async with engine.connect() as conn:
+            attached = (await conn.execute(text(
+                "SELECT tweet_id, media_id, position FROM tweet_media ORDER BY tweet_id, position"
+            ))).all()
+            owners = (await conn.execute(text("SELECT user_id FROM medias ORDER BY id"))).scalars().all()
+        await engine.dispose()
+        return attached, owners
+
+    attached, owners = asyncio.run(run())
+    assert [tuple(row) for row in attached] == [(1, 2, 0), (1, 1, 1)]
+    assert owners == [1, 1]
+
+
+def test_tweet_search_migration_indexes_existing_and_new_rows(tmp_path):
+    from sqlalchemy.dialects import postgresql
+    from alembic import command
+    from database import upgrade_schema
+    from database.schema import alembic_config
+    from database.search import search_matches
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'search.sqlite'}")
+
+    async def found(conn, query):
+        matches = search_matches("sqlite", query).subquery()
+        return sorted((await conn.execute(select(matches.c.id))).scalars())
+
+    async def run():
+        await upgrade_schema(engine, "0007")
+        async with engine.begin() as conn:
+            await conn.execute(text("INSERT INTO users (id, name, api_key) VALUES (1, 'a', 'k')"))
+            await conn.execute(text(
+                "INSERT INTO tweets (id, user_id, tweet_data) VALUES (1, 1, 'old Café news')"
+            ))
+        await upgrade_schema(engine)
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO tweets (id, user_id, tweet_data) VALUES (2, 1, 'fresh cafe news')"
+            ))
+            await conn.execute(text("UPDATE tweets SET tweet_data = 'renamed' WHERE id = 1"))
+            await conn.execute(text("UPDATE tweets SET like_count = 5 WHERE id = 2"))
+            results = [await found(conn, "cafe"), await found(conn, "renamed"), await found(conn, "old")]
+            await conn.execute(text("DELETE FROM tweets WHERE id = 2"))
+            results.append(await found(conn, "news"))
+        async with engine.connect() as conn:
+            await conn.run_sync(lambda sync_conn: command.downgrade(alembic_config(sync_conn), "0007"))
+            await conn.commit()
+            tables = (await conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE name LIKE 'tweets_fts%'"
+            ))).scalars().all()
+        await engine.dispose()
+        assert tables == []
+        return results
+
+    assert asyncio.run(run()) == [[2], [1], [], []]
+
+    pg_sql = str(search_matches("postgresql", "cafe").compile(dialect=postgresql.dialect()))
+    assert "tweets.search_vector @@ websearch_to_tsquery" in pg_sql
+
+
+def test_baseline_database_upgrades_with_backfills(tmp_path):
+    from database import upgrade_schema
+    from database.migrate_media import migrate_media_blobs
+    from services import LocalMediaStorage
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'baseline.sqlite'}")
+
+    async def run():
+        # база в том виде, в каком её создавал create_all до миграций
+        await upgrade_schema(engine, "0001")
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "INSERT INTO users (id, name, api_key) VALUES (1, 'a', 'ka'), (2, 'b', 'kb'), (3, 'c', 'kc')"
+            ))
+            await conn.execute(text(
+                "INSERT INTO tweets (id, user_id, tweet_data) VALUES (1, 1, 'one'), (2, 2, 'two')"
+            ))
+            await conn.execute(text("INSERT INTO likes (user_id, tweet_id) VALUES (2, 1), (3, 1)"))
+            await conn.execute(text("INSERT INTO follows (follower_id, following_id) VALUES (3, 1), (2, 1)"))
+            await conn.execute(text("INSERT INTO medias (id, file) VALUES (1, :blob)"), {"blob": b"legacy"})
+        with pytest.raises(RuntimeError, match="migrate_media"):
+            await upgrade_schema(engine)
+        await migrate_media_blobs(engine, LocalMediaStorage(str(tmp_path / "media")))
+        await upgrade_schema(engine)
+        async with engine.connect() as conn:
+            likes = (await conn.execute(text("SELECT like_count FROM tweets ORDER BY id"))).scalars().all()
+            followers = (await conn.execute(text("SELECT followers_count FROM users ORDER BY id"))).scalars().all()
+            inboxes = (await conn.execute(text(
+                "SELECT user_id, tweet_id FROM timeline_entries ORDER BY user_id, tweet_id"
+            ))).all()
+            columns = {row[1] for row in await conn.execute(text("PRAGMA table_info(medias)"))}
+        await engine.dispose()
+        return likes, followers, [tuple(row) for row in inboxes], columns
+
+    likes, followers, inboxes, columns = asyncio.run(run())
+    assert likes == [2, 0]
+    assert followers == [2, 0, 0]
+    assert inboxes == [(1, 1), (2, 1), (2, 2), (3, 1)]
+    assert "file" not in columns and "path" in columns
@@ -0,0 +1,64 @@
+import gzip
+import importlib.util
+import os
+
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+
+def test_precompressed_variants_negotiated_and_cached(tmp_path):
+    from services.static import PrecompressedStaticFiles, accepted_encodings, compress_directory
+
+    source = b"console.log('twitterclone');\n" * 200
+    (tmp_path / "app.ee2cdef2.js").write_bytes(source)
+    (tmp_path / "app.ee2cdef2.js.map").write_bytes(b"{}" * 1000)
+    (tmp_path / "tiny.js").write_bytes(b"1")
+
+    written = {os.path.basename(path) for path in compress_directory(str(tmp_path))}
+    has_brotli = importlib.util.find_spec("brotli") is not None
+    assert written == ({"app.ee2cdef2.js.gz", "app.ee2cdef2.js.br"} if has_brotli else {"app.ee2cdef2.js.gz"})
+
+    app = Starlette(routes=[Mount("/js", PrecompressedStaticFiles(directory=str(tmp_path)))])
+    with TestClient(app) as client:
+        r = client.get("/js/app.ee2cdef2.js", headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip"
+        assert r.headers["content-type"].startswith("text/javascript")
+        assert r.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert r.headers["vary"] == "Accept-Encoding"
+        assert r.content == source
+        gzip_etag = r.headers["etag"]
+
+        r = client.get("/js/app.ee2cdef2.js", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in r.headers
+        assert int(r.headers["content-length"]) == len(source)
+        assert r.headers["etag"] != gzip_etag
+
+        r = client.get(
+            "/js/app.ee2cdef2.js", headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag}
+        )
+        assert r.status_code == 304
+
+        if has_brotli:
+            r = client.get("/js/app.ee2cdef2.js", headers={"Accept-Encoding": "gzip, br"})
+            assert r.headers["content-encoding"] == "br"
+
+        # файл без хэша в имени перепроверяется, карты исходников не отдаются
+        assert client.get("/js/tiny.js").headers["cache-control"] == "no-cache"
+        assert client.get("/js/app.ee2cdef2.js.map").status_code == 404
+
+    assert accepted_encodings("gzip;q=0, br") == {"br"}
+    assert accepted_encodings("*, gzip;q=0") == {"br"}
+    assert gzip.decompress((tmp_path / "app.ee2cdef2.js.gz").read_bytes()) == source
+
+
+def test_index_and_bundle_caching(client):
+    r = client.get("/")
+    assert r.status_code == 200
+    assert r.headers["cache-control"] == "no-cache"
+    assert client.get("/", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+
+    r = client.get("/js/app.ee2cdef2.js")
+    assert r.status_code == 200
+    assert "immutable" in r.headers["cache-control"]
+    assert client.get("/js/app.ee2cdef2.js.map").status_code == 404